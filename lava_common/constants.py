@@ -39,6 +39,21 @@ HTTP_DOWNLOAD_CHUNK_SIZE = 32768
 # Size of the chunks when downloading over scp
 SCP_DOWNLOAD_CHUNK_SIZE = 32768
 
+# Default maximum size of the download cache (in MB)
+DOWNLOAD_CACHE_MAX_SIZE = 10 * 1024
+
+# Default maximum number of parallel downloads in a deploy action
+DOWNLOAD_CONCURRENCY = 4
+
+# Maximum number of chunks queued for the hashing and decompression threads
+DOWNLOAD_QUEUE_SIZE = 256
+
+# Default settings of the git mirror cache: minimal interval between two
+# fetches (in seconds), maximum size (in MB) and age of unused mirrors (in days)
+GIT_CACHE_FETCH_INTERVAL = 300
+GIT_CACHE_MAX_SIZE = 5 * 1024
+GIT_CACHE_MAX_AGE = 30
+
 # dispatcher temporary directory
 # This is distinct from the TFTP daemon directory
 # Files here are for download using the Apache /tmp alias.
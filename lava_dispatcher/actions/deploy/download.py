@@ -22,11 +22,15 @@
 # This class is used for all downloads, including images and individual files for tftp.
 # python2 only
 
+import concurrent.futures
 import contextlib
 import errno
+import itertools
 import math
 import os
+import queue
 import shutil
+import threading
 import time
 import hashlib
 import requests
@@ -39,13 +43,20 @@ from lava_dispatcher.connections.serial import ConnectDevice
 from lava_common.exceptions import InfrastructureError, JobError, LAVABug
 from lava_dispatcher.action import Action, Pipeline
 from lava_dispatcher.logical import Deployment, RetryAction
-from lava_dispatcher.utils.compression import untar_file
+from lava_dispatcher.utils.cache import ArtifactCache
+from lava_dispatcher.utils.compression import (
+    Decompressor,
+    decompress_command_map,
+    untar_file,
+)
 from lava_dispatcher.utils.filesystem import (
     copy_to_lxc,
     lava_lxc_home,
     copy_overlay_to_lxc,
 )
 from lava_common.constants import (
+    DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_QUEUE_SIZE,
     FILE_DOWNLOAD_CHUNK_SIZE,
     HTTP_DOWNLOAD_CHUNK_SIZE,
     SCP_DOWNLOAD_CHUNK_SIZE,
@@ -56,6 +67,115 @@ from lava_dispatcher.actions.boot.u_boot import UBootEnterFastbootAction
 from urllib.parse import quote_plus, urlparse
 
 
+def download_concurrency(dispatcher_config):
+    """
+    Returns the maximum number of parallel downloads, set by the
+    download_concurrency key in dispatcher_config.
+    """
+    try:
+        return int(dispatcher_config["download_concurrency"])
+    except (KeyError, TypeError, ValueError):
+        return DOWNLOAD_CONCURRENCY
+
+
+class DownloadGroup:
+    """
+    Download the resources of consecutive DownloaderActions in parallel.
+    The first action downloads in the main thread while the next ones are
+    downloaded in background threads. When its turn comes, each action waits
+    for its background download.
+    """
+
+    def __init__(self, max_workers):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self.handlers = []
+
+    @classmethod
+    def start(cls, leader, max_end_time):
+        if leader.job is None:
+            return None
+        concurrency = download_concurrency(leader.job.parameters.get("dispatcher"))
+        actions = leader.next_downloads()
+        if concurrency <= 1 or not actions:
+            return None
+
+        group = cls(concurrency - 1)
+        for action in actions:
+            action.group = group
+            handler = action.pipeline.actions[0]
+            # Protocol calls should be made from the main thread
+            if (
+                isinstance(handler, DownloadHandler)
+                and "protocols" not in handler.parameters
+            ):
+                group.handlers.append(handler)
+                handler.prefetch = group.executor.submit(
+                    handler.run_in_background, max_end_time
+                )
+        # The submitted downloads will still run
+        group.executor.shutdown(wait=False)
+        return group
+
+    def cancel(self):
+        for handler in self.handlers:
+            handler.cancelled = True
+
+
+class StreamWorker(threading.Thread):
+    """
+    Process the downloaded chunks in a separate thread.
+    hashlib and the decompressors release the GIL, so the hashing and the
+    decompression run in parallel with the download loop.
+    """
+
+    def __init__(self, name, func):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.queue = queue.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+        self.exc = None
+        self.aborted = False
+        # Statistics
+        self.size = 0
+        self.busy = 0.0
+
+    def run(self):
+        while True:
+            buff = self.queue.get()
+            if buff is None:
+                return
+            # Drain the queue after an error
+            if self.exc is not None or self.aborted:
+                continue
+            start = time.time()
+            try:
+                self.func(buff)
+            except Exception as exc:
+                self.exc = exc
+            self.busy += time.time() - start
+            self.size += len(buff)
+
+    def put(self, buff):
+        if self.exc is not None:
+            raise self.exc
+        self.queue.put(buff)
+
+    def finish(self):
+        self.queue.put(None)
+        self.join()
+        if self.exc is not None:
+            raise self.exc
+
+    def abort(self):
+        self.aborted = True
+        self.queue.put(None)
+        self.join()
+
+    def throughput(self):
+        if not self.busy:
+            return 0.0
+        return self.size / (1024 * 1024 * self.busy)
+
+
 class DownloaderAction(RetryAction):
     """
     The retry pipeline for downloads.
@@ -72,6 +192,7 @@ class DownloaderAction(RetryAction):
         self.key = key  # the key in the parameters of what to download
         self.path = path  # where to download
         self.uniquify = uniquify
+        self.group = None
 
     def populate(self, parameters):
         self.pipeline = Pipeline(parent=self, job=self.job, parameters=parameters)
@@ -99,6 +220,42 @@ class DownloaderAction(RetryAction):
             raise JobError("Unsupported url protocol scheme: %s" % url.scheme)
         self.pipeline.add_action(action)
 
+    def next_downloads(self):
+        """
+        Return the DownloaderActions directly following this action in the
+        same pipeline.
+        """
+        if self.job is None or self.job.pipeline is None:
+            return []
+        pipelines = [self.job.pipeline]
+        while pipelines:
+            actions = pipelines.pop().actions
+            for (index, action) in enumerate(actions):
+                if action is self:
+                    return list(
+                        itertools.takewhile(
+                            lambda a: isinstance(a, DownloaderAction),
+                            actions[index + 1 :],
+                        )
+                    )
+                if action.pipeline is not None:
+                    pipelines.append(action.pipeline)
+        return []
+
+    def run(self, connection, max_end_time):
+        # Start the next downloads in the background, unless this action is
+        # already part of a group
+        if self.group is None:
+            self.group = DownloadGroup.start(self, max_end_time)
+        try:
+            return super().run(connection, max_end_time)
+        except BaseException:
+            if self.group is not None:
+                self.group.cancel()
+            raise
+        finally:
+            self.group = None
+
 
 class DownloadHandler(Action):
     """
@@ -116,8 +273,14 @@ class DownloadHandler(Action):
     summary = "download-action"
     timeout_exception = InfrastructureError
 
-    # Supported decompression commands
-    decompress_command_map = {"xz": "unxz", "gz": "gunzip", "bz2": "bunzip2"}
+    # Supported decompression commands, only used when the compression is not
+    # supported in-process (see Decompressor)
+    decompress_command_map = {
+        "xz": "unxz",
+        "gz": "gunzip",
+        "bz2": "bunzip2",
+        "zstd": "unzstd",
+    }
 
     def __init__(self, key, path, url, uniquify=True):
         super().__init__()
@@ -130,6 +293,15 @@ class DownloadHandler(Action):
         if uniquify:
             self.path = os.path.join(path, key)
         self.fname = None
+        # Version of the remote resource (etag, modification time, ...) used
+        # to build the download cache key
+        self.cache_version = None
+        # Background download (see DownloadGroup)
+        self.prefetch = None
+        self.cancelled = False
+        # SIGALRM is only delivered to the main thread: in background threads,
+        # the timeout is checked while downloading.
+        self.deadline = None
 
     def reader(self):
         raise LAVABug("'reader' function unimplemented")
@@ -203,7 +375,7 @@ class DownloadHandler(Action):
             self.set_namespace_data(
                 action="download-action", label=self.key, key="overlay", value=overlay
             )
-        if compression and compression not in ["gz", "bz2", "xz", "zip"]:
+        if compression and compression not in decompress_command_map:
             self.errors = "Unknown 'compression' format '%s'" % compression
         if archive and archive not in ["tar"]:
             self.errors = "Unknown 'archive' format '%s'" % archive
@@ -216,6 +388,20 @@ class DownloadHandler(Action):
                 value=self.parameters[self.key].get("type"),
             )
 
+    def _cache_key(self, remote, decompress_command):
+        # Content addressed if the checksum is known, otherwise rely on the
+        # version of the remote resource.
+        if remote.get("sha256sum"):
+            key = "sha256:%s" % remote["sha256sum"]
+        elif remote.get("sha512sum"):
+            key = "sha512:%s" % remote["sha512sum"]
+        elif self.cache_version is not None:
+            key = "%s %s" % (remote["url"], self.cache_version)
+        else:
+            return None
+        # The compressed and decompressed files are different entries
+        return "%s [%s]" % (key, decompress_command or "raw")
+
     def _check_checksum(self, algorithm, actual, expected):
         if expected is None:
             return
@@ -232,7 +418,31 @@ class DownloadHandler(Action):
         self.results = {"fail": {algorithm: expected, "download": actual}}
         raise JobError("%s for '%s' does not match." % (algorithm, self.url.geturl()))
 
+    def run_in_background(self, max_end_time):
+        self.deadline = min(max_end_time, time.time() + self.timeout.duration)
+        try:
+            self.download(None, max_end_time)
+        finally:
+            self.deadline = None
+
     def run(self, connection, max_end_time):
+        if self.prefetch is not None:
+            (future, self.prefetch) = (self.prefetch, None)
+            try:
+                future.result()
+                self.logger.info("%s downloaded in the background", self.key)
+                return super().run(connection, max_end_time)
+            except (InfrastructureError, JobError) as exc:
+                self.logger.warning(
+                    "Background download of %s failed: %s", self.key, str(exc)
+                )
+            except BaseException:
+                self.cancelled = True
+                raise
+        self.cancelled = False
+        return self.download(connection, max_end_time)
+
+    def download(self, connection, max_end_time):
         def progress_unknown_total(downloaded_sz, last_val):
             """ Compute progress when the size is unknown """
             condition = downloaded_sz >= last_val + 25 * 1024 * 1024
@@ -258,9 +468,6 @@ class DownloadHandler(Action):
 
         connection = super().run(connection, max_end_time)
         # self.cookies = self.job.context.config.lava_cookies  # FIXME: work out how to restore
-        md5 = hashlib.md5()  # nosec - not being used for cryptography.
-        sha256 = hashlib.sha256()
-        sha512 = hashlib.sha512()
 
         # Create a fresh directory if the old one has been removed by a previous cleanup
         # (when retrying inside a RetryAction)
@@ -290,6 +497,15 @@ class DownloadHandler(Action):
         sha256sum = remote.get("sha256sum")
         sha512sum = remote.get("sha512sum")
 
+        # Only compute the requested digests
+        hashes = {}
+        if md5sum:
+            hashes["md5"] = hashlib.md5()  # nosec - not being used for cryptography.
+        if sha256sum:
+            hashes["sha256"] = hashlib.sha256()
+        if sha512sum:
+            hashes["sha512"] = hashlib.sha512()
+
         if os.path.isdir(self.fname):
             raise JobError("Download '%s' is a directory, not a file" % self.fname)
         if os.path.exists(self.fname):
@@ -316,9 +532,12 @@ class DownloadHandler(Action):
         if compression:
             if compression in self.decompress_command_map:
                 decompress_command = self.decompress_command_map[compression]
-                self.logger.info(
-                    "Using %s to decompress %s", decompress_command, compression
-                )
+                if Decompressor.supports(compression):
+                    self.logger.info("Decompressing %s in-process", compression)
+                else:
+                    self.logger.info(
+                        "Using %s to decompress %s", decompress_command, compression
+                    )
             else:
                 self.logger.info(
                     "Compression %s specified but not decompressing during download",
@@ -327,20 +546,36 @@ class DownloadHandler(Action):
         else:
             self.logger.debug("No compression specified")
 
-        def update_progress():
-            nonlocal downloaded_size, last_value, md5, sha256, sha512
+        def update_progress(buff):
+            nonlocal downloaded_size, last_value
             downloaded_size += len(buff)
             (printing, new_value, msg) = progress(downloaded_size, last_value)
             if printing:
                 last_value = new_value
+                if self.deadline is not None:
+                    # Downloading in the background: tell which resource
+                    msg = "%s %s" % (self.key, msg)
                 self.logger.debug(msg)
-            md5.update(buff)
-            sha256.update(buff)
-            sha512.update(buff)
+            if self.cancelled:
+                raise JobError("Download of %s cancelled" % self.key)
+            if self.deadline is not None and time.time() > self.deadline:
+                raise self.timeout.exception(
+                    "%s timed out after %d seconds" % (self.name, self.timeout.duration)
+                )
 
-        if compression and decompress_command:
+        def download():
+            """
+            Download in the current thread while the decompression (or the
+            writing) and each digest run in their own thread.
+            Return the workers, for the statistics.
+            """
+            decompressor = None
+            proc = None
             try:
-                with open(self.fname, "wb") as dwnld_file:
+                dwnld_file = open(self.fname, "wb")
+                if decompress_command and Decompressor.supports(compression):
+                    decompressor = Decompressor(compression)
+                elif decompress_command:
                     proc = subprocess.Popen(  # nosec - internal.
                         [decompress_command], stdin=subprocess.PIPE, stdout=dwnld_file
                     )
@@ -349,11 +584,12 @@ class DownloadHandler(Action):
                 self.logger.error(msg)
                 raise InfrastructureError(msg)
 
-            with proc.stdin as pipe:
-                for buff in self.reader():
-                    update_progress()
+            def write(buff):
+                if decompressor is not None:
+                    dwnld_file.write(decompressor.decompress(buff))
+                elif proc is not None:
                     try:
-                        pipe.write(buff)
+                        proc.stdin.write(buff)
                     except BrokenPipeError as exc:
                         error_message = str(exc)
                         self.logger.exception(error_message)
@@ -363,30 +599,120 @@ class DownloadHandler(Action):
                         )
                         self.logger.error(msg)
                         raise JobError(error_message)
-            proc.wait()
-        else:
-            with open(self.fname, "wb") as dwnld_file:
-                for buff in self.reader():
-                    update_progress()
+                else:
                     dwnld_file.write(buff)
 
-        # Log the download speed
-        ending = time.time()
-        self.logger.info(
-            "%dMB downloaded in %0.2fs (%0.2fMB/s)",
-            downloaded_size / (1024 * 1024),
-            round(ending - beginning, 2),
-            round(downloaded_size / (1024 * 1024 * (ending - beginning)), 2),
-        )
+            name = "decompress (%s)" % compression if decompress_command else "write"
+            workers = [StreamWorker(name, write)]
+            workers.extend(StreamWorker(algo, hashes[algo].update) for algo in hashes)
+            with dwnld_file:
+                for worker in workers:
+                    worker.start()
+                try:
+                    for buff in self.reader():
+                        update_progress(buff)
+                        for worker in workers:
+                            worker.put(buff)
+                    for worker in workers:
+                        worker.finish()
+                    if decompressor is not None:
+                        dwnld_file.write(decompressor.flush())
+                except BaseException:
+                    # Do not wait for a blocked decompression command
+                    if proc is not None:
+                        proc.kill()
+                    for worker in workers:
+                        worker.abort()
+                    raise
+                finally:
+                    if proc is not None:
+                        with contextlib.suppress(BrokenPipeError):
+                            proc.stdin.close()
+                        proc.wait()
+            return workers
+
+        # Use the download cache if the resource can be identified
+        cache = ArtifactCache.from_config(self.job.parameters.get("dispatcher"))
+        cache_key = self._cache_key(remote, decompress_command)
+        entry = None
+        if cache is not None and cache_key is not None:
+            entry = cache.entry(cache_key)
+            if not entry.lock(max_end_time, lambda: self.cancelled):
+                if self.cancelled:
+                    raise JobError("Download of %s cancelled" % self.key)
+                self.logger.warning("Unable to lock the download cache entry")
+                entry = None
 
-        # If the remote server uses "Content-Encoding: gzip", this calculation will be wrong
-        # because requests will decompress the file on the fly, creating a larger file than
-        # LAVA expects.
-        if self.size > 0 and self.size != downloaded_size:
-            raise InfrastructureError(
-                "Download finished (%i bytes) but was not expected size (%i bytes), check your networking."
-                % (downloaded_size, self.size)
-            )
+        try:
+            metadata = entry.load() if entry is not None else None
+            if metadata is not None and not set(hashes).issubset(metadata["checksums"]):
+                self.logger.debug("Digests missing from the download cache")
+                metadata = None
+            if metadata is not None:
+                try:
+                    method = entry.materialize(self.fname)
+                except OSError as exc:
+                    self.logger.warning(
+                        "Unable to use the download cache: %s", str(exc)
+                    )
+                    metadata = None
+            if metadata is not None:
+                downloaded_size = metadata["size"]
+                checksums = metadata["checksums"]
+                self.logger.info(
+                    "Cache hit (%s): %d bytes saved (%dMB)",
+                    method,
+                    downloaded_size,
+                    downloaded_size / (1024 * 1024),
+                )
+            else:
+                workers = download()
+
+                # Log the download speed and the throughput of each stage
+                ending = time.time()
+                self.logger.info(
+                    "%dMB downloaded in %0.2fs (%0.2fMB/s)",
+                    downloaded_size / (1024 * 1024),
+                    round(ending - beginning, 2),
+                    round(downloaded_size / (1024 * 1024 * (ending - beginning)), 2),
+                )
+                for worker in workers:
+                    self.logger.debug(
+                        "%s: %0.2fs busy (%0.2fMB/s)",
+                        worker.name,
+                        round(worker.busy, 2),
+                        round(worker.throughput(), 2),
+                    )
+
+                # If the remote server uses "Content-Encoding: gzip", this calculation will be wrong
+                # because requests will decompress the file on the fly, creating a larger file than
+                # LAVA expects.
+                if self.size > 0 and self.size != downloaded_size:
+                    raise InfrastructureError(
+                        "Download finished (%i bytes) but was not expected size (%i bytes), check your networking."
+                        % (downloaded_size, self.size)
+                    )
+                checksums = {algo: hashes[algo].hexdigest() for algo in hashes}
+
+                # Only cache valid downloads
+                if entry is not None and all(
+                    remote.get(algo + "sum") in [None, checksums[algo]]
+                    for algo in checksums
+                ):
+                    try:
+                        entry.store(
+                            self.fname,
+                            {"size": downloaded_size, "checksums": checksums},
+                        )
+                    except OSError as exc:
+                        self.logger.warning(
+                            "Unable to store %s in the download cache: %s",
+                            self.fname,
+                            str(exc),
+                        )
+        finally:
+            if entry is not None:
+                entry.release()
 
         # set the dynamic data into the context
         self.set_namespace_data(
@@ -395,21 +721,10 @@ class DownloadHandler(Action):
         self.set_namespace_data(
             action="download-action", label="file", key=self.key, value=self.fname
         )
-        self.set_namespace_data(
-            action="download-action", label=self.key, key="md5", value=md5.hexdigest()
-        )
-        self.set_namespace_data(
-            action="download-action",
-            label=self.key,
-            key="sha256",
-            value=sha256.hexdigest(),
-        )
-        self.set_namespace_data(
-            action="download-action",
-            label=self.key,
-            key="sha512",
-            value=sha512.hexdigest(),
-        )
+        for (algo, value) in checksums.items():
+            self.set_namespace_data(
+                action="download-action", label=self.key, key=algo, value=value
+            )
 
         # handle archive files
         archive = remote.get("archive", False)
@@ -433,9 +748,9 @@ class DownloadHandler(Action):
                 value=target_fname_path,
             )
 
-        self._check_checksum("md5", md5.hexdigest(), md5sum)
-        self._check_checksum("sha256", sha256.hexdigest(), sha256sum)
-        self._check_checksum("sha512", sha512.hexdigest(), sha512sum)
+        self._check_checksum("md5", checksums.get("md5"), md5sum)
+        self._check_checksum("sha256", checksums.get("sha256"), sha256sum)
+        self._check_checksum("sha512", checksums.get("sha512"), sha512sum)
 
         # certain deployments need prefixes set
         if self.parameters["to"] == "tftp" or self.parameters["to"] == "nbd":
@@ -466,25 +781,9 @@ class DownloadHandler(Action):
         if "lava-xnbd" in self.parameters and nbdroot:
             self.parameters["lava-xnbd"]["nbdroot"] = nbdroot
 
-        self.results = {
-            "label": self.key,
-            "size": downloaded_size,
-            "md5sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="md5"
-                )
-            ),
-            "sha256sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="sha256"
-                )
-            ),
-            "sha512sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="sha512"
-                )
-            ),
-        }
+        self.results = {"label": self.key, "size": downloaded_size}
+        for (algo, value) in checksums.items():
+            self.results[algo + "sum"] = value
         return connection
 
 
@@ -501,7 +800,9 @@ class FileDownloadAction(DownloadHandler):
         super().validate()
         try:
             self.logger.debug("Validating that %s exists", self.url.geturl())
-            self.size = os.stat(self.url.path).st_size
+            stat = os.stat(self.url.path)
+            self.size = stat.st_size
+            self.cache_version = "mtime:%d size:%d" % (stat.st_mtime_ns, stat.st_size)
         except OSError:
             self.errors = "Image file '%s' does not exist or is not readable" % (
                 self.url.path
@@ -569,6 +870,12 @@ class HttpDownloadAction(DownloadHandler):
                     return
 
             self.size = int(res.headers.get("content-length", -1))
+            # Weak etags do not guarantee byte-for-byte identical resources
+            etag = res.headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                self.cache_version = "etag:%s" % etag
+            elif res.headers.get("last-modified"):
+                self.cache_version = "last-modified:%s" % res.headers["last-modified"]
         except requests.Timeout:
             self.logger.error("Request timed out")
             self.errors = "'%s' timed out" % (self.url.geturl())
@@ -32,7 +32,7 @@ from lava_common.exceptions import InfrastructureError, JobError, LAVABug, TestE
 from lava_dispatcher.action import Action, Pipeline
 from lava_dispatcher.actions.test import TestAction
 from lava_dispatcher.utils.strings import indices
-from lava_dispatcher.utils.vcs import GitHelper
+from lava_dispatcher.utils.vcs import GitCache, GitHelper
 from lava_common.constants import DEFAULT_TESTDEF_NAME_CLASS, DISPATCHER_DOWNLOAD_DIR
 
 
@@ -255,7 +255,10 @@ class GitRepoAction(RepoAction):
             self.errors = "Path to YAML file not specified in the job definition"
         if not self.valid:
             return
-        self.vcs = GitHelper(self.parameters["repository"])
+        self.vcs = GitHelper(
+            self.parameters["repository"],
+            GitCache.from_config(self.job.parameters.get("dispatcher")),
+        )
         super().validate()
 
     @classmethod
@@ -871,6 +874,7 @@ class TestInstallAction(TestOverlayAction):
 
     def install_git_repos(self, testdef, runner_path):
         repos = testdef["install"].get("git-repos", [])
+        cache = GitCache.from_config(self.job.parameters.get("dispatcher"))
         for repo in repos:
             commit_id = None
             if isinstance(repo, str):
@@ -879,7 +883,7 @@ class TestInstallAction(TestOverlayAction):
                     ".git", "", len(repo) - 1
                 )  # drop .git from the end, if present
                 dest_path = os.path.join(runner_path, os.path.basename(subdir))
-                commit_id = GitHelper(repo).clone(dest_path)
+                commit_id = GitHelper(repo, cache).clone(dest_path)
             elif isinstance(repo, dict):
                 # TODO: We use 'skip_by_default' to check if this
                 # specific repository should be skipped. The value
@@ -907,7 +911,7 @@ class TestInstallAction(TestOverlayAction):
                         raise TestError(
                             "Cannot mix string and url forms for the same repository."
                         )
-                    commit_id = GitHelper(url).clone(dest_path, branch=branch)
+                    commit_id = GitHelper(url, cache).clone(dest_path, branch=branch)
             else:
                 raise TestError("Unrecognised git-repos block.")
             if commit_id is None:
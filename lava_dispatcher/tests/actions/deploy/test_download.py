@@ -19,6 +19,7 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import concurrent.futures
 import os
 import pytest
 import requests
@@ -29,6 +30,7 @@ from lava_common.exceptions import InfrastructureError, JobError
 from lava_dispatcher.actions.deploy.download import (
     DownloaderAction,
     DownloadHandler,
+    download_concurrency,
     LxcDownloadAction,
     FileDownloadAction,
     HttpDownloadAction,
@@ -653,3 +655,101 @@ def test_http_download_run_compressed(tmpdir):
             }
         }
     }
+
+
+def test_download_concurrency():
+    assert download_concurrency(None) == 4
+    assert download_concurrency({}) == 4
+    assert download_concurrency({"download_concurrency": 1}) == 1
+    assert download_concurrency({"download_concurrency": "8"}) == 8
+
+
+def test_http_download_run_in_background(tmpdir):
+    def reader():
+        yield b"hello"
+        yield b"world"
+
+    action = HttpDownloadAction("dtb", str(tmpdir), urlparse("https://example.com/dtb"))
+    action.job = Job(1234, {"dispatcher": {}}, None)
+    action.url = urlparse("https://example.com/dtb")
+    action.parameters = {
+        "to": "download",
+        "images": {"dtb": {"url": "https://example.com/dtb"}},
+        "namespace": "common",
+    }
+    action.reader = reader
+    action.fname = str(tmpdir / "dtb/dtb")
+
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        action.prefetch = executor.submit(action.run_in_background, 4212)
+        action.run(None, 4212)
+    assert action.prefetch is None
+    with open(str(tmpdir / "dtb/dtb")) as f_in:
+        assert f_in.read() == "helloworld"
+    assert action.get_namespace_data(
+        action="download-action", label="dtb", key="file"
+    ) == str(tmpdir / "dtb/dtb")
+
+    # A cancelled background download is done again in the main thread
+    action.cancelled = True
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        action.prefetch = executor.submit(action.run_in_background, 4212)
+        action.run(None, 4212)
+    assert action.cancelled is False
+    with open(str(tmpdir / "dtb/dtb")) as f_in:
+        assert f_in.read() == "helloworld"
+
+
+def test_http_download_run_requested_digests(tmpdir):
+    def reader():
+        yield b"hello"
+        yield b"world"
+
+    action = HttpDownloadAction("dtb", str(tmpdir), urlparse("https://example.com/dtb"))
+    action.job = Job(1234, {"dispatcher": {}}, None)
+    action.url = urlparse("https://example.com/dtb")
+    action.parameters = {
+        "to": "download",
+        "images": {
+            "dtb": {
+                "url": "https://example.com/dtb",
+                "sha256sum": "936a185caaa266bb9cbe981e9e05cb78cd732b0b3280eb944412bb6f8f8f07af",
+            }
+        },
+        "namespace": "common",
+    }
+    action.reader = reader
+    action.fname = str(tmpdir / "dtb/dtb")
+    action.run(None, 4212)
+    assert dict(action.results) == {
+        "success": {
+            "sha256": "936a185caaa266bb9cbe981e9e05cb78cd732b0b3280eb944412bb6f8f8f07af"
+        },
+        "label": "dtb",
+        "size": 10,
+        "sha256sum": "936a185caaa266bb9cbe981e9e05cb78cd732b0b3280eb944412bb6f8f8f07af",
+    }
+    assert action.data["common"]["download-action"]["dtb"] == {
+        "file": "%s/dtb/dtb" % str(tmpdir),
+        "sha256": "936a185caaa266bb9cbe981e9e05cb78cd732b0b3280eb944412bb6f8f8f07af",
+    }
+
+
+def test_http_download_run_compressed_invalid(tmpdir):
+    def reader():
+        yield b"not an xz file"
+
+    action = HttpDownloadAction(
+        "rootfs", str(tmpdir), urlparse("https://example.com/rootfs.xz")
+    )
+    action.job = Job(1234, {}, None)
+    action.url = urlparse("https://example.com/rootfs.xz")
+    action.parameters = {
+        "to": "download",
+        "rootfs": {"url": "https://example.com/rootfs.xz", "compression": "xz"},
+        "namespace": "common",
+    }
+    action.reader = reader
+    action.fname = str(tmpdir / "rootfs/rootfs")
+    with pytest.raises(JobError):
+        action.run(None, 4212)
@@ -0,0 +1,180 @@
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from lava_common.constants import DOWNLOAD_CACHE_MAX_SIZE
+
+# ioctl used to clone a file (reflink) on btrfs, xfs, ...
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst, hardlink=False):
+    """
+    Make dst a copy of src. Use a hard link if allowed, then a reflink if
+    supported by the filesystem and finally fallback to a plain copy.
+    Return the method that was used.
+    """
+    if hardlink:
+        with contextlib.suppress(OSError):
+            os.link(src, dst)
+            return "hardlink"
+    try:
+        with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        return "reflink"
+    except OSError:
+        shutil.copyfile(src, dst)
+        return "copy"
+
+
+class CacheEntry:
+    """
+    A file in the artifact cache, with its metadata (size and checksums of the
+    downloaded data).
+    The entry should be locked before being read or stored: the first job
+    holding the lock downloads the file while the other jobs wait for it.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        self.data = os.path.join(cache.path, name)
+        self.meta = self.data + ".json"
+        self.lock_file = None
+
+    def lock(self, end_time, cancelled=None):
+        """
+        Wait for the lock until end_time or until cancelled() returns True.
+        Return False if the lock was not taken.
+        """
+        lock_file = open(self.data + ".lock", "a")
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.lock_file = lock_file
+                return True
+            except BlockingIOError:
+                if time.time() >= end_time or (cancelled is not None and cancelled()):
+                    lock_file.close()
+                    return False
+                time.sleep(1)
+
+    def release(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def load(self):
+        """
+        Return the metadata or None if the entry is not in the cache.
+        """
+        try:
+            with open(self.meta, encoding="utf-8") as f_meta:
+                metadata = json.load(f_meta)
+            if os.path.exists(self.data):
+                return metadata
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def materialize(self, fname):
+        method = clone_file(self.data, fname, self.cache.hardlink)
+        # Update the last usage for the LRU
+        with contextlib.suppress(OSError):
+            os.utime(self.meta)
+        return method
+
+    def store(self, fname, metadata):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.data + ".tmp")
+        clone_file(fname, self.data + ".tmp", self.cache.hardlink)
+        with open(self.meta + ".tmp", "w", encoding="utf-8") as f_meta:
+            json.dump(dict(metadata, key=self.key), f_meta)
+        # Rename the data first: the entry is valid once the metadata exists
+        os.rename(self.data + ".tmp", self.data)
+        os.rename(self.meta + ".tmp", self.meta)
+        self.cache.evict()
+
+
+class ArtifactCache:
+    """
+    Worker-local cache of the downloaded artifacts, shared by all the jobs
+    running on the worker. The least recently used entries are evicted when
+    the cache is larger than max_size (in bytes).
+    """
+
+    def __init__(self, path, max_size, hardlink=False):
+        self.path = path
+        self.max_size = max_size
+        self.hardlink = hardlink
+
+    @classmethod
+    def from_config(cls, dispatcher_config):
+        """
+        Return the cache configured in dispatcher_config or None.
+        """
+        try:
+            config = dispatcher_config["download_cache"]
+            path = config["path"]
+        except (KeyError, TypeError):
+            return None
+        max_size = int(config.get("max_size", DOWNLOAD_CACHE_MAX_SIZE)) * 1024 * 1024
+        return cls(path, max_size, bool(config.get("hardlink", False)))
+
+    def entry(self, key):
+        os.makedirs(self.path, 0o755, exist_ok=True)
+        return CacheEntry(self, key)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            data = os.path.join(self.path, name[:-5])
+            try:
+                size = os.stat(data).st_blocks * 512
+                last_usage = os.stat(data + ".json").st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append((last_usage, data, size))
+            total += size
+
+        for (_, data, size) in sorted(entries):
+            if total <= self.max_size:
+                break
+            with open(data + ".lock", "a") as lock_file:
+                # Skip the entries currently used by other jobs
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                # The lock file is kept: removing it would allow two jobs to
+                # lock the same entry through two different files.
+                for suffix in [".json", ""]:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(data + suffix)
+            total -= size
@@ -24,15 +24,24 @@
 # android images: tar + xz,bz2,gz, or just gz,xz,bzip2
 # vexpress recovery images: any compression though usually zip
 
+import bz2
+import lzma
 import os
 import subprocess  # nosec - internal use.
 import tarfile
+import zlib
 
 from lava_common.exceptions import InfrastructureError, JobError
 
 from lava_dispatcher.utils.contextmanager import chdir
 from lava_dispatcher.utils.shell import which
 
+# zstandard is optional: without it, zstd files are decompressed with unzstd
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 # https://www.kernel.org/doc/Documentation/xz.txt
 compress_command_map = {"xz": ["xz", "--check=crc32"], "gz": ["gzip"], "bz2": ["bzip2"]}
@@ -41,6 +50,7 @@ decompress_command_map = {
     "gz": ["gunzip"],
     "bz2": ["bunzip2"],
     "zip": ["unzip"],
+    "zstd": ["unzstd"],
 }
 
 
@@ -95,3 +105,72 @@ def untar_file(infile, outdir):
             tar.extractall(outdir)
     except tarfile.TarError as exc:
         raise JobError("Unable to unpack %s: %s" % (infile, str(exc)))
+
+
+def _zstd_decompressobj():
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+# In-process decompressors, by compression
+decompressobj_map = {
+    "xz": lzma.LZMADecompressor,
+    # Accept the gzip header and trailer
+    "gz": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    "bz2": bz2.BZ2Decompressor,
+}
+# bz2 raises OSError on invalid data
+decompress_errors = (lzma.LZMAError, zlib.error, OSError, EOFError)
+# The decompressors should tell where each stream ends (eof), which old
+# versions of zstandard do not: use unzstd instead.
+if zstandard is not None and hasattr(_zstd_decompressobj(), "eof"):
+    decompressobj_map["zstd"] = _zstd_decompressobj
+    decompress_errors += (zstandard.ZstdError,)
+
+
+class Decompressor:
+    """
+    Decompress a stream in-process, chunk by chunk.
+    Files made of several concatenated streams (pigz, pbzip2, pixz, ...) are
+    supported, as well as the null padding allowed after xz streams.
+    """
+
+    def __init__(self, compression):
+        self.compression = compression
+        self.factory = decompressobj_map[compression]
+        self.obj = self.factory()
+        # Did the current stream consume some data?
+        self.pending = False
+        self.streams = 0
+
+    @classmethod
+    def supports(cls, compression):
+        return compression in decompressobj_map
+
+    def decompress(self, data):
+        output = []
+        while data:
+            if self.streams and not self.pending and not data.strip(b"\0"):
+                # Stream padding
+                break
+            try:
+                output.append(self.obj.decompress(data))
+            except decompress_errors as exc:
+                raise JobError(
+                    "Unable to decompress %s data: %s. Make sure the 'compression' "
+                    "is corresponding to the image file type." % (self.compression, exc)
+                )
+            self.pending = True
+            if not self.obj.eof:
+                break
+            # End of the current stream: the remaining data is the next stream
+            data = self.obj.unused_data
+            self.obj = self.factory()
+            self.pending = False
+            self.streams += 1
+        return b"".join(output)
+
+    def flush(self):
+        truncated = self.pending and not self.obj.eof
+        if truncated or not (self.pending or self.streams):
+            raise JobError("%s stream is truncated" % self.compression)
+        return b""
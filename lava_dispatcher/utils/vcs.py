@@ -18,14 +18,188 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import contextlib
+import fcntl
+import hashlib
 import logging
 import os
 import shutil
 import subprocess  # nosec - internal use.
+import time
 
+from lava_common.constants import (
+    GIT_CACHE_FETCH_INTERVAL,
+    GIT_CACHE_MAX_AGE,
+    GIT_CACHE_MAX_SIZE,
+)
 from lava_common.exceptions import InfrastructureError
 
 
+def _disk_usage(path):
+    total = 0
+    for (root, _, files) in os.walk(path):
+        for fname in files:
+            with contextlib.suppress(OSError):
+                total += os.lstat(os.path.join(root, fname)).st_blocks * 512
+    return total
+
+
+class GitCache:
+    """
+    Worker-local cache of bare mirrors of the git repositories, shared by all
+    the jobs running on the worker.
+    A mirror is fetched at most once every fetch_interval seconds, unless the
+    requested revision is missing. The mirrors unused for max_age seconds are
+    evicted, as well as the least recently used ones when the cache is larger
+    than max_size (in bytes).
+    """
+
+    def __init__(self, path, fetch_interval, max_size, max_age):
+        self.path = os.path.abspath(path)
+        self.fetch_interval = fetch_interval
+        self.max_size = max_size
+        self.max_age = max_age
+
+    @classmethod
+    def from_config(cls, dispatcher_config):
+        """
+        Return the cache configured in dispatcher_config or None.
+        """
+        try:
+            config = dispatcher_config["git_cache"]
+            path = config["path"]
+        except (KeyError, TypeError):
+            return None
+        return cls(
+            path,
+            int(config.get("fetch_interval", GIT_CACHE_FETCH_INTERVAL)),
+            int(config.get("max_size", GIT_CACHE_MAX_SIZE)) * 1024 * 1024,
+            int(config.get("max_age", GIT_CACHE_MAX_AGE)) * 24 * 3600,
+        )
+
+    @contextlib.contextmanager
+    def mirror(self, binary, url, revision=None):
+        """
+        Yield the path to an up to date mirror of url, or None if the mirror
+        cannot be updated. The mirror is not updated while being used.
+        """
+        logger = logging.getLogger("dispatcher")
+        base = os.path.join(self.path, hashlib.sha256(url.encode("utf-8")).hexdigest())
+        try:
+            os.makedirs(self.path, 0o755, exist_ok=True)
+            f_lock = open(base + ".lock", "a")
+        except OSError as exc:
+            logger.warning("Unable to use the git cache: %s", str(exc))
+            yield None
+            return
+
+        updated = False
+        with f_lock:
+            # Jobs can clone from a fresh mirror concurrently
+            fcntl.flock(f_lock, fcntl.LOCK_SH)
+            mirror = base + ".git"
+            stamp = base + ".fetched"
+            if not self._is_fresh(binary, mirror, stamp, revision):
+                # The lock is released while escalating: the mirror might have
+                # been updated in the meantime.
+                fcntl.flock(f_lock, fcntl.LOCK_EX)
+                try:
+                    updated = self._update(binary, url, mirror, stamp, revision)
+                except (OSError, subprocess.CalledProcessError) as exc:
+                    output = getattr(exc, "output", None)
+                    if output:
+                        logger.warning(output.decode("utf-8", errors="replace"))
+                    logger.warning("Unable to update the git mirror of %s", url)
+                    mirror = None
+                fcntl.flock(f_lock, fcntl.LOCK_SH)
+            else:
+                logger.debug("Using the git mirror of %s", url)
+            # Update the last usage for the eviction
+            os.utime(base + ".lock")
+            yield mirror
+        # The cache only grows when a mirror is created or fetched
+        if updated:
+            self.evict()
+
+    def _is_fresh(self, binary, mirror, stamp, revision):
+        if not os.path.isdir(mirror):
+            return False
+        try:
+            fetched = os.stat(stamp).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - fetched < self.fetch_interval and (
+            revision is None or self._has_revision(binary, mirror, revision)
+        )
+
+    def _update(self, binary, url, mirror, stamp, revision):
+        """
+        Create or fetch the mirror, unless fresh. Return True if the mirror
+        was updated.
+        """
+        logger = logging.getLogger("dispatcher")
+        if not os.path.isdir(mirror):
+            logger.debug("Creating the git mirror of %s", url)
+            shutil.rmtree(mirror + ".tmp", ignore_errors=True)
+            subprocess.check_output(  # nosec - internal use.
+                [binary, "clone", "--mirror", url, mirror + ".tmp"],
+                stderr=subprocess.STDOUT,
+            )
+            os.rename(mirror + ".tmp", mirror)
+        elif self._is_fresh(binary, mirror, stamp, revision):
+            logger.debug("Using the git mirror of %s", url)
+            return False
+        else:
+            logger.debug("Updating the git mirror of %s", url)
+            subprocess.check_output(  # nosec - internal use.
+                [binary, "-C", mirror, "fetch", "--prune"], stderr=subprocess.STDOUT
+            )
+        with open(stamp, "w"):
+            pass
+        os.utime(stamp)
+        return True
+
+    def _has_revision(self, binary, mirror, revision):
+        return (
+            subprocess.call(  # nosec - internal use.
+                [binary, "-C", mirror, "cat-file", "-e", "%s^{commit}" % revision],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            == 0
+        )
+
+    def evict(self):
+        now = time.time()
+        mirrors = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".git"):
+                continue
+            base = os.path.join(self.path, name[:-4])
+            try:
+                last_usage = os.stat(base + ".lock").st_mtime
+            except FileNotFoundError:
+                continue
+            mirrors.append((last_usage, base, _disk_usage(base + ".git")))
+        total = sum(size for (_, _, size) in mirrors)
+
+        for (last_usage, base, size) in sorted(mirrors):
+            if total <= self.max_size and now - last_usage <= self.max_age:
+                break
+            # The lock file is kept: removing it would allow two jobs to lock
+            # the same mirror through two different files.
+            with open(base + ".lock", "a") as f_lock:
+                # Skip the mirrors currently used by other jobs
+                try:
+                    fcntl.flock(f_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                shutil.rmtree(base + ".git", ignore_errors=True)
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(base + ".fetched")
+            total -= size
+
+
 class VCSHelper:
     def __init__(self, url):
         self.url = url
@@ -43,20 +217,40 @@ class GitHelper(VCSHelper):
       commit_id = git.clone('destination')
       commit_id = git.clone('destination2, 'hash')
 
+    When a GitCache is given, the repository is cloned from a local mirror.
+
     This helper will raise a InfrastructureError for any error encountered.
     """
 
-    def __init__(self, url):
+    def __init__(self, url, cache=None):
         super().__init__(url)
         self.binary = "/usr/bin/git"
+        self.cache = cache
 
     def clone(self, dest_path, shallow=False, revision=None, branch=None, history=True):
+        if self.cache is None:
+            return self._clone(dest_path, shallow, revision, branch, history)
+        with self.cache.mirror(self.binary, self.url, revision) as mirror:
+            return self._clone(dest_path, shallow, revision, branch, history, mirror)
+
+    def _clone(self, dest_path, shallow, revision, branch, history, mirror=None):
         logger = logging.getLogger("dispatcher")
         try:
+            cmd_args = [self.binary, "clone"]
             if branch is not None:
-                cmd_args = [self.binary, "clone", "-b", branch, self.url, dest_path]
+                cmd_args.extend(["-b", branch])
+            if mirror is None:
+                cmd_args.append(self.url)
+            elif shallow:
+                # git ignores --depth for local clones without file://
+                cmd_args.append("file://" + mirror)
+            elif not history:
+                # .git will be removed: share the objects with the mirror
+                cmd_args.extend(["--shared", mirror])
             else:
-                cmd_args = [self.binary, "clone", self.url, dest_path]
+                # Local clones hard link the objects of the mirror
+                cmd_args.append(mirror)
+            cmd_args.append(dest_path)
 
             if shallow:
                 cmd_args.append("--depth=1")
@@ -66,6 +260,21 @@ class GitHelper(VCSHelper):
                 cmd_args, stderr=subprocess.STDOUT
             )
 
+            if mirror is not None and history:
+                # Point to the real repository and not to the mirror
+                subprocess.check_output(  # nosec - internal use.
+                    [
+                        self.binary,
+                        "-C",
+                        dest_path,
+                        "remote",
+                        "set-url",
+                        "origin",
+                        self.url,
+                    ],
+                    stderr=subprocess.STDOUT,
+                )
+
             if revision is not None:
                 logger.debug("Running '%s checkout %s", self.binary, str(revision))
                 subprocess.check_output(  # nosec - internal use.
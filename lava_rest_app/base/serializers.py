@@ -51,6 +51,9 @@ class TestJobSerializer(serializers.ModelSerializer):
             "multinode_definition",
             "failure_tags",
             "failure_comment",
+            "error_type",
+            "error_msg",
+            "duration",
         )
         extra_kwargs = {
             "id": {"read_only": True},
@@ -71,6 +74,9 @@ class TestJobSerializer(serializers.ModelSerializer):
             "multinode_definition": {"read_only": True},
             "failure_tags": {"read_only": True},
             "failure_comment": {"read_only": True},
+            "error_type": {"read_only": True},
+            "error_msg": {"read_only": True},
+            "duration": {"read_only": True},
         }
 
 
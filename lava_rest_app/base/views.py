@@ -18,6 +18,7 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 import io
+import itertools
 import junit_xml
 import tap
 
@@ -31,10 +32,15 @@ from lava_scheduler_app.models import (
 from lava_scheduler_app.dbutils import testjob_submission
 from lava_scheduler_app.schema import SubmissionException
 from lava_results_app.models import TestCase
-from lava_scheduler_app.logutils import read_logs
+from lava_scheduler_app.logutils import (
+    compute_timings,
+    read_logs,
+    read_timings,
+    stream_logs,
+)
 from linaro_django_xmlrpc.models import AuthToken
 
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 
 from rest_framework import status, viewsets
 from rest_framework.permissions import BasePermission
@@ -138,8 +144,18 @@ class TestJobViewSet(viewsets.ModelViewSet):
         "multinode_definition",
         "failure_tags",
         "failure_comment",
+        "error_type",
+        "error_msg",
+        "duration",
+    )
+    ordering_fields = (
+        "id",
+        "start_time",
+        "end_time",
+        "submit_time",
+        "error_type",
+        "duration",
     )
-    ordering_fields = ("id", "start_time", "end_time", "submit_time")
     filter_class = filters.TestJobFilter
 
     def get_queryset(self):
@@ -200,10 +216,13 @@ class TestJobViewSet(viewsets.ModelViewSet):
         start = safe_str2int(request.query_params.get("start", 0))
         end = safe_str2int(request.query_params.get("end", None))
         try:
-            data = read_logs(self.get_object().output_dir, start, end)
-            if not data:
+            data = stream_logs(self.get_object().output_dir, start, end)
+            first = next(data, None)
+            if not first:
                 raise NotFound()
-            response = HttpResponse(data, content_type="application/yaml")
+            response = StreamingHttpResponse(
+                itertools.chain([first], data), content_type="application/yaml"
+            )
             response["Content-Disposition"] = (
                 "attachment; filename=job_%d.yaml" % self.get_object().id
             )
@@ -277,6 +296,17 @@ class TestJobViewSet(viewsets.ModelViewSet):
         )
         return paginator.get_paginated_response(serializer.data)
 
+    @detail_route(methods=["get"], suffix="timings")
+    def timings(self, request, **kwargs):
+        job = self.get_object()
+        table = read_timings(job.output_dir)
+        if table is None:
+            try:
+                table = compute_timings(job.output_dir)
+            except FileNotFoundError:
+                raise NotFound()
+        return Response(table)
+
     def create(self, request, **kwargs):
         serializer = serializers.TestJobSerializer(data=request.data)
 
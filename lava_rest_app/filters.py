@@ -385,4 +385,7 @@ class TestJobFilter(filters.FilterSet):
                 "endswith",
                 "isnull",
             ],
+            "error_type": ["exact", "in", "isnull"],
+            "error_msg": ["exact", "contains", "icontains", "startswith", "isnull"],
+            "duration": ["exact", "lt", "gt", "isnull"],
         }
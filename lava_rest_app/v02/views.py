@@ -39,6 +39,7 @@ from rest_framework.permissions import DjangoModelPermissions
 from rest_framework_extensions.mixins import NestedViewSetMixin
 from rest_framework.response import Response
 from rest_framework.exceptions import ParseError, PermissionDenied, ValidationError
+from lava_scheduler_app.dbutils import job_report_matrix
 from lava_scheduler_app.models import Alias, Tag
 
 from . import serializers
@@ -234,6 +235,11 @@ class DeviceTypeViewSet(base_views.DeviceTypeViewSet):
                     "Unable to write health check configuration: %s" % exc.strerror
                 )
 
+    @detail_route(methods=["get"], suffix="reports")
+    def reports(self, request, **kwargs):
+        (now, matrix) = job_report_matrix(device_type=self.get_object())
+        return Response(dict(matrix, date=now))
+
     @detail_route(methods=["get", "post"], suffix="template")
     def template(self, request, **kwargs):
         if request.method == "GET":
@@ -287,7 +293,10 @@ class DeviceTypeViewSet(base_views.DeviceTypeViewSet):
 
 
 class DeviceViewSet(base_views.DeviceViewSet):
-    pass
+    @detail_route(methods=["get"], suffix="reports")
+    def reports(self, request, **kwargs):
+        (now, matrix) = job_report_matrix(device=self.get_object())
+        return Response(dict(matrix, date=now))
 
 
 class WorkerViewSet(base_views.WorkerViewSet):
@@ -638,7 +638,7 @@ class ResultsAPI(ExposedAPI):
                 )
 
             test_suite = job.testsuite_set.get(name=suite_name)
-            test_case_count = test_suite.testcase_set.all().count()
+            test_case_count = test_suite.testcase_count("total")
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
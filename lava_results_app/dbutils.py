@@ -25,18 +25,27 @@ import logging
 import decimal
 from urllib.parse import quote
 
-from collections import OrderedDict  # pylint: disable=unused-import
+from collections import Counter, OrderedDict  # pylint: disable=unused-import
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Concat
 
 from lava_common.compat import yaml_load, yaml_safe_load
 from lava_common.version import __version__
 from lava_results_app.models import (
+    RESULT_COUNTERS,
+    RESULT_COUNT_AGGREGATES,
     TestSuite,
     TestSet,
     TestCase,
     TestData,
     ActionData,
     MetaType,
+    NamedTestAttribute,
 )
+from lava_scheduler_app.models import TestJob
 from lava_common.timeout import Timeout
 
 
@@ -70,10 +79,12 @@ def _check_for_testset(result_dict, suite):
 
 
 def append_failure_comment(job, msg):
-    if not job.failure_comment:
-        job.failure_comment = ""
-    job.failure_comment += msg[:256]
-    job.save(update_fields=["failure_comment"])
+    # Append in the database: the job object might be outdated (lava-logs
+    # keeps it for the whole job).
+    TestJob.objects.filter(id=job.id).update(
+        failure_comment=Concat(Coalesce("failure_comment", Value("")), Value(msg[:256]))
+    )
+    job.refresh_from_db(fields=["failure_comment"])
 
 
 def create_metadata_store(results, job):
@@ -108,12 +119,13 @@ def create_metadata_store(results, job):
     return meta_filename
 
 
-def map_scanned_results(results, job, markers, meta_filename):
+def map_scanned_results(results, job, markers, meta_filename, suites=None):
     """
     Sanity checker on the logged results dictionary
     :param results: results logged via the slave
     :param job: the current test job
     :param meta_filename: YAML store for results metadata
+    :param suites: optional cache of the TestSuite objects of this job, by name
     :return: the TestCase object that should be saved to the database.
              None on error.
     """
@@ -139,7 +151,12 @@ def map_scanned_results(results, job, markers, meta_filename):
         append_failure_comment(job, msg)
         metadata = ""
 
-    suite, _ = TestSuite.objects.get_or_create(name=results["definition"], job=job)
+    if suites is None:
+        suites = {}
+    suite = suites.get(results["definition"])
+    if suite is None:
+        suite, _ = TestSuite.objects.get_or_create(name=results["definition"], job=job)
+        suites[results["definition"]] = suite
     testset = _check_for_testset(results, suite)
 
     name = results["case"].strip()
@@ -212,6 +229,76 @@ def map_scanned_results(results, job, markers, meta_filename):
     return test_case
 
 
+def update_result_counters(test_cases):
+    """
+    Increment the counters of the suites and jobs of the given test cases,
+    that were just saved into the database.
+    Counters that were not built yet (NULL) are left untouched.
+    """
+    suites = {}
+    jobs = {}
+    for test_case in test_cases:
+        for (counters, pk) in [
+            (suites, test_case.suite_id),
+            (jobs, test_case.suite.job_id),
+        ]:
+            counter = counters.setdefault(pk, Counter())
+            counter["count_%s" % RESULT_COUNTERS[test_case.result]] += 1
+            counter["count_total"] += 1
+            if test_case.measurement is not None:
+                counter["count_measurement"] += 1
+
+    # Lock the suites before the jobs, like rebuild_result_counters
+    for (model, counters) in [(TestSuite, suites), (TestJob, jobs)]:
+        for pk in sorted(counters):
+            model.objects.filter(pk=pk).update(
+                **{name: F(name) + value for (name, value) in counters[pk].items()}
+            )
+
+
+def rebuild_result_counters(job_ids):
+    """
+    Compute the counters of the given jobs and of their suites from the test
+    cases.
+    """
+    counters = ["count_%s" % name for name in RESULT_COUNT_AGGREGATES]
+    with transaction.atomic():
+        # Lock the rows so the test cases saved concurrently are counted
+        # exactly once: either by this function or by update_result_counters
+        # once the lock is released.
+        list(
+            TestSuite.objects.select_for_update()
+            .filter(job_id__in=job_ids)
+            .values_list("id")
+        )
+        list(
+            TestJob.objects.select_for_update().filter(id__in=job_ids).values_list("id")
+        )
+
+        results = {}
+        query = TestCase.objects.filter(suite__job_id__in=job_ids)
+        query = query.values("suite_id").annotate(
+            **{
+                "count_%s" % name: aggregate
+                for (name, aggregate) in RESULT_COUNT_AGGREGATES.items()
+            }
+        )
+        for item in query.order_by():
+            results[item["suite_id"]] = item
+
+        suites = list(TestSuite.objects.filter(job_id__in=job_ids).only("id", "job_id"))
+        jobs = {pk: TestJob(pk=pk, **{name: 0 for name in counters}) for pk in job_ids}
+        for suite in suites:
+            job = jobs[suite.job_id]
+            for name in counters:
+                value = results.get(suite.id, {}).get(name, 0)
+                setattr(suite, name, value)
+                setattr(job, name, getattr(job, name) + value)
+
+        TestSuite.objects.bulk_update(suites, counters)
+        TestJob.objects.bulk_update(list(jobs.values()), counters)
+
+
 def _add_parameter_metadata(prefix, definition, dictionary, label):
     if "parameters" in definition and isinstance(definition["parameters"], dict):
         for paramkey, paramvalue in definition["parameters"].items():
@@ -343,58 +430,80 @@ def _get_action_metadata(data):
     return retval
 
 
-def build_action(action_data, testdata, submission):
-    # test for a known section
-    logger = logging.getLogger("lava-master")
-    if "section" not in action_data:
-        logger.warning("Invalid action data - missing section")
-        return
-
-    metatype = MetaType.get_section(action_data["section"])
-    if metatype is None:  # 0 is allowed
-        logger.debug("Unrecognised metatype in action_data: %s", action_data["section"])
-        return
-    # lookup the type from the job definition.
-    type_name = MetaType.get_type_name(action_data, submission)
-    if not type_name:
-        logger.debug(
-            "type_name failed for %s metatype %s",
-            action_data["section"],
-            MetaType.TYPE_CHOICES[metatype],
+class ActionMapper:
+    """
+    Map the pipeline actions to ActionData objects, created in bulk.
+    The test cases of the lava suite are indexed by action level and the
+    MetaType objects are cached, so that each action does not run any query.
+    """
+
+    def __init__(self, testdata, submission):
+        self.testdata = testdata
+        self.submission = submission
+        self.meta_types = {}
+        self.test_cases = {}
+        for case in TestCase.objects.filter(
+            suite__job=testdata.testjob, suite__name="lava"
+        ):
+            metadata = case.action_metadata
+            if metadata:
+                self.test_cases[metadata.get("level")] = case
+        self.objects = []
+
+    def get_meta_type(self, name, metatype):
+        key = (name, metatype)
+        if key not in self.meta_types:
+            self.meta_types[key], _ = MetaType.objects.get_or_create(
+                name=name, metatype=metatype
+            )
+        return self.meta_types[key]
+
+    def build_action(self, action_data):
+        # test for a known section
+        logger = logging.getLogger("lava-master")
+        if "section" not in action_data:
+            logger.warning("Invalid action data - missing section")
+            return
+
+        metatype = MetaType.get_section(action_data["section"])
+        if metatype is None:  # 0 is allowed
+            logger.debug(
+                "Unrecognised metatype in action_data: %s", action_data["section"]
+            )
+            return
+        # lookup the type from the job definition.
+        type_name = MetaType.get_type_name(action_data, self.submission)
+        if not type_name:
+            logger.debug(
+                "type_name failed for %s metatype %s",
+                action_data["section"],
+                MetaType.TYPE_CHOICES[metatype],
+            )
+            return
+
+        # maps the static testdata derived from the definition to the runtime pipeline construction
+        self.objects.append(
+            ActionData(
+                action_name=action_data["name"],
+                action_level=action_data["level"],
+                action_summary=action_data["summary"],
+                testdata=self.testdata,
+                action_description=action_data["description"],
+                meta_type=self.get_meta_type(type_name, metatype),
+                max_retries=action_data.get("max_retries"),
+                timeout=int(Timeout.parse(action_data["timeout"])),
+                testcase=self.test_cases.get(action_data["level"]),
+            )
         )
-        return
-    action_meta, _ = MetaType.objects.get_or_create(name=type_name, metatype=metatype)
-    max_retry = action_data.get("max_retries")
-
-    # find corresponding test case
-    match_case = None
-    test_cases = TestCase.objects.filter(
-        suite__job=testdata.testjob, suite__name="lava"
-    )
-    for case in test_cases:
-        if case.action_metadata:
-            if case.action_metadata.get("level") == action_data["level"]:
-                match_case = case
-
-    # maps the static testdata derived from the definition to the runtime pipeline construction
-    ActionData.objects.create(
-        action_name=action_data["name"],
-        action_level=action_data["level"],
-        action_summary=action_data["summary"],
-        testdata=testdata,
-        action_description=action_data["description"],
-        meta_type=action_meta,
-        max_retries=max_retry,
-        timeout=int(Timeout.parse(action_data["timeout"])),
-        testcase=match_case,
-    )
 
+    def walk_actions(self, data):
+        for action in data:
+            self.build_action(action)
+            if "pipeline" in action:
+                self.walk_actions(action["pipeline"])
 
-def walk_actions(data, testdata, submission):
-    for action in data:
-        build_action(action, testdata, submission)
-        if "pipeline" in action:
-            walk_actions(action["pipeline"], testdata, submission)
+    def save(self):
+        ActionData.objects.bulk_create(self.objects)
 
 
 def map_metadata(description, job):
@@ -431,39 +540,44 @@ def map_metadata(description, job):
     if "job" not in description_data:
         logger.warning("[%s] skipping description without a job.", job.id)
         return False
-    action_values = _get_action_metadata(description_data["job"]["actions"])
-    for key, value in action_values.items():
-        if not key or not value:
-            logger.warning("[%s] Missing element in job. %s: %s", job.id, key, value)
-            continue
-        testdata.attributes.create(name=key, value=value)
 
-    # get common job metadata
-    job_metadata = _get_job_metadata(job)
-    for key, value in job_metadata.items():
-        testdata.attributes.create(name=key, value=value)
-
-    # get metadata from device
-    device_values = {}
-    device_values["target.device_type"] = job.requested_device_type
-    for key, value in device_values.items():
-        if not key or not value:
-            logger.warning("[%s] Missing element in device. %s: %s", job.id, key, value)
-            continue
-        testdata.attributes.create(name=key, value=value)
+    attributes = {}
 
-    # Add metadata from job submission data.
-    if "metadata" in submission_data:
-        for key in submission_data["metadata"]:
-            value = submission_data["metadata"][key]
+    def add_attributes(values, kind):
+        for key, value in values.items():
             if not key or not value:
                 logger.warning(
-                    "[%s] Missing element in job. %s: %s", job.id, key, value
+                    "[%s] Missing element in %s. %s: %s", job.id, kind, key, value
                 )
                 continue
-            testdata.attributes.create(name=key, value=value)
+            if key in attributes:
+                logger.warning("[%s] Duplicated metadata: %s", job.id, key)
+                continue
+            attributes[key] = value
+
+    add_attributes(
+        _get_action_metadata(description_data["job"]["actions"]) or {}, "job"
+    )
+    # get common job metadata
+    add_attributes(_get_job_metadata(job), "job")
+    # get metadata from device
+    add_attributes({"target.device_type": job.requested_device_type}, "device")
+    # Add metadata from job submission data.
+    add_attributes(submission_data.get("metadata") or {}, "job")
+
+    content_type = ContentType.objects.get_for_model(testdata)
+    NamedTestAttribute.objects.bulk_create(
+        [
+            NamedTestAttribute(
+                content_type=content_type, object_id=testdata.id, name=key, value=value,
+            )
+            for (key, value) in attributes.items()
+        ]
+    )
 
-    walk_actions(description_data["pipeline"], testdata, submission_data)
+    mapper = ActionMapper(testdata, submission_data)
+    mapper.walk_actions(description_data["pipeline"])
+    mapper.save()
     return True
 
 
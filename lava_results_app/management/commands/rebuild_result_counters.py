@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand
+
+from lava_results_app.dbutils import rebuild_result_counters
+from lava_scheduler_app.models import TestJob
+
+
+class Command(BaseCommand):
+    """
+    Compute the test case counters of the test jobs and suites
+    """
+
+    help = "Rebuild the test case counters of the test jobs and suites"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--job", type=int, action="append", default=[], help="Test job id"
+        )
+        parser.add_argument(
+            "--missing",
+            action="store_true",
+            default=False,
+            help="Only the test jobs without counters",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of test jobs updated in each transaction",
+        )
+
+    def handle(self, *args, **options):
+        query = TestJob.objects.all()
+        if options["job"]:
+            query = query.filter(id__in=options["job"])
+        if options["missing"]:
+            query = query.filter(count_total__isnull=True)
+        job_ids = list(query.order_by("id").values_list("id", flat=True))
+
+        batch_size = options["batch_size"]
+        for index in range(0, len(job_ids), batch_size):
+            rebuild_result_counters(job_ids[index : index + batch_size])
+            self.stdout.write(
+                "%d/%d test jobs"
+                % (min(index + batch_size, len(job_ids)), len(job_ids))
+            )
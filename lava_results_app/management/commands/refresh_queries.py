@@ -17,8 +17,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import sys
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
 from lava_results_app.models import Query, QueryUpdatedError, RefreshLiveQueryError
 
 
@@ -37,6 +42,19 @@ class Command(BaseCommand):
         parser.add_argument(
             "--all", dest="all", action="store_true", help="Refresh all queries"
         )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Evaluate the queries again from scratch instead of only "
+            "appending the new results",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.QUERY_REFRESH_WORKERS,
+            help="Number of queries refreshed in parallel. Default: %d"
+            % settings.QUERY_REFRESH_WORKERS,
+        )
 
     def handle(self, *args, **options):
         if not options["name"] and not options["all"]:
@@ -59,12 +77,22 @@ class Command(BaseCommand):
                     % (query_name, options["username"])
                 )
                 sys.exit(1)
-            self._refresh_query(query)
+            self._refresh_query(query, options["full"])
         else:
-            for query in Query.objects.all().filter(is_live=False, is_archived=False):
-                self._refresh_query(query)
+            queries = Query.objects.all().filter(is_live=False, is_archived=False)
+            with concurrent.futures.ThreadPoolExecutor(options["workers"]) as executor:
+                for query in queries.select_related("owner"):
+                    executor.submit(self._refresh_query_thread, query, options["full"])
+
+    def _refresh_query_thread(self, query, full):
+        # Each thread has its own database connection
+        close_old_connections()
+        try:
+            self._refresh_query(query, full)
+        finally:
+            connection.close()
 
-    def _refresh_query(self, query):
+    def _refresh_query(self, query, full=False):
         if query.is_archived:
             self.stderr.write(
                 "Query with name %s owned by user %s is archived."
@@ -72,7 +100,7 @@ class Command(BaseCommand):
             )
             return
         try:
-            query.refresh_view()
+            query.refresh_view(full)
         except QueryUpdatedError as e:
             self.stderr.write(
                 "Query with name %s owned by user %s was recently refreshed."
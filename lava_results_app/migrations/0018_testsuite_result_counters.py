@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.7 on 2019-12-09 09:41
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_results_app", "0017_testdata_onetoone_field")]
+
+    # The counters of the existing rows are NULL (unknown) while the new
+    # rows start at 0: add the columns without a default first.
+    operations = [
+        migrations.AddField(
+            model_name="testsuite",
+            name="count_pass",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="testsuite",
+            name="count_fail",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="testsuite",
+            name="count_skip",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="testsuite",
+            name="count_unknown",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="testsuite",
+            name="count_total",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="testsuite",
+            name="count_measurement",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="testsuite",
+            name="count_pass",
+            field=models.PositiveIntegerField(default=0, null=True),
+        ),
+        migrations.AlterField(
+            model_name="testsuite",
+            name="count_fail",
+            field=models.PositiveIntegerField(default=0, null=True),
+        ),
+        migrations.AlterField(
+            model_name="testsuite",
+            name="count_skip",
+            field=models.PositiveIntegerField(default=0, null=True),
+        ),
+        migrations.AlterField(
+            model_name="testsuite",
+            name="count_unknown",
+            field=models.PositiveIntegerField(default=0, null=True),
+        ),
+        migrations.AlterField(
+            model_name="testsuite",
+            name="count_total",
+            field=models.PositiveIntegerField(default=0, null=True),
+        ),
+        migrations.AlterField(
+            model_name="testsuite",
+            name="count_measurement",
+            field=models.PositiveIntegerField(default=0, null=True),
+        ),
+    ]
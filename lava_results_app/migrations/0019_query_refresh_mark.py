@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.7 on 2019-12-10 14:03
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_results_app", "0018_testsuite_result_counters")]
+
+    operations = [
+        migrations.AddField(
+            model_name="query",
+            name="refresh_mark",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        )
+    ]
@@ -28,7 +28,9 @@ TestSet can be enabled within a test definition run step
 TestCase is a single lava-test-case record or Action result.
 """
 
+import collections
 from datetime import timedelta
+import hashlib
 import logging
 from urllib.parse import quote
 import yaml
@@ -39,9 +41,10 @@ from django.contrib.admin.models import LogEntry, ADDITION
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes import fields
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models, connection, transaction
-from django.db.models import Q, Lookup
+from django.db.models import Avg, Count, Lookup, Max, Min, Q
 from django.db.models.fields import Field
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
@@ -110,43 +113,115 @@ class NotEqual(Lookup):
 
 
 class QueryMaterializedView(MaterializedView):
+    """
+    Cached results of a query.
+    The results used to be stored in a materialized view. They are now stored
+    in a table so that only the new results are appended on refresh.
+    """
+
     class Meta:
         abstract = True
 
-    CREATE_VIEW = "CREATE MATERIALIZED VIEW %s%s AS %s;"
     DROP_VIEW = "DROP MATERIALIZED VIEW IF EXISTS %s%s;"
-    REFRESH_VIEW = "REFRESH MATERIALIZED VIEW %s%s;"
+    DROP_TABLE = "DROP TABLE IF EXISTS %s%s;"
     VIEW_EXISTS = "SELECT EXISTS(SELECT * FROM pg_class WHERE relname='%s%s');"
+    VIEW_KIND = "SELECT relkind FROM pg_class WHERE relname='%s%s';"
     QUERY_VIEW_PREFIX = "query_"
 
     @classmethod
     def create(cls, query):
         # Check if view for this query exists.
+        if not cls.view_exists(query.id):
+            cls.rebuild(query)
+
+    @classmethod
+    def rebuild(cls, query):
+        """
+        Compute all the results of the query in a new table and swap it with
+        the current one: the old results are readable until the end.
+        """
+        name = "%s%s" % (cls.QUERY_VIEW_PREFIX, query.id)
+        sql, params = Query.get_queryset(
+            query.content_type, query.querycondition_set.all(), query.limit
+        ).query.sql_with_params()
+
         cursor = connection.cursor()
-        if not cls.view_exists(query.id):  # create view
-            sql, params = Query.get_queryset(
-                query.content_type, query.querycondition_set.all(), query.limit
-            ).query.sql_with_params()
+        cursor.execute("DROP TABLE IF EXISTS %s_new;" % name)
+        cursor.execute("CREATE TABLE %s_new AS %s;" % (name, sql), params)
+        with transaction.atomic():
+            cls.drop(query.id)
+            cursor.execute("ALTER TABLE %s_new RENAME TO %s;" % (name, name))
+            cursor.execute("CREATE UNIQUE INDEX %s_id ON %s (id);" % (name, name))
+
+    @classmethod
+    def append(cls, query, refresh_mark):
+        """
+        Evaluate the query again for the objects starting at refresh_mark and
+        keep the last query.limit results.
+        """
+        name = "%s%s" % (cls.QUERY_VIEW_PREFIX, query.id)
+        conditions = query.querycondition_set.all()
+        insert = "INSERT INTO %s SELECT * FROM (%%s) AS results " % name
+        insert += "ON CONFLICT (id) DO NOTHING;"
 
-            sql = sql.replace("%s", "'%s'")
-            query_str = sql % params
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute("SELECT count(*) FROM %s;" % name)
+            full = cursor.fetchone()[0] >= query.limit
+            cursor.execute("DELETE FROM %s WHERE id >= %%s;" % name, [refresh_mark])
+
+            sql, params = (
+                Query.get_queryset(query.content_type, conditions)
+                .filter(id__gte=refresh_mark)[: query.limit]
+                .query.sql_with_params()
+            )
+            cursor.execute(insert % sql, params)
+
+            # Results that do not match anymore were removed: when the older
+            # results were truncated, fetch them again.
+            cursor.execute("SELECT count(*), min(id) FROM %s;" % name)
+            (count, first) = cursor.fetchone()
+            if full and count < query.limit:
+                sql, params = (
+                    Query.get_queryset(query.content_type, conditions)
+                    .filter(id__lt=first if first is not None else refresh_mark)[
+                        : query.limit - count
+                    ]
+                    .query.sql_with_params()
+                )
+                cursor.execute(insert % sql, params)
 
-            # TODO: handle potential exceptions here. what to do if query
-            # view is not created? - new field update_status?
-            query_str = cls.CREATE_VIEW % (cls.QUERY_VIEW_PREFIX, query.id, query_str)
-            cursor.execute(query_str)
+            cursor.execute(
+                "DELETE FROM %s WHERE id NOT IN "
+                "(SELECT id FROM %s ORDER BY id DESC LIMIT %%s);" % (name, name),
+                [query.limit],
+            )
 
     @classmethod
-    def refresh(cls, query_id):
-        refresh_sql = cls.REFRESH_VIEW % (cls.QUERY_VIEW_PREFIX, query_id)
-        cursor = connection.cursor()
-        cursor.execute(refresh_sql)
+    def next_refresh_mark(cls, model):
+        """
+        Return the id of the first object that could still change: the
+        first object of the unfinished test jobs or the next object.
+        """
+        last = model.objects.aggregate(last=Max("id"))["last"] or 0
+        unfinished = TestJob.objects.exclude(state=TestJob.STATE_FINISHED)
+        if model == TestJob:
+            objects = unfinished
+        elif model == TestSuite:
+            objects = TestSuite.objects.filter(job__in=unfinished)
+        else:
+            objects = TestCase.objects.filter(suite__job__in=unfinished)
+        first = objects.aggregate(first=Min("id"))["first"]
+        return last + 1 if first is None else min(first, last + 1)
 
     @classmethod
     def drop(cls, query_id):
-        drop_sql = cls.DROP_VIEW % (cls.QUERY_VIEW_PREFIX, query_id)
+        kind = cls.view_kind(query_id)
+        if kind is None:
+            return
+        drop_sql = cls.DROP_VIEW if kind == "m" else cls.DROP_TABLE
         cursor = connection.cursor()
-        cursor.execute(drop_sql)
+        cursor.execute(drop_sql % (cls.QUERY_VIEW_PREFIX, query_id))
 
     @classmethod
     def view_exists(cls, query_id):
@@ -154,6 +229,16 @@ class QueryMaterializedView(MaterializedView):
         cursor.execute(cls.VIEW_EXISTS % (cls.QUERY_VIEW_PREFIX, query_id))
         return cursor.fetchone()[0]
 
+    @classmethod
+    def view_kind(cls, query_id):
+        """
+        Return "r" for a table, "m" for a materialized view or None.
+        """
+        cursor = connection.cursor()
+        cursor.execute(cls.VIEW_KIND % (cls.QUERY_VIEW_PREFIX, query_id))
+        row = cursor.fetchone()
+        return None if row is None else row[0]
+
     def get_queryset(self):
         return QueryMaterializedView.objects.all()
 
@@ -197,17 +282,31 @@ class TestSuite(models.Model, Queryable):
         verbose_name=u"Suite name", blank=True, null=True, default=None, max_length=200
     )
 
+    # Test case counters, updated when the test cases are saved.
+    # NULL for the suites created before the counters were introduced: use
+    # the rebuild_result_counters command to compute them.
+    count_pass = models.PositiveIntegerField(null=True, default=0)
+    count_fail = models.PositiveIntegerField(null=True, default=0)
+    count_skip = models.PositiveIntegerField(null=True, default=0)
+    count_unknown = models.PositiveIntegerField(null=True, default=0)
+    count_total = models.PositiveIntegerField(null=True, default=0)
+    count_measurement = models.PositiveIntegerField(null=True, default=0)
+
+    def get_result_counts(self):
+        return result_counts(self, self.testcase_set.all())
+
     def testcase_count(self, value):
-        return self.testcase_set.filter(result=TestCase.RESULT_MAP[value]).count()
+        return self.get_result_counts()[value]
 
     def get_passfail_results(self):
         # Get pass fail results per lava_results_app.testsuite.
+        counts = self.get_result_counts()
         return {
             self.name: {
-                "pass": self.testcase_count("pass"),
-                "fail": self.testcase_count("fail"),
-                "skip": self.testcase_count("skip"),
-                "unknown": self.testcase_count("unknown"),
+                "pass": counts["pass"],
+                "fail": counts["fail"],
+                "skip": counts["skip"],
+                "unknown": counts["unknown"],
             }
         }
 
@@ -476,6 +575,35 @@ class TestCase(models.Model, Queryable):
         return self.RESULT_REVERSE[self.result]
 
 
+# Name of the TestSuite and TestJob counter of each test case result
+RESULT_COUNTERS = {
+    TestCase.RESULT_PASS: "pass",
+    TestCase.RESULT_FAIL: "fail",
+    TestCase.RESULT_SKIP: "skip",
+    TestCase.RESULT_UNKNOWN: "unknown",
+}
+
+RESULT_COUNT_AGGREGATES = {
+    "pass": Count("id", filter=Q(result=TestCase.RESULT_PASS)),
+    "fail": Count("id", filter=Q(result=TestCase.RESULT_FAIL)),
+    "skip": Count("id", filter=Q(result=TestCase.RESULT_SKIP)),
+    "unknown": Count("id", filter=Q(result=TestCase.RESULT_UNKNOWN)),
+    "total": Count("id"),
+    "measurement": Count("measurement"),
+}
+
+
+def result_counts(obj, test_cases):
+    """
+    Return the test case counters of a TestSuite or a TestJob as a dict.
+    The counters are computed from the test_cases queryset when they were
+    not built yet.
+    """
+    if obj.count_total is None:
+        return test_cases.aggregate(**RESULT_COUNT_AGGREGATES)
+    return {name: getattr(obj, "count_%s" % name) for name in RESULT_COUNT_AGGREGATES}
+
+
 class MetaType(models.Model):
     """
     name will be a label, like a deployment type (NFS) or a boot type (bootz)
@@ -789,6 +917,9 @@ class Query(models.Model):
 
     last_updated = models.DateTimeField(blank=True, null=True)
 
+    # Objects before this id were already evaluated by the last refresh
+    refresh_mark = models.BigIntegerField(blank=True, null=True, editable=False)
+
     group_by_attribute = models.CharField(
         blank=True, null=True, max_length=20, verbose_name="group by attribute"
     )
@@ -946,8 +1077,12 @@ class Query(models.Model):
 
         return query_results
 
-    def refresh_view(self):
-
+    def refresh_view(self, full=False):
+        """
+        Update the cached results. Only the objects created or still changing
+        since the last refresh are evaluated, unless full is True or the
+        conditions have changed.
+        """
         if self.is_live:
             raise RefreshLiveQueryError("Refreshing live query not permitted.")
 
@@ -966,14 +1101,22 @@ class Query(models.Model):
                 query.save()
 
         try:
-            if not self.has_view():
-                QueryMaterializedView.create(self)
-            elif self.is_changed:
-                QueryMaterializedView.drop(self.id)
-                QueryMaterializedView.create(self)
+            # Compute the mark before reading the results: the objects created
+            # in the meantime will be read by the next refresh.
+            refresh_mark = QueryMaterializedView.next_refresh_mark(
+                self.content_type.model_class()
+            )
+            if (
+                full
+                or self.is_changed
+                or self.refresh_mark is None
+                or QueryMaterializedView.view_kind(self.id) != "r"
+            ):
+                QueryMaterializedView.rebuild(self)
             else:
-                QueryMaterializedView.refresh(self.id)
+                QueryMaterializedView.append(self, self.refresh_mark)
 
+            self.refresh_mark = refresh_mark
             self.last_updated = timezone.now()
             self.is_changed = False
 
@@ -1472,6 +1615,13 @@ class ChartQuery(models.Model):
         chart_data["basic"] = self.get_basic_chart_data()
         chart_data["user"] = self.get_user_chart_data(user)
 
+        cache_key = self.get_data_cache_key(user)
+        if cache_key is not None:
+            data = cache.get(cache_key)
+            if data is not None:
+                chart_data["data"] = data
+                return chart_data
+
         # TODO: order by attribute if attribute is used for x-axis.
         if hasattr(self, "query"):
             results = self.query.get_results(user).order_by(
@@ -1496,8 +1646,39 @@ class ChartQuery(models.Model):
         elif self.chart_type == "attributes":
             chart_data["data"] = self.get_chart_attributes_data(user, results)
 
+        if cache_key is not None and "data" in chart_data:
+            cache.set(cache_key, chart_data["data"], settings.CHART_DATA_CACHE_TIMEOUT)
         return chart_data
 
+    def get_data_cache_key(self, user):
+        """
+        Return the key of the chart data in the cache or None if the data
+        should not be cached.
+        Only the results of the non-live queries are cached: the key depends
+        on the last refresh of the query, the omitted results, the chart
+        options and the user.
+        """
+        if not hasattr(self, "query"):
+            return None
+        if self.query.is_live or self.query.last_updated is None:
+            return None
+        omitted = QueryOmitResult.objects.filter(query=self.query).aggregate(
+            count=Count("id"), last=Max("id")
+        )
+        version = (
+            self.query.last_updated.isoformat(),
+            omitted["count"],
+            omitted["last"],
+            self.chart_type,
+            self.xaxis_attribute,
+            self.attributes,
+            user.id,
+        )
+        return "chart-data-%d-%s" % (
+            self.id,
+            hashlib.sha1(repr(version).encode("utf-8")).hexdigest(),  # nosec
+        )
+
     def get_basic_chart_data(self):
         data = {}
         fields = [
@@ -1549,97 +1730,288 @@ class ChartQuery(models.Model):
 
         return data
 
-    def get_chart_passfail_data(self, user, query_results):
+    def get_chart_items(self, query_results, xaxis=False):
+        """
+        Return the common fields of the query results, in the query order, as
+        a list of dicts. When xaxis is True, the value of xaxis_attribute is
+        fetched for each item and the items without it are skipped.
+        """
+        model = query_results.model
+        if issubclass(model, TestJob):
+            rows = query_results.values_list("id", "end_time", "sub_id")
+            items = [
+                {
+                    "pk": pk,
+                    "job_id": pk,
+                    "date": str(end_time),
+                    "link": reverse(
+                        "lava.scheduler.job.detail", args=[sub_id if sub_id else pk]
+                    ),
+                }
+                for (pk, end_time, sub_id) in rows
+            ]
+        elif issubclass(model, TestSuite):
+            rows = query_results.values_list("id", "job_id", "job__end_time", "name")
+            items = [
+                {
+                    "pk": pk,
+                    "job_id": job_id,
+                    "date": str(end_time),
+                    "link": reverse("lava.results.suite", args=[job_id, name]),
+                }
+                for (pk, job_id, end_time, name) in rows
+            ]
+        else:
+            rows = query_results.values_list("id", "suite__job_id", "logged")
+            items = [
+                {
+                    "pk": pk,
+                    "job_id": job_id,
+                    "date": str(logged),
+                    "link": reverse("lava.results.testcase", args=[pk]),
+                }
+                for (pk, job_id, logged) in rows
+            ]
 
-        data = []
-        for item in query_results:
+        if not xaxis:
+            return items
+        if not self.xaxis_attribute:
+            for item in items:
+                item["attribute"] = item["date"]
+            return items
+
+        values = dict(
+            TestData.objects.filter(
+                testjob_id__in=set(item["job_id"] for item in items),
+                attributes__name=self.xaxis_attribute,
+            ).values_list("testjob_id", "attributes__value")
+        )
+        # Items without this specific attribute are ignored.
+        selected = []
+        for item in items:
+            attribute = values.get(item["job_id"])
+            if attribute:
+                item["attribute"] = attribute
+                selected.append(item)
+        return selected
+
+    @staticmethod
+    def get_suites_results(suites):
+        """
+        Return the name, the job id and the test case counters of each suite
+        as {suite id: (job id, name, counts)}, ordered by id.
+        """
+        names = list(RESULT_COUNT_AGGREGATES)
+        fields = ["count_%s" % name for name in names]
+        results = collections.OrderedDict()
+        missing = []
+        for (pk, job_id, name, *counts) in suites.order_by("id").values_list(
+            "id", "job_id", "name", *fields
+        ):
+            results[pk] = (job_id, name, dict(zip(names, counts)))
+            if counts[names.index("total")] is None:
+                missing.append(pk)
+
+        # Compute the counters that were not built yet.
+        if missing:
+            query = TestCase.objects.filter(suite_id__in=missing).values("suite_id")
+            for item in query.annotate(
+                **{
+                    "count_%s" % name: aggr
+                    for (name, aggr) in RESULT_COUNT_AGGREGATES.items()
+                }
+            ).order_by():
+                counts = results[item["suite_id"]][2]
+                for name in names:
+                    counts[name] = item["count_%s" % name]
+            for pk in missing:
+                counts = results[pk][2]
+                for name in names:
+                    if counts[name] is None:
+                        counts[name] = 0
+        return results
 
-            # Set attribute based on xaxis_attribute.
-            attribute = item.get_xaxis_attribute(self.xaxis_attribute)
-            # If xaxis attribute is set and this query item does not have
-            # this specific attribute, ignore it.
-            if self.xaxis_attribute and not attribute:
-                continue
+    def get_chart_passfail_data(self, user, query_results):
+
+        model = query_results.model
+        if issubclass(model, TestCase):
+            # Pass/fail charts for testcases do not make sense.
+            return []
 
-            date = str(item.get_end_datetime())
-            attribute = attribute if attribute is not None else date
+        items = self.get_chart_items(query_results, xaxis=True)
+        pks = [item["pk"] for item in items]
+        by_job = issubclass(model, TestJob)
+        if by_job:
+            suites = self.get_suites_results(TestSuite.objects.filter(job_id__in=pks))
+        else:
+            suites = self.get_suites_results(TestSuite.objects.filter(id__in=pks))
 
-            passfail_results = item.get_passfail_results()
-            for result in passfail_results:
+        # {job or suite id: {suite name: counts}}
+        passfail_results = {}
+        for (pk, (job_id, name, counts)) in suites.items():
+            passfail_results.setdefault(job_id if by_job else pk, {})[name] = counts
 
+        data = []
+        for item in items:
+            for (result, counts) in passfail_results.get(item["pk"], {}).items():
                 if result:
-                    chart_item = {
-                        "id": result,
-                        "pk": item.id,
-                        "link": item.get_absolute_url(),
-                        "date": date,
-                        "attribute": attribute,
-                        "pass": passfail_results[result]["fail"] == 0,
-                        "passes": passfail_results[result]["pass"],
-                        "failures": passfail_results[result]["fail"],
-                        "skip": passfail_results[result]["skip"],
-                        "unknown": passfail_results[result]["unknown"],
-                        "total": (
-                            passfail_results[result]["pass"]
-                            + passfail_results[result]["fail"]
-                            + passfail_results[result]["unknown"]
-                            + passfail_results[result]["skip"]
-                        ),
-                    }
-                    data.append(chart_item)
+                    data.append(
+                        {
+                            "id": result,
+                            "pk": item["pk"],
+                            "link": item["link"],
+                            "date": item["date"],
+                            "attribute": item["attribute"],
+                            "pass": counts["fail"] == 0,
+                            "passes": counts["pass"],
+                            "failures": counts["fail"],
+                            "skip": counts["skip"],
+                            "unknown": counts["unknown"],
+                            "total": (
+                                counts["pass"]
+                                + counts["fail"]
+                                + counts["unknown"]
+                                + counts["skip"]
+                            ),
+                        }
+                    )
 
         return data
 
     def get_chart_measurement_data(self, user, query_results):
 
-        data = []
-        for item in query_results:
-
-            # Set attribute based on xaxis_attribute.
-            attribute = item.get_xaxis_attribute(self.xaxis_attribute)
-            # If xaxis attribute is set and this query item does not have
-            # this specific attribute, ignore it.
-            if self.xaxis_attribute and not attribute:
-                continue
-
-            date = str(item.get_end_datetime())
-            attribute = attribute if attribute is not None else date
-
-            measurement_results = item.get_measurement_results()
-            for result in measurement_results:
+        model = query_results.model
+        items = self.get_chart_items(query_results, xaxis=True)
+        pks = [item["pk"] for item in items]
+
+        # {job, suite or test case id: {name: (measurement, fail)}}
+        measurement_results = {}
+        if issubclass(model, TestJob):
+            # Average measurement of each suite
+            suites = self.get_suites_results(TestSuite.objects.filter(job_id__in=pks))
+            averages = dict(
+                TestCase.objects.filter(suite_id__in=list(suites))
+                .values("suite_id")
+                .annotate(average=Avg("measurement"))
+                .order_by()
+                .values_list("suite_id", "average")
+            )
+            for (pk, (job_id, name, counts)) in suites.items():
+                measurement_results.setdefault(job_id, {})[name] = (
+                    averages.get(pk),
+                    counts["fail"],
+                )
+        else:
+            query = TestCase.objects.order_by("id")
+            if issubclass(model, TestSuite):
+                query = query.filter(suite_id__in=pks)
+                fields = ("suite_id", "name", "measurement", "result")
+            else:
+                query = query.filter(id__in=pks)
+                fields = ("id", "name", "measurement", "result")
+            for (pk, name, measurement, result) in query.values_list(*fields):
+                measurement_results.setdefault(pk, {})[name] = (
+                    measurement,
+                    result != TestCase.RESULT_PASS,
+                )
 
+        data = []
+        for item in items:
+            for (result, (measurement, fail)) in measurement_results.get(
+                item["pk"], {}
+            ).items():
                 if result:
-                    chart_item = {
-                        "id": result,
-                        "pk": item.id,
-                        "link": item.get_absolute_url(),
-                        "date": date,
-                        "attribute": attribute,
-                        "pass": measurement_results[result]["fail"] == 0,
-                        "measurement": measurement_results[result]["measurement"],
-                    }
-                data.append(chart_item)
+                    data.append(
+                        {
+                            "id": result,
+                            "pk": item["pk"],
+                            "link": item["link"],
+                            "date": item["date"],
+                            "attribute": item["attribute"],
+                            "pass": fail == 0,
+                            "measurement": measurement,
+                        }
+                    )
 
         return data
 
     def get_chart_attributes_data(self, user, query_results):
 
-        data = []
-        for item in query_results:
+        model = query_results.model
+        items = self.get_chart_items(query_results)
+        pks = [item["pk"] for item in items]
+        attributes = [x.strip() for x in self.attributes.split(",")]
+
+        # {job, suite or test case id: {attribute: (value, fail)}}
+        attribute_results = {}
+        if issubclass(model, TestJob):
+            jobs = dict(TestJob.objects.filter(id__in=pks).values_list("id", "health"))
+            query = TestData.objects.filter(
+                testjob_id__in=pks, attributes__name__in=attributes
+            )
+            for (job_id, name, value) in query.order_by("attributes__id").values_list(
+                "testjob_id", "attributes__name", "attributes__value"
+            ):
+                results = attribute_results.setdefault(job_id, {})
+                try:
+                    results[name] = (
+                        float(value),
+                        jobs[job_id] != TestJob.HEALTH_COMPLETE,
+                    )
+                except (TypeError, ValueError):
+                    # Ignore non-float metadata.
+                    results.pop(name, None)
+        else:
+            # Only parse the metadata that could contain the attributes
+            query = TestCase.objects.order_by("id")
+            condition = Q()
+            for attribute in attributes:
+                condition |= Q(metadata__contains=attribute)
+            query = query.filter(condition)
+            if issubclass(model, TestSuite):
+                query = query.filter(suite_id__in=pks)
+                fields = ("suite_id", "metadata", "result")
+            else:
+                query = query.filter(id__in=pks)
+                fields = ("id", "metadata", "result")
+
+            for (pk, metadata, result) in query.values_list(*fields):
+                try:
+                    action_metadata = yaml_load(metadata) if metadata else None
+                except yaml.YAMLError:
+                    continue
+                if not action_metadata:
+                    continue
+                results = attribute_results.setdefault(pk, {})
+                for key in action_metadata:
+                    # Use only the metadata from the first testcase atm.
+                    if key in attributes and key not in results:
+                        try:
+                            results[key] = (
+                                float(action_metadata[key]),
+                                result != TestCase.RESULT_PASS,
+                            )
+                        except (TypeError, ValueError):
+                            # Ignore non-float metadata.
+                            pass
 
-            attribute_results = item.get_attribute_results(self.attributes)
-            for result in attribute_results:
+        data = []
+        for item in items:
+            for (result, (value, fail)) in attribute_results.get(
+                item["pk"], {}
+            ).items():
                 if result:
-                    chart_item = {
-                        "id": result,
-                        "pk": item.id,
-                        "attribute": str(item.get_end_datetime()),
-                        "link": item.get_absolute_url(),
-                        "date": str(item.get_end_datetime()),
-                        "pass": attribute_results[result]["fail"] == 0,
-                        "attr_value": attribute_results[result]["value"],
-                    }
-                data.append(chart_item)
+                    data.append(
+                        {
+                            "id": result,
+                            "pk": item["pk"],
+                            "attribute": item["date"],
+                            "link": item["link"],
+                            "date": item["date"],
+                            "pass": fail == 0,
+                            "attr_value": value,
+                        }
+                    )
 
         return data
 
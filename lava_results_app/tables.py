@@ -81,7 +81,7 @@ class ResultsTable(LavaTable):
     def render_total(self, record, table=None):
         if not self._check_job(record, table):
             return ""
-        return TestCase.objects.filter(suite__job=record.job, suite=record).count()
+        return record.testcase_count("total")
 
     def render_logged(self, record, table=None):
         if not self._check_job(record, table):
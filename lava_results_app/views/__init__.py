@@ -335,7 +335,7 @@ def suite_testcase_count(request, job, pk):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
     test_suite = get_object_or_404(TestSuite, name=pk, job=job)
-    test_case_count = test_suite.testcase_set.all().count()
+    test_case_count = test_suite.testcase_count("total")
     return HttpResponse(test_case_count, content_type="text/plain")
 
 
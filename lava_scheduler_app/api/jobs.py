@@ -31,7 +31,6 @@ import lava_common.schemas as schemas
 from lava_scheduler_app.api import SchedulerAPI
 from lava_scheduler_app.logutils import read_logs
 from lava_scheduler_app.models import TestJob
-from lava_results_app.models import TestCase
 
 
 def load_optional_file(filename):
@@ -196,7 +195,7 @@ class SchedulerJobsAPI(ExposedV2API):
         start = max(0, start)
         limit = min(limit, 100)
         jobs = TestJob.objects.visible_by_user(self.user).select_related(
-            "requested_device_type", "submitter"
+            "requested_device_type", "submitter", "actual_device"
         )
         if state:
             try:
@@ -238,25 +237,13 @@ class SchedulerJobsAPI(ExposedV2API):
                 # cancelled jobs might not have start or end time
                 end_time = str(job.end_time) if job.end_time else None
                 start_time = str(job.start_time) if job.start_time else None
-                metadata = None
-                try:
-                    job_case = TestCase.objects.get(
-                        suite__job=job, suite__name="lava", name="job"
-                    )
-                except TestCase.DoesNotExist:
-                    job_case = None
-                if job_case:
-                    metadata = job_case.action_metadata
-                if not metadata:
-                    # if job_case exists but metadata is still None due to job error
-                    metadata = {}
                 data.update(
                     {
                         "actual_device": actual_device,
                         "start_time": start_time,
                         "end_time": end_time,
-                        "error_msg": metadata.get("error_msg"),
-                        "error_type": metadata.get("error_type"),
+                        "error_msg": job.error_msg,
+                        "error_type": job.error_type,
                     }
                 )
 
@@ -18,12 +18,111 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from itertools import chain
+import threading
 
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 
 
+class PermissionCache:
+    """
+    Group permissions of the devices and device types, loaded in bulk (one
+    query per model and per user) and shared by every permission check of
+    the process.
+    The cache is cleared when a group permission or the groups of a user
+    are changed, and at the start of each request and scheduling pass so
+    that the changes made by the other processes are taken into account.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.codenames = {}
+        self.restrictions = {}
+        self.users = {}
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.codenames = {}
+            self.restrictions = {}
+            self.users = {}
+
+    def _get(self, store, key, load):
+        try:
+            return getattr(self, store)[key]
+        except KeyError:
+            pass
+        generation = self.generation
+        value = load()
+        with self.lock:
+            # Do not store data loaded before the cache was cleared
+            if generation == self.generation:
+                getattr(self, store)[key] = value
+        return value
+
+    def _load(self, obj, **filters):
+        """
+        Return the permission codenames of the objects of the same model as
+        obj, for the group permissions matching the filters.
+        """
+        model = obj._meta.get_field("permissions").related_model
+        perms = {}
+        query = model.objects.filter(**filters)
+        for (pk, codename) in query.values_list(
+            obj._meta.model_name, "permission__codename"
+        ):
+            perms.setdefault(pk, set()).add(codename)
+        return perms
+
+    def _load_user(self, user, obj):
+        perms = self._load(obj, group__user=user)
+        # Add lower priority permissions to the resulting sets.
+        priority = [p.split(".", 1)[-1] for p in obj.PERMISSIONS_PRIORITY]
+        for codenames in perms.values():
+            for perm in codenames.copy():
+                if perm in priority:
+                    codenames.update(priority[priority.index(perm) + 1 :])
+        return perms
+
+    def get_perms(self, obj):
+        """
+        Returns the codenames of all the permissions of the model of obj.
+        """
+        return self._get(
+            "codenames",
+            obj._meta.model_name,
+            lambda: set(
+                Permission.objects.filter(
+                    content_type=ContentType.objects.get_for_model(obj)
+                ).values_list("codename", flat=True)
+            ),
+        )
+
+    def get_group_perms(self, user, obj):
+        """
+        Returns the codenames of the permissions of user over obj, granted
+        through the groups of the user.
+        """
+        perms = self._get(
+            "users",
+            (user.id, obj._meta.model_name),
+            lambda: self._load_user(user, obj),
+        )
+        return set(perms.get(obj.pk, ()))
+
+    def is_restricted(self, obj, codename):
+        """
+        Returns True if the permission is granted to at least one group
+        for obj.
+        """
+        perms = self._get("restrictions", obj._meta.model_name, lambda: self._load(obj))
+        return codename in perms.get(obj.pk, ())
+
+
+permission_cache = PermissionCache()
+
+
 class PermissionAuth:
     def __init__(self, user):
         self.user = user
@@ -55,29 +154,7 @@ class PermissionAuth:
         return perm in self.get_perms(obj)
 
     def get_group_perms(self, obj):
-        content_type = ContentType.objects.get_for_model(obj)
-
-        perms_queryset = Permission.objects.filter(
-            content_type=ContentType.objects.get_for_model(obj)
-        )
-        fieldname = "group%spermission__group__user" % content_type.model
-
-        filters = {fieldname: self.user}
-        filters[
-            "group%spermission__%s" % (content_type.model, content_type.model)
-        ] = obj
-
-        perms_queryset = perms_queryset.filter(**filters)
-        perms = set(perms_queryset.values_list("codename", flat=True))
-        # Add lower priority permissions the resulting set.
-        for perm in perms.copy():
-            for idx, lower_perm in enumerate(obj.PERMISSIONS_PRIORITY):
-                if idx > obj.PERMISSIONS_PRIORITY.index(
-                    "%s.%s" % (content_type.app_label, perm)
-                ):
-                    perms.add(lower_perm.split(".", 1)[-1])
-
-        return perms
+        return permission_cache.get_group_perms(self.user, obj)
 
     def get_perms(self, obj):
         """
@@ -87,15 +164,8 @@ class PermissionAuth:
         """
         if not self.user.is_active:
             return []
-        content_type = ContentType.objects.get_for_model(obj)
         if self.user.is_superuser:
-            perms = set(
-                chain(
-                    *Permission.objects.filter(content_type=content_type).values_list(
-                        "codename"
-                    )
-                )
-            )
+            perms = set(permission_cache.get_perms(obj))
         else:
-            perms = set(self.get_group_perms(obj))
+            perms = self.get_group_perms(obj)
         return perms
@@ -25,17 +25,23 @@ Used to allow models.py to be shortened and easier to follow.
 
 
 import contextlib
+import datetime
 import os
 import yaml
 import jinja2
 import logging
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models import Q, Case, When, IntegerField, Sum
+from django.db.models import Q, Case, Count, When, IntegerField, Sum
+from django.db.models.expressions import RawSQL
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from django.contrib.sites.models import Site
+from django.urls import reverse
+from django.utils import timezone
 
 from lava_common.compat import yaml_load, yaml_safe_load
 from lava_common.decorators import nottest
@@ -233,6 +239,108 @@ if list(Device.objects.filter(Q(device_type=dt), ~Q(health=Device.HEALTH_RETIRED
     return device_types
 
 
+# Number of days and weeks displayed in the job reports
+REPORT_DAYS = 7
+REPORT_WEEKS = 10
+
+
+def job_report_matrix(device_type=None, device=None):
+    """
+    Count the passing and failing jobs started during each of the last
+    REPORT_WEEKS weeks, day 0 being the last 24 hours, in a single query.
+    Return the time of the computation and a dict with a list of
+    {"pass": count, "fail": count} for the "health_check" and "jobs" keys.
+    The matrix is cached for REPORTS_CACHE_TIMEOUT seconds.
+    """
+    key = "lava-scheduler-job-report-%s-%s" % (
+        "" if device_type is None else device_type.name,
+        "" if device is None else device.hostname,
+    )
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    now = timezone.now()
+    days = REPORT_WEEKS * 7
+    jobs = TestJob.objects.filter(
+        start_time__range=(now - datetime.timedelta(days), now)
+    )
+    if device_type is not None:
+        jobs = jobs.filter(actual_device__device_type=device_type)
+    if device is not None:
+        jobs = jobs.filter(actual_device=device)
+    age = RawSQL(
+        "CAST(FLOOR(EXTRACT(EPOCH FROM "
+        "(%s - lava_scheduler_app_testjob.start_time)) / 86400) AS INTEGER)",
+        [now],
+        output_field=IntegerField(),
+    )
+    rows = (
+        jobs.annotate(day=age)
+        .values("health_check", "day")
+        .annotate(
+            passing=Count("id", filter=Q(health=TestJob.HEALTH_COMPLETE)),
+            failing=Count(
+                "id",
+                filter=Q(
+                    health__in=[TestJob.HEALTH_CANCELED, TestJob.HEALTH_INCOMPLETE]
+                ),
+            ),
+        )
+        .order_by()
+    )
+
+    matrix = {
+        "health_check": [{"pass": 0, "fail": 0} for _ in range(days)],
+        "jobs": [{"pass": 0, "fail": 0} for _ in range(days)],
+    }
+    for row in rows:
+        if 0 <= row["day"] < days:
+            counts = matrix["health_check" if row["health_check"] else "jobs"]
+            counts[row["day"]]["pass"] += row["passing"]
+            counts[row["day"]]["fail"] += row["failing"]
+
+    data = (now, matrix)
+    cache.set(key, data, settings.REPORTS_CACHE_TIMEOUT)
+    return data
+
+
+def job_reports(device_type=None, device=None):
+    """
+    Return the daily and weekly job reports rendered by the reports pages.
+    """
+    (now, matrix) = job_report_matrix(device_type, device)
+    url = reverse("lava.scheduler.failure_report")
+    scope = ""
+    if device_type is not None:
+        scope = "&device_type=%s" % device_type.name
+    elif device is not None:
+        scope = "&device=%s" % device.hostname
+
+    def report(health_check, start_day, end_day):
+        counts = matrix["health_check" if health_check else "jobs"]
+        counts = counts[-end_day:-start_day]
+        return {
+            "pass": sum(c["pass"] for c in counts),
+            "fail": sum(c["fail"] for c in counts),
+            "date": (now + datetime.timedelta(start_day)).strftime("%m-%d"),
+            "failure_url": "%s?start=%s&end=%s%s&health_check=%d"
+            % (url, start_day, end_day, scope, health_check),
+        }
+
+    reports = {}
+    for (prefix, health_check) in [("health", True), ("job", False)]:
+        reports["%s_day_report" % prefix] = [
+            report(health_check, day * -1 - 1, day * -1)
+            for day in reversed(range(REPORT_DAYS))
+        ]
+        reports["%s_week_report" % prefix] = [
+            report(health_check, week * -7 - 7, week * -7)
+            for week in reversed(range(REPORT_WEEKS))
+        ]
+    return reports
+
+
 def load_devicetype_template(device_type_name, raw=False):
     """
     Loads the bare device-type template as a python dictionary object for
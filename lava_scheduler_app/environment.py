@@ -17,11 +17,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import contextlib
+import copy
+import fcntl
+import hashlib
 import jinja2
+import jinja2.meta
+import os
+import simplejson
 import threading
 
 from django.conf import settings
 
+from lava_common.compat import yaml_safe_load
+from lava_server.cmdutils import watch_directory
+
 
 thread_locals = threading.local()
 
@@ -45,3 +56,241 @@ def devices():
 
 def device_types():
     return thread_locals.device_types
+
+
+class DeviceConfiguration:
+    """
+    Rendered device configuration, as stored in the cache.
+    The parsed dictionary and the validation result are computed lazily.
+    """
+
+    def __init__(self, digest, raw, rendered, extends, deps, error=None):
+        self.digest = digest
+        self.raw = raw
+        self.rendered = rendered
+        self.extends = extends
+        self.deps = deps
+        self.error = error
+        self.valid = None
+        self._parsed = None
+        self._network = None
+
+    def load(self):
+        """
+        Return a copy of the parsed configuration: callers are allowed to
+        modify the dictionary.
+        raise: yaml.YAMLError
+        """
+        if self.rendered is None:
+            return None
+        if self._parsed is None:
+            self._parsed = yaml_safe_load(self.rendered)
+        return copy.deepcopy(self._parsed)
+
+    def network(self):
+        """
+        Return the vland ports of the device as a list of
+        (switch, port, interface) tuples.
+        raise: yaml.YAMLError
+        """
+        if self._network is None:
+            network = []
+            if self.rendered is not None:
+                if self._parsed is None:
+                    self._parsed = yaml_safe_load(self.rendered)
+                params = self._parsed.get("parameters") or {}
+                interfaces = params.get("interfaces") or {}
+                for (name, interface) in interfaces.items():
+                    # Skip the "target" interface, not connected to a switch
+                    if not isinstance(interface, dict) or "switch" not in interface:
+                        continue
+                    network.append(
+                        (
+                            interface["switch"],
+                            interface["port"],
+                            {
+                                "interface": name,
+                                "mac": interface["mac"],
+                                "sysfs": interface["sysfs"],
+                            },
+                        )
+                    )
+            self._network = network
+        return self._network
+
+
+class DeviceConfigurationCache:
+    """
+    Cache of the rendered device dictionaries.
+
+    When inotify is available, DEVICES_PATH and DEVICE_TYPES_PATH are watched
+    and any change in these directories does flush the cache.
+    Otherwise, entries are validated by the digest of the device dictionary,
+    the job context and the mtimes of the templates it extends or includes.
+    """
+
+    MAX_ENTRIES = 4096
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.inotify_fd = None
+        self.paths = None
+        self.pid = None
+
+    def _watch(self):
+        # Start (or restart after a fork or a change of settings) watching the
+        # directories.
+        paths = (settings.DEVICES_PATH, settings.DEVICE_TYPES_PATH)
+        if self.paths == paths and self.pid == os.getpid():
+            return
+        self.entries.clear()
+        self.close()
+        self.paths = paths
+        self.pid = os.getpid()
+
+        inotify_fd = None
+        for path in paths:
+            fd = watch_directory(path, inotify_fd)
+            if fd is None:
+                if inotify_fd is not None:
+                    os.close(inotify_fd)
+                return
+            inotify_fd = fd
+        flags = fcntl.fcntl(inotify_fd, fcntl.F_GETFL, 0)
+        fcntl.fcntl(inotify_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.inotify_fd = inotify_fd
+
+    def close(self):
+        """
+        Stop watching the directories: the entries are then validated by
+        their digest.
+        """
+        if self.inotify_fd is not None:
+            with contextlib.suppress(OSError):
+                os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+    def _check_events(self):
+        if self.inotify_fd is None:
+            return
+        modified = False
+        try:
+            while os.read(self.inotify_fd, 4096):
+                modified = True
+        except BlockingIOError:
+            pass
+        if modified:
+            self.entries.clear()
+
+    def invalidate(self, hostname=None):
+        with self.lock:
+            if hostname is None:
+                self.entries.clear()
+            else:
+                for key in [k for k in self.entries if k[0] == hostname]:
+                    del self.entries[key]
+
+    def get(self, hostname, job_ctx=None):
+        ctx_key = simplejson.dumps(job_ctx or {}, sort_keys=True, default=str)
+        key = (hostname, ctx_key)
+        with self.lock:
+            self._watch()
+            self._check_events()
+            entry = self.entries.get(key)
+            # Without any inotify events, the entry is still valid
+            if entry is not None and self.inotify_fd is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        raw = self._read(hostname)
+        if entry is not None and entry.digest == self._digest(raw, ctx_key, entry.deps):
+            return entry
+
+        entry = self._render(hostname, raw, ctx_key, job_ctx or {})
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.MAX_ENTRIES:
+                self.entries.popitem(last=False)
+        return entry
+
+    def _read(self, hostname):
+        try:
+            with open(
+                os.path.join(settings.DEVICES_PATH, "%s.jinja2" % hostname), "r"
+            ) as f_in:
+                return f_in.read()
+        except OSError:
+            return None
+
+    def _digest(self, raw, ctx_key, deps):
+        digest = hashlib.sha256()
+        digest.update((raw or "").encode("utf-8"))
+        digest.update(ctx_key.encode("utf-8"))
+        for path in deps:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            digest.update(("%s:%s" % (path, mtime)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _lookup(self, name):
+        for path in [settings.DEVICES_PATH, settings.DEVICE_TYPES_PATH]:
+            filename = os.path.join(path, name)
+            if os.path.exists(filename):
+                return filename
+        return None
+
+    def _dependencies(self, env, ast):
+        # Templates extended or included (recursively) by the device dictionary
+        deps = []
+        pending = [name for name in jinja2.meta.find_referenced_templates(ast) if name]
+        while pending:
+            filename = self._lookup(pending.pop())
+            if filename is None or filename in deps:
+                continue
+            deps.append(filename)
+            with contextlib.suppress(OSError, jinja2.TemplateError):
+                with open(filename, "r") as f_in:
+                    data = f_in.read()
+                pending.extend(
+                    name
+                    for name in jinja2.meta.find_referenced_templates(env.parse(data))
+                    if name
+                )
+        return deps
+
+    def _render(self, hostname, raw, ctx_key, job_ctx):
+        env = devices()
+        extends = []
+        deps = []
+        error = None
+        if raw:
+            try:
+                ast = env.parse(raw)
+                extends = [
+                    getattr(node.template, "value", None)
+                    for node in ast.find_all(jinja2.nodes.Extends)
+                ]
+                deps = self._dependencies(env, ast)
+            except jinja2.TemplateError as exc:
+                error = str(exc)
+
+        try:
+            template = env.get_template("%s.jinja2" % hostname)
+            rendered = template.render(**job_ctx)
+        except jinja2.TemplateError:
+            rendered = None
+
+        return DeviceConfiguration(
+            self._digest(raw, ctx_key, deps), raw, rendered, extends, deps, error
+        )
+
+
+configurations = DeviceConfigurationCache()
+
+
+def device_configurations():
+    return configurations
@@ -17,23 +17,62 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 import contextlib
 import lzma
+import os
 import pathlib
+import re
 import struct
 
+from lava_common.compat import yaml_load, yaml_safe_dump, yaml_safe_load
+
 PACK_FORMAT = "=Q"
 PACK_SIZE = struct.calcsize(PACK_FORMAT)
 
+# Block-compressed logs: output.yaml.xz is a concatenation of independent xz
+# streams and output.yaml.xz.idx stores, for each stream, the offset in the
+# uncompressed logs and the offset in the compressed file.
+CHUNK_PACK_FORMAT = "=QQ"
+CHUNK_SIZE = 1024 * 1024
+
+# Size of the blocks sent when streaming the logs
+STREAM_SIZE = 64 * 1024
+
+# Action start and end lines
+PATTERN_START = re.compile(
+    r"^start: (?P<level>[\d.]+) (?P<action>[\w_-]+) \(timeout (?P<timeout>\d+:\d+:\d+)\)(?: \[(?P<namespace>[^\]]*)\])?"
+)
+PATTERN_END = re.compile(
+    r"^end: (?P<level>[\d.]+) (?P<action>[\w_-]+) \(duration (?P<duration>\d+:\d+:\d+)\)(?: \[(?P<namespace>[^\]]*)\])?"
+)
+
+
+class _ChunkedLogs(lzma.LZMAFile):
+    """
+    Decompress the logs starting at the given chunk.
+    """
+
+    def __init__(self, filename, position):
+        self._raw = open(filename, "rb")
+        self._raw.seek(position)
+        super().__init__(self._raw, "rb")
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._raw.close()
+
 
 def _build_index(directory):
+    # Like lava-logs, store the offset of the beginning of each line
     with open_logs(directory) as f_log:
         with open(str(directory / "output.idx"), "wb") as f_idx:
-            f_idx.write(struct.pack(PACK_FORMAT, 0))
-            line = f_log.readline()
-            while line:
-                f_idx.write(struct.pack(PACK_FORMAT, f_log.tell()))
-                line = f_log.readline()
+            offset = 0
+            for line in f_log:
+                f_idx.write(struct.pack(PACK_FORMAT, offset))
+                offset += len(line)
 
 
 def _get_line_offset(f_idx, line):
@@ -49,20 +88,79 @@ def line_count(f_idx):
     return int(f_idx.tell() / PACK_SIZE)
 
 
-def open_logs(dir_name):
+def _read_chunks(directory):
+    with contextlib.suppress(FileNotFoundError):
+        with open(str(directory / "output.yaml.xz.idx"), "rb") as f_chunks:
+            return list(struct.iter_unpack(CHUNK_PACK_FORMAT, f_chunks.read()))
+    return None
+
+
+def open_logs(dir_name, offset=0):
+    """
+    Open the logs, positioned at the given offset (in the uncompressed data).
+    For block-compressed logs, only the chunks after this offset are
+    decompressed.
+    """
     directory = pathlib.Path(dir_name)
     with contextlib.suppress(FileNotFoundError):
-        return open(str(directory / "output.yaml"), "rb")
-    return lzma.open(str(directory / "output.yaml.xz"), "rb")
+        f_log = open(str(directory / "output.yaml"), "rb")
+        f_log.seek(offset)
+        return f_log
 
+    chunks = _read_chunks(directory) if offset else None
+    if chunks:
+        idx = max(bisect.bisect_right(chunks, (offset, 2 ** 64)) - 1, 0)
+        (chunk_offset, position) = chunks[idx]
+        f_log = _ChunkedLogs(str(directory / "output.yaml.xz"), position)
+        f_log.seek(offset - chunk_offset)
+        return f_log
 
-def read_logs(dir_name, start=0, end=None):
+    f_log = lzma.open(str(directory / "output.yaml.xz"), "rb")
+    f_log.seek(offset)
+    return f_log
+
+
+def compress_logs(dir_name, chunk_size=CHUNK_SIZE):
+    """
+    Create the block-compressed output.yaml.xz and output.yaml.xz.idx from
+    output.yaml (or from a previous output.yaml.xz).
+    The original output.yaml is not removed.
+    Return the size of the uncompressed logs.
+    """
     directory = pathlib.Path(dir_name)
+    logs = str(directory / "output.yaml.xz")
+    chunks = str(directory / "output.yaml.xz.idx")
+    offset = 0
+    position = 0
+    with open_logs(directory) as f_in:
+        with open(logs + ".tmp", "wb") as f_out, open(chunks + ".tmp", "wb") as f_idx:
+            data = f_in.read(chunk_size)
+            while data:
+                compressed = lzma.compress(data)
+                f_idx.write(struct.pack(CHUNK_PACK_FORMAT, offset, position))
+                f_out.write(compressed)
+                offset += len(data)
+                position += len(compressed)
+                data = f_in.read(chunk_size)
+    # Rename the logs before the chunk index: when the index is present, the
+    # logs are always block-compressed.
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(chunks)
+    os.rename(logs + ".tmp", logs)
+    os.rename(chunks + ".tmp", chunks)
+    return offset
+
+
+def is_block_compressed(dir_name):
+    return (pathlib.Path(dir_name) / "output.yaml.xz.idx").exists()
+
 
+def _get_offsets(directory, start, end):
+    # Return the offsets of the lines [start, end[ in the uncompressed logs or
+    # None if the range is empty.
     # Only create the index if needed
     if start == 0 and end is None:
-        with open_logs(directory) as f_log:
-            return f_log.read().decode("utf-8")
+        return (0, None)
 
     # Create the index
     if not (directory / "output.idx").exists():
@@ -71,17 +169,93 @@ def read_logs(dir_name, start=0, end=None):
     with open(str(directory / "output.idx"), "rb") as f_idx:
         start_offset = _get_line_offset(f_idx, start)
         if start_offset is None:
-            return ""
-        with open_logs(directory) as f_log:
-            f_log.seek(start_offset)
-            if end is None:
-                return f_log.read().decode("utf-8")
-            end_offset = _get_line_offset(f_idx, end)
-            if end_offset is None:
-                return f_log.read().decode("utf-8")
-            if end_offset <= start_offset:
-                return ""
-            return f_log.read(end_offset - start_offset).decode("utf-8")
+            return None
+        if end is None:
+            return (start_offset, None)
+        end_offset = _get_line_offset(f_idx, end)
+        if end_offset is not None and end_offset <= start_offset:
+            return None
+        return (start_offset, end_offset)
+
+
+def read_logs(dir_name, start=0, end=None):
+    directory = pathlib.Path(dir_name)
+    offsets = _get_offsets(directory, start, end)
+    if offsets is None:
+        return ""
+    (start_offset, end_offset) = offsets
+    with open_logs(directory, start_offset) as f_log:
+        if end_offset is None:
+            return f_log.read().decode("utf-8")
+        return f_log.read(end_offset - start_offset).decode("utf-8")
+
+
+def stream_logs(dir_name, start=0, end=None, size=STREAM_SIZE):
+    """
+    Yield the raw logs, from line start to line end (excluded), by blocks of
+    at most size bytes.
+    """
+    directory = pathlib.Path(dir_name)
+    offsets = _get_offsets(directory, start, end)
+    if offsets is None:
+        return
+    (start_offset, end_offset) = offsets
+    with open_logs(directory, start_offset) as f_log:
+        remaining = None if end_offset is None else end_offset - start_offset
+        while remaining is None or remaining > 0:
+            data = f_log.read(size if remaining is None else min(size, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+
+def iter_logs(dir_name, start=0, end=None, size=None):
+    """
+    Yield the log records, from line start to line end (excluded), one at a
+    time. If size is given, only the first size bytes of the logs are read.
+    Each line is a yaml list with only one flow-style mapping, so the lines
+    are parsed one by one instead of loading the whole logs in memory.
+    """
+    directory = pathlib.Path(dir_name)
+    offsets = _get_offsets(directory, start, end)
+    if offsets is None:
+        return
+    (start_offset, end_offset) = offsets
+    if size is not None:
+        end_offset = size if end_offset is None else min(end_offset, size)
+    with open_logs(directory, start_offset) as f_log:
+        position = start_offset
+        for line in f_log:
+            if end_offset is not None and position >= end_offset:
+                break
+            position += len(line)
+            yield from yaml_load(line) or []
+
+
+def logs_line_count(dir_name, size=None):
+    """
+    Return the number of lines in the logs, using the index.
+    If size is given, only count the lines starting in the first size bytes
+    of the logs.
+    """
+    directory = pathlib.Path(dir_name)
+    if not (directory / "output.idx").exists():
+        _build_index(directory)
+    if size is None:
+        size = size_logs(directory)
+    with open(str(directory / "output.idx"), "rb") as f_idx:
+        f_idx.seek(0, os.SEEK_END)
+        count = line_count(f_idx)
+        # lava-logs writes the index before the logs: skip the lines that are
+        # not yet in the logs.
+        while count and size is not None:
+            offset = _get_line_offset(f_idx, count - 1)
+            if offset < size:
+                break
+            count -= 1
+        return count
 
 
 def size_logs(dir_name):
@@ -94,7 +268,116 @@ def size_logs(dir_name):
 
 
 def write_logs(f_log, f_idx, line):
-    f_idx.write(struct.pack(PACK_FORMAT, f_log.tell()))
+    write_lines(f_log, f_idx, [line])
+
+
+def write_lines(f_log, f_idx, lines):
+    # Write the index entries and the lines with only one write and one flush
+    # for each file.
+    offset = f_log.tell()
+    index = []
+    for line in lines:
+        index.append(struct.pack(PACK_FORMAT, offset))
+        offset += len(line)
+    f_idx.write(b"".join(index))
     f_idx.flush()
-    f_log.write(line)
+    f_log.write(b"".join(lines))
     f_log.flush()
+
+
+def _parse_duration(value):
+    parts = value.split(":")
+    return float(parts[0]) * 3600 + float(parts[1]) * 60 + float(parts[2])
+
+
+def _level_key(level):
+    return [int(part) for part in level.split(".") if part]
+
+
+class ActionTimings:
+    """
+    Build the timing table of the actions from the start and end lines of the
+    logs.
+    """
+
+    def __init__(self):
+        self.actions = {}
+
+    def add(self, lvl, msg):
+        # Only parse debug and info levels
+        if lvl not in ["debug", "info"]:
+            return
+
+        # Will raise if the log message is a python object
+        try:
+            match = PATTERN_START.match(msg)
+        except TypeError:
+            return
+
+        if match is not None:
+            d = match.groupdict()
+            action = self.actions.setdefault(d["level"], {"level": d["level"]})
+            action["action"] = d["action"]
+            action["namespace"] = d["namespace"]
+            action["timeout"] = _parse_duration(d["timeout"])
+            return
+
+        # No need to catch TypeError here as we know it's a string
+        match = PATTERN_END.match(msg)
+        if match is not None:
+            d = match.groupdict()
+            # TODO: validate does not have a proper start line
+            if d["action"] == "validate":
+                return
+            # We create the entry because with some timeout, the start line
+            # might be missing.
+            action = self.actions.setdefault(d["level"], {"level": d["level"]})
+            action.setdefault("action", d["action"])
+            action.setdefault("namespace", d["namespace"])
+            action["duration"] = _parse_duration(d["duration"])
+
+    def table(self):
+        """
+        Return the list of actions, sorted by level. The timeout or the
+        duration is None when the start or end line is missing.
+        """
+        table = []
+        for level in sorted(self.actions, key=_level_key):
+            action = self.actions[level]
+            table.append(
+                {
+                    "level": level,
+                    "action": action.get("action", "???"),
+                    "namespace": action.get("namespace"),
+                    "timeout": action.get("timeout"),
+                    "duration": action.get("duration"),
+                }
+            )
+        return table
+
+
+def compute_timings(dir_name):
+    """
+    Build the timing table by parsing the logs
+    """
+    timings = ActionTimings()
+    for line in iter_logs(dir_name):
+        timings.add(line["lvl"], line["msg"])
+    return timings.table()
+
+
+def read_timings(dir_name):
+    """
+    Return the precomputed timing table or None
+    """
+    with contextlib.suppress(FileNotFoundError):
+        data = (pathlib.Path(dir_name) / "timings.yaml").read_text(encoding="utf-8")
+        return yaml_safe_load(data)
+    return None
+
+
+def write_timings(dir_name, table):
+    filename = str(pathlib.Path(dir_name) / "timings.yaml")
+    with open(filename + ".tmp", "w", encoding="utf-8") as f_out:
+        f_out.write(yaml_safe_dump(table, default_flow_style=None))
+    os.rename(filename + ".tmp", filename)
@@ -23,6 +23,7 @@ from django.db import models
 from django.db.models import Q, Count
 
 from lava_common.exceptions import ObjectNotPersisted, PermissionNameError
+from lava_scheduler_app.auth import permission_cache
 
 
 class GroupObjectPermissionManager(models.Manager):
@@ -84,7 +85,10 @@ class GroupObjectPermissionManager(models.Manager):
             kwargs["group"] = group
             to_add.append(self.model(**kwargs))
 
-        return self.model.objects.bulk_create(to_add)
+        created = self.model.objects.bulk_create(to_add)
+        # bulk_create does not send the post_save signals
+        permission_cache.clear()
+        return created
 
     def remove_perm(self, perm, group, obj):
         """
@@ -103,7 +107,9 @@ class GroupObjectPermissionManager(models.Manager):
             "permission__content_type": ctype,
             ctype.model: obj,
         }
-        return self.filter(**kwargs).delete()
+        deleted = self.filter(**kwargs).delete()
+        permission_cache.clear()
+        return deleted
 
 
 class RestrictedObjectQuerySet(models.QuerySet):
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.7 on 2019-12-02 10:12
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_scheduler_app", "0046_permission_consolidation")]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationTask",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "endpoint",
+                    models.CharField(max_length=256, verbose_name="Endpoint"),
+                ),
+                (
+                    "state",
+                    models.IntegerField(
+                        choices=[(0, "Queued"), (1, "Failed")],
+                        default=0,
+                        verbose_name="State",
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0, verbose_name="Attempts")),
+                (
+                    "next_attempt",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Next attempt"
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Created"),
+                ),
+                (
+                    "callback",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="lava_scheduler_app.NotificationCallback",
+                        verbose_name="Callback",
+                    ),
+                ),
+                (
+                    "notification",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="lava_scheduler_app.Notification",
+                        verbose_name="Notification",
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="lava_scheduler_app.NotificationRecipient",
+                        verbose_name="Recipient",
+                    ),
+                ),
+            ],
+            options={"index_together": {("state", "next_attempt")}},
+        )
+    ]
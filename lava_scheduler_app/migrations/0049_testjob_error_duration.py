@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.7 on 2019-12-11 10:27
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_scheduler_app", "0048_testjob_result_counters")]
+
+    operations = [
+        migrations.AddField(
+            model_name="testjob",
+            name="duration",
+            field=models.DurationField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                null=True,
+                verbose_name="Duration",
+            ),
+        ),
+        migrations.AddField(
+            model_name="testjob",
+            name="error_type",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=32,
+                null=True,
+                verbose_name="Error type",
+            ),
+        ),
+        migrations.AddField(
+            model_name="testjob",
+            name="error_msg",
+            field=models.TextField(
+                blank=True, editable=False, null=True, verbose_name="Error message"
+            ),
+        ),
+    ]
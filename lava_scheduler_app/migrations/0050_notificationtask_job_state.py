@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.7 on 2019-12-16 09:12
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_scheduler_app", "0049_testjob_error_duration")]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationtask",
+            name="job_health",
+            field=models.IntegerField(
+                blank=True,
+                choices=[
+                    (0, "Unknown"),
+                    (1, "Complete"),
+                    (2, "Incomplete"),
+                    (3, "Canceled"),
+                ],
+                null=True,
+                verbose_name="Job health",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationtask",
+            name="job_state",
+            field=models.IntegerField(
+                blank=True,
+                choices=[
+                    (0, "Submitted"),
+                    (1, "Scheduling"),
+                    (2, "Scheduled"),
+                    (3, "Running"),
+                    (4, "Canceling"),
+                    (5, "Finished"),
+                ],
+                null=True,
+                verbose_name="Job state",
+            ),
+        ),
+    ]
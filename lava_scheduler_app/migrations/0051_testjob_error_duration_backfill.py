@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.7 on 2019-12-17 14:05
+import yaml
+
+from django.db import migrations, models
+
+from lava_common.compat import yaml_load
+
+BATCH_SIZE = 1000
+
+
+def backfill(apps, schema_editor):
+    TestJob = apps.get_model("lava_scheduler_app", "TestJob")
+    TestCase = apps.get_model("lava_results_app", "TestCase")
+    db_alias = schema_editor.connection.alias
+    error_type_length = TestJob._meta.get_field("error_type").max_length
+
+    # Duration of the finished jobs, truncated to the second
+    last = TestJob.objects.using(db_alias).aggregate(last=models.Max("id"))["last"]
+    for start in range(0, (last or 0) + 1, BATCH_SIZE):
+        schema_editor.execute(
+            "UPDATE lava_scheduler_app_testjob "
+            "SET duration = date_trunc('second', end_time - start_time) "
+            "WHERE id >= %s AND id < %s "
+            "AND start_time IS NOT NULL AND end_time IS NOT NULL",
+            [start, start + BATCH_SIZE],
+        )
+
+    # Errors reported by the failed lava.job results (TestCase.RESULT_FAIL)
+    cases = TestCase.objects.using(db_alias).filter(
+        suite__name="lava", name="job", result=1
+    )
+    cases = cases.exclude(metadata=None).order_by("id")
+    last_id = 0
+    while True:
+        batch = list(
+            cases.filter(id__gt=last_id).values_list("id", "suite__job_id", "metadata")[
+                :BATCH_SIZE
+            ]
+        )
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        jobs = []
+        for (_, job_id, metadata) in batch:
+            try:
+                metadata = yaml_load(metadata)
+            except yaml.YAMLError:
+                continue
+            if not isinstance(metadata, dict):
+                continue
+            error_type = metadata.get("error_type")
+            error_msg = metadata.get("error_msg")
+            if error_type is None and error_msg is None:
+                continue
+            jobs.append(
+                TestJob(
+                    id=job_id,
+                    error_type=None
+                    if error_type is None
+                    else str(error_type)[:error_type_length],
+                    error_msg=None if error_msg is None else str(error_msg),
+                )
+            )
+        TestJob.objects.using(db_alias).bulk_update(jobs, ["error_type", "error_msg"])
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    # Commit each batch: the table is not locked during the whole backfill
+    atomic = False
+
+    dependencies = [
+        ("lava_scheduler_app", "0050_notificationtask_job_state"),
+        ("lava_results_app", "0019_query_refresh_mark"),
+    ]
+
+    operations = [migrations.RunPython(backfill, noop)]
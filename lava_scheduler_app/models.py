@@ -47,6 +47,7 @@ from lava_common.compat import yaml_dump, yaml_safe_load, yaml_safe_dump
 from lava_common.decorators import nottest
 from lava_results_app.utils import export_testcase
 from lava_scheduler_app import utils
+from lava_scheduler_app.auth import permission_cache
 from lava_scheduler_app.logutils import read_logs
 import lava_scheduler_app.environment as environment
 from lava_scheduler_app.managers import (
@@ -208,11 +209,8 @@ class RestrictedObject(models.Model):
         abstract = True
 
     def is_permission_restricted(self, perm):
-        app_label, codename = perm.split(".", 1)
-        perm_count = self.permissions.filter(
-            permission__content_type__app_label=app_label, permission__codename=codename
-        ).count()
-        return perm_count > 0
+        _, codename = perm.split(".", 1)
+        return permission_cache.is_restricted(self, codename)
 
     def has_any_permission_restrictions(self, perm):
         raise NotImplementedError("Should implement this")
@@ -681,12 +679,15 @@ class Device(RestrictedObject):
         return False
 
     def is_valid(self):
-        try:
-            rendered = self.load_configuration()
-            validate_device(rendered)
-        except (SubmissionException, yaml.YAMLError):
-            return False
-        return True
+        # The validation result is cached along with the rendered template
+        config = environment.device_configurations().get(self.hostname)
+        if config.valid is None:
+            try:
+                validate_device(config.load())
+                config.valid = True
+            except (SubmissionException, yaml.YAMLError):
+                config.valid = False
+        return config.valid
 
     def log_admin_entry(self, user, reason):
         if user is None:
@@ -822,16 +823,14 @@ class Device(RestrictedObject):
             except OSError:
                 return None
 
-        try:
-            template = environment.devices().get_template("%s.jinja2" % self.hostname)
-            device_template = template.render(**job_ctx)
-        except jinja2.TemplateError:
+        config = environment.device_configurations().get(self.hostname, job_ctx)
+        if config.rendered is None:
             return None
 
         if output_format == "yaml":
-            return device_template
+            return config.rendered
         else:
-            return yaml_safe_load(device_template)
+            return config.load()
 
     def minimise_configuration(self, data):
         """
@@ -870,6 +869,7 @@ class Device(RestrictedObject):
                 os.path.join(settings.DEVICES_PATH, "%s.jinja2" % self.hostname), "w"
             ) as f_out:
                 f_out.write(data)
+            environment.device_configurations().invalidate(self.hostname)
             return True
         except OSError as exc:
             logger = logging.getLogger("lava_scheduler_app")
@@ -879,26 +879,18 @@ class Device(RestrictedObject):
             return False
 
     def get_extends(self):
-        jinja_config = self.load_configuration(output_format="raw")
-        if not jinja_config:
+        config = environment.device_configurations().get(self.hostname)
+        if not config.raw:
             return None
 
-        env = jinja2.Environment(  # nosec - YAML, not HTML, no XSS scope.
-            autoescape=False
-        )
-        try:
-            ast = env.parse(jinja_config)
-            extends = list(ast.find_all(jinja2.nodes.Extends))
-            if len(extends) != 1:
-                logger = logging.getLogger("lava_scheduler_app")
-                logger.error("Found %d extends for %s", len(extends), self.hostname)
-                return None
-            else:
-                return os.path.splitext(extends[0].template.value)[0]
-        except jinja2.TemplateError as exc:
-            logger = logging.getLogger("lava_scheduler_app")
-            logger.error("Invalid template for %s: %s", self.hostname, str(exc))
+        logger = logging.getLogger("lava_scheduler_app")
+        if config.error is not None:
+            logger.error("Invalid template for %s: %s", self.hostname, config.error)
+            return None
+        if len(config.extends) != 1 or config.extends[0] is None:
+            logger.error("Found %d extends for %s", len(config.extends), self.hostname)
             return None
+        return os.path.splitext(config.extends[0])[0]
 
     def get_health_check(self):
         # Get the device dictionary
@@ -1407,12 +1399,10 @@ class TestJob(models.Model):
         editable=False,
     )
 
-    @property
-    def duration(self):
-        if self.end_time is None or self.start_time is None:
-            return None
-        # Only return seconds and not milliseconds
-        return datetime.timedelta(seconds=(self.end_time - self.start_time).seconds)
+    # Set when the job is finished. Only keep the seconds.
+    duration = models.DurationField(
+        verbose_name=_("Duration"), null=True, blank=True, editable=False, db_index=True
+    )
 
     STATE_SUBMITTED, STATE_SCHEDULING, STATE_SCHEDULED, STATE_RUNNING, STATE_CANCELING, STATE_FINISHED = range(
         6
@@ -1556,6 +1546,10 @@ class TestJob(models.Model):
         self.state = TestJob.STATE_FINISHED
 
         self.end_time = timezone.now()
+        if self.start_time is not None:
+            self.duration = datetime.timedelta(
+                seconds=int((self.end_time - self.start_time).total_seconds())
+            )
         # TODO: check that self.actual_device is locked by the
         # select_for_update on the TestJob
         # Skip non-scheduled jobs and dynamic_connections
@@ -1648,6 +1642,36 @@ class TestJob(models.Model):
     )
     failure_comment = models.TextField(null=True, blank=True)
 
+    # Test case counters, see lava_results_app.models.TestSuite
+    # They are only written with UPDATE queries, see save().
+    RESULT_COUNTERS = (
+        "count_pass",
+        "count_fail",
+        "count_skip",
+        "count_unknown",
+        "count_total",
+        "count_measurement",
+    )
+    count_pass = models.PositiveIntegerField(null=True, default=0)
+    count_fail = models.PositiveIntegerField(null=True, default=0)
+    count_skip = models.PositiveIntegerField(null=True, default=0)
+    count_unknown = models.PositiveIntegerField(null=True, default=0)
+    count_total = models.PositiveIntegerField(null=True, default=0)
+    count_measurement = models.PositiveIntegerField(null=True, default=0)
+
+    # Error reported by the lava.job result
+    error_type = models.CharField(
+        verbose_name=_("Error type"),
+        max_length=32,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+    )
+    error_msg = models.TextField(
+        verbose_name=_("Error message"), null=True, blank=True, editable=False
+    )
+
     @property
     def results_link(self):
         return reverse("lava.results.testjob", args=[self.id])
@@ -1703,6 +1727,21 @@ class TestJob(models.Model):
     def get_absolute_url(self):
         return reverse("lava.scheduler.job.detail", args=[self.display_id])
 
+    def save(self, *args, **kwargs):
+        # The result counters are incremented in the database while the test
+        # cases are saved. Saving an instance loaded before would write back
+        # the old values: skip them unless explicitly requested.
+        if not self._state.adding and not args and kwargs.get("update_fields") is None:
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.RESULT_COUNTERS
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
     @classmethod
     def from_yaml_and_user(cls, yaml_data, user, original_job=None):
         """
@@ -1878,6 +1917,15 @@ class TestJob(models.Model):
 
         return data
 
+    def set_error(self, error_type, error_msg):
+        """
+        Save the error reported by the lava.job result, truncating the error
+        type to the size of the field.
+        """
+        max_length = TestJob._meta.get_field("error_type").max_length
+        self.error_type = None if error_type is None else str(error_type)[:max_length]
+        self.error_msg = None if error_msg is None else str(error_msg)
+
     def set_failure_comment(self, message):
         if not self.failure_comment:
             self.failure_comment = message
@@ -2245,9 +2293,16 @@ class NotificationCallback(models.Model):
         verbose_name=_("Callback content-type"),
     )
 
-    def invoke_callback(self):
+    def invoke_callback(self, job=None):
+        """
+        Send the request to the callback url, with the data of the given job
+        (by default the job of the notification).
+        Return False if the request failed.
+        """
         logger = logging.getLogger("lava_scheduler_app")
         data = None
+        if job is None:
+            job = self.notification.test_job
 
         if self.method != NotificationCallback.GET:
             output = self.dataset in [
@@ -2258,16 +2313,12 @@ class NotificationCallback(models.Model):
                 NotificationCallback.RESULTS,
                 NotificationCallback.ALL,
             ]
-            data = self.notification.test_job.create_job_data(
-                token=self.token, output=output, results=results
-            )
+            data = job.create_job_data(token=self.token, output=output, results=results)
             # store callback_data for later retrieval & triage
-            job_data_file = os.path.join(
-                self.notification.test_job.output_dir, "job_data.gz"
-            )
+            job_data_file = os.path.join(job.output_dir, "job_data.gz")
             if data:
                 # allow for jobs cancelled in submitted state
-                utils.mkdir(self.notification.test_job.output_dir)
+                utils.mkdir(job.output_dir)
                 # only write the file once
                 if not os.path.exists(job_data_file):
                     with gzip.open(job_data_file, "wb") as output:
@@ -2300,6 +2351,82 @@ class NotificationCallback(models.Model):
 
         except Exception as ex:
             logger.warning("Problem sending request to %s: %s" % (self.url, ex))
+            return False
+        return True
+
+
+class NotificationTask(models.Model):
+    """
+    An email, IRC message or callback waiting to be sent by lava-notifier.
+    The tasks are created when the job changes state and sent
+    asynchronously, with retries. Tasks still failing after
+    NOTIFICATION_MAX_ATTEMPTS are kept in the failed state.
+    """
+
+    class Meta:
+        index_together = ["state", "next_attempt"]
+
+    notification = models.ForeignKey(
+        Notification, null=False, on_delete=models.CASCADE, verbose_name="Notification"
+    )
+
+    recipient = models.ForeignKey(
+        NotificationRecipient,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        verbose_name="Recipient",
+    )
+
+    callback = models.ForeignKey(
+        NotificationCallback,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        verbose_name="Callback",
+    )
+
+    # Where the notification is sent: smtp, irc://<server> or the scheme and
+    # host of the callback url. Used to limit the concurrency per endpoint.
+    endpoint = models.CharField(max_length=256, verbose_name="Endpoint")
+
+    # State and health of the job when the task was created. The notification
+    # is sent with these values even if the job changed in the meantime.
+    job_state = models.IntegerField(
+        choices=TestJob.STATE_CHOICES,
+        null=True,
+        blank=True,
+        verbose_name=_("Job state"),
+    )
+
+    job_health = models.IntegerField(
+        choices=TestJob.HEALTH_CHOICES,
+        null=True,
+        blank=True,
+        verbose_name=_("Job health"),
+    )
+
+    # Sent notifications are removed from the queue
+    STATE_QUEUED = 0
+    STATE_FAILED = 1
+    STATE_CHOICES = ((STATE_QUEUED, "Queued"), (STATE_FAILED, "Failed"))
+    state = models.IntegerField(
+        choices=STATE_CHOICES, default=STATE_QUEUED, verbose_name=_("State")
+    )
+
+    attempts = models.IntegerField(default=0, verbose_name=_("Attempts"))
+
+    next_attempt = models.DateTimeField(
+        default=timezone.now, verbose_name=_("Next attempt")
+    )
+
+    created = models.DateTimeField(
+        auto_now_add=True, editable=False, verbose_name=_("Created")
+    )
+
+    def __str__(self):
+        target = self.callback.url if self.callback is not None else self.recipient
+        return "%s: %s (%s)" % (self.notification, target, self.get_state_display())
 
 
 @nottest
@@ -20,6 +20,7 @@
 import contextlib
 import logging
 import re
+from urllib.parse import urlsplit
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -29,11 +30,12 @@ from django.db import IntegrityError
 
 from lava_scheduler_app import dbutils
 from lava_scheduler_app import utils
-from lava_results_app.models import Query, TestCase, TestSuite
+from lava_results_app.models import Query, TestCase
 from lava_scheduler_app.models import (
     Notification,
     NotificationCallback,
     NotificationRecipient,
+    NotificationTask,
     TestJob,
 )
 from linaro_django_xmlrpc.models import AuthToken
@@ -125,16 +127,82 @@ def create_callback(job, callback_data, notification):
     notification_callback.save()
 
 
+# Index of each result in the (pass, fail, skip) suite counts
+RESULT_COUNT_INDEX = {
+    TestCase.RESULT_PASS: 0,
+    TestCase.RESULT_FAIL: 1,
+    TestCase.RESULT_SKIP: 2,
+}
+
+
+def compare_results(new_cases, old_cases, suites, blacklist):
+    """
+    Compare the test cases of two jobs in memory.
+    new_cases and old_cases are lists of (id, suite name, name, result) and
+    suites is the set of the suite names found in both jobs.
+    Return a tuple with:
+    * the ids of the new test cases which name is not used by the old job
+    * the ids of the old test cases which name is not used by the new job
+    * the (pass, fail, skip) counts of the common suites for both jobs
+    * the new test cases which result changed as {id: old result}
+    """
+    new_names = set(case[2] for case in new_cases)
+    old_names = set(case[2] for case in old_cases)
+    added = [
+        case_id
+        for (case_id, _, name, _) in new_cases
+        if name not in old_names and name not in blacklist
+    ]
+    removed = [
+        case_id
+        for (case_id, _, name, _) in old_cases
+        if name not in new_names and name not in blacklist
+    ]
+
+    def count(cases):
+        counts = {suite: [0, 0, 0] for suite in suites}
+        for (_, suite, _, result) in cases:
+            if suite in counts and result in RESULT_COUNT_INDEX:
+                counts[suite][RESULT_COUNT_INDEX[result]] += 1
+        return {suite: tuple(values) for (suite, values) in counts.items()}
+
+    # Results of the old test cases: None when the name is not unique in
+    # the suite
+    old_results = {}
+    for (_, suite, name, result) in old_cases:
+        if suite in suites:
+            key = (suite, name)
+            old_results[key] = None if key in old_results else result
+
+    changed = {}
+    for (case_id, suite, name, result) in new_cases:
+        if suite not in suites:
+            continue
+        key = (suite, name)
+        if key not in old_results:
+            continue  # No matching TestCase, move on.
+        old_result = old_results[key]
+        if old_result is None:
+            logging.info(
+                "Multiple Test Cases with the equal name in TestSuite %s, could not compare",
+                suite,
+            )
+        elif old_result != result:
+            changed[case_id] = old_result
+
+    return (added, removed, count(new_cases), count(old_cases), changed)
+
+
 def get_notification_args(job):
     args = {}
     args["job"] = job
     args["url_prefix"] = "http://%s" % dbutils.get_domain()
-    # Get lava.job result if available
-    with contextlib.suppress(TestCase.DoesNotExist):
-        lava_job_obj = TestCase.objects.get(
-            suite__job=job, suite__name="lava", name="job"
-        )
-        args["lava_job_result"] = lava_job_obj.action_metadata
+    # Error reported by the lava.job result
+    if job.error_type or job.error_msg:
+        args["lava_job_result"] = {
+            "error_type": job.error_type,
+            "error_msg": job.error_msg,
+        }
 
     args["query"] = {}
     if job.notification.query_name or job.notification.entity:
@@ -150,107 +218,56 @@ def get_notification_args(job):
 
         args["query"]["compare_index"] = compare_index
         if compare_index is not None and job.notification.blacklist:
+            blacklist = job.notification.blacklist
+            old_job = args["query"]["results"][compare_index]
+
             # Get testsuites diffs between current job and latest complete
             # job from query.
-            new_suites = job.testsuite_set.all().exclude(
-                name__in=job.notification.blacklist
-            )
-            old_suites = (
-                args["query"]["results"][compare_index]
-                .testsuite_set.all()
-                .exclude(name__in=job.notification.blacklist)
+            new_suites = list(
+                job.testsuite_set.exclude(name__in=blacklist).order_by("id")
             )
-            left_suites_diff = new_suites.exclude(
-                name__in=old_suites.values_list("name", flat=True)
+            old_suites = list(
+                old_job.testsuite_set.exclude(name__in=blacklist).order_by("id")
             )
-            right_suites_diff = old_suites.exclude(
-                name__in=new_suites.values_list("name", flat=True)
-            )
-
-            args["query"]["left_suites_diff"] = left_suites_diff
-            args["query"]["right_suites_diff"] = right_suites_diff
+            new_suite_names = set(suite.name for suite in new_suites)
+            old_suite_names = set(suite.name for suite in old_suites)
+            args["query"]["left_suites_diff"] = [
+                suite for suite in new_suites if suite.name not in old_suite_names
+            ]
+            args["query"]["right_suites_diff"] = [
+                suite for suite in old_suites if suite.name not in new_suite_names
+            ]
 
-            # Get testcases diffs between current job and latest complete
-            # job from query.
-            new_cases = (
-                TestCase.objects.filter(suite__job=job)
-                .exclude(name__in=job.notification.blacklist)
-                .exclude(suite__name__in=job.notification.blacklist)
-            )
-            old_cases = (
-                TestCase.objects.filter(
-                    suite__job=args["query"]["results"][compare_index]
+            # Fetch the test cases of both jobs and compare them in memory.
+            def job_cases(test_job):
+                return list(
+                    TestCase.objects.filter(suite__job=test_job)
+                    .exclude(suite__name__in=blacklist)
+                    .order_by("id")
+                    .values_list("id", "suite__name", "name", "result")
                 )
-                .exclude(name__in=job.notification.blacklist)
-                .exclude(suite__name__in=job.notification.blacklist)
-            )
-
-            left_cases_diff = new_cases.exclude(
-                name__in=old_cases.values_list("name", flat=True)
-            )
-            right_cases_diff = old_cases.exclude(
-                name__in=new_cases.values_list("name", flat=True)
-            )
-
-            args["query"]["left_cases_diff"] = left_cases_diff
-            args["query"]["right_cases_diff"] = right_cases_diff
 
-            left_suites_intersection = new_suites.filter(
-                name__in=old_suites.values_list("name", flat=True)
+            (added, removed, left_count, right_count, changed) = compare_results(
+                job_cases(job),
+                job_cases(old_job),
+                new_suite_names & old_suite_names,
+                set(blacklist),
             )
+            args["query"]["left_suites_count"] = left_count
+            args["query"]["right_suites_count"] = right_count
 
-            # Format results.
-            left_suites_count = {}
-            for suite in left_suites_intersection:
-                left_suites_count[suite.name] = (
-                    suite.testcase_set.filter(result=TestCase.RESULT_PASS).count(),
-                    suite.testcase_set.filter(result=TestCase.RESULT_FAIL).count(),
-                    suite.testcase_set.filter(result=TestCase.RESULT_SKIP).count(),
-                )
-
-            right_suites_intersection = old_suites.filter(
-                name__in=new_suites.values_list("name", flat=True)
+            # Only load the test cases that are displayed.
+            cases = TestCase.objects.select_related("suite").in_bulk(
+                added + removed + list(changed)
             )
-
-            # Format results.
-            right_suites_count = {}
-            for suite in right_suites_intersection:
-                right_suites_count[suite.name] = (
-                    suite.testcase_set.filter(result=TestCase.RESULT_PASS).count(),
-                    suite.testcase_set.filter(result=TestCase.RESULT_FAIL).count(),
-                    suite.testcase_set.filter(result=TestCase.RESULT_SKIP).count(),
-                )
-
-            args["query"]["left_suites_count"] = left_suites_count
-            args["query"]["right_suites_count"] = right_suites_count
+            args["query"]["left_cases_diff"] = [cases[pk] for pk in added]
+            args["query"]["right_cases_diff"] = [cases[pk] for pk in removed]
 
             # Format {<Testcase>: old_result, ...}
-            testcases_changed = {}
-            for suite in left_suites_intersection:
-                try:
-                    old_suite = TestSuite.objects.get(
-                        name=suite.name, job=args["query"]["results"][compare_index]
-                    )
-                except TestSuite.DoesNotExist:
-                    continue  # No matching suite, move on.
-                for testcase in suite.testcase_set.all():
-                    try:
-                        old_testcase = TestCase.objects.get(
-                            suite=old_suite, name=testcase.name
-                        )
-                        if old_testcase and testcase.result != old_testcase.result:
-                            testcases_changed[
-                                testcase
-                            ] = old_testcase.get_result_display()
-                    except TestCase.DoesNotExist:
-                        continue  # No matching TestCase, move on.
-                    except TestCase.MultipleObjectsReturned:
-                        logging.info(
-                            "Multiple Test Cases with the equal name in TestSuite %s, could not compare",
-                            old_suite,
-                        )
-
-            args["query"]["testcases_changed"] = testcases_changed
+            results = dict(TestCase.RESULT_CHOICES)
+            args["query"]["testcases_changed"] = {
+                cases[pk]: results[old_result] for (pk, old_result) in changed.items()
+            }
 
     return args
 
@@ -275,76 +292,126 @@ def get_recipient_args(recipient):
     return user_data
 
 
-def send_notifications(job):
+def send_email_notification(job, recipient):
     logger = logging.getLogger("lava_scheduler_app")
+    try:
+        logger.info(
+            "[%d] sending email notification to %s", job.id, recipient.email_address
+        )
+        title = "LAVA notification for Test Job %s %s" % (job.id, job.description[:200])
+        kwargs = get_notification_args(job)
+        kwargs["user"] = get_recipient_args(recipient)
+        body = create_notification_body(job.notification.template, **kwargs)
+        return bool(
+            send_mail(title, body, settings.SERVER_EMAIL, [recipient.email_address])
+        )
+    except Exception as exc:
+        logger.exception(exc)
+        logger.warning(
+            "[%d] failed to send email notification to %s",
+            job.id,
+            recipient.email_address,
+        )
+        return False
+
+
+def send_irc_notification(job, recipient):
+    logger = logging.getLogger("lava_scheduler_app")
+    logger.info(
+        "[%d] sending IRC notification to %s on %s",
+        job.id,
+        recipient.irc_handle_name,
+        recipient.irc_server_name,
+    )
+    try:
+        irc_message = create_irc_notification(job)
+        utils.send_irc_notification(
+            Notification.DEFAULT_IRC_HANDLE,
+            recipient=recipient.irc_handle_name,
+            message=irc_message,
+            server=recipient.irc_server_name,
+        )
+        logger.info(
+            "[%d] IRC notification sent to %s", job.id, recipient.irc_handle_name
+        )
+        return True
+    # FIXME: this bare except should be constrained
+    except Exception as e:
+        logger.warning(
+            "[%d] IRC notification not sent. Reason: %s - %s",
+            job.id,
+            e.__class__.__name__,
+            str(e),
+        )
+        return False
+
+
+def enqueue_notifications(job):
+    """
+    Queue the emails, IRC messages and callbacks of the job notification.
+    They are sent asynchronously by lava-notifier, with the current state and
+    health of the job.
+    """
     notification = job.notification
-    # Prep template args.
-    kwargs = get_notification_args(job)
-    # Process notification callback.
+    snapshot = {"job_state": job.state, "job_health": job.health}
+    tasks = []
     for callback in notification.notificationcallback_set.all():
-        callback.invoke_callback()
+        url = urlsplit(callback.url or "")
+        tasks.append(
+            NotificationTask(
+                notification=notification,
+                callback=callback,
+                endpoint="%s://%s" % (url.scheme, url.netloc),
+                **snapshot
+            )
+        )
 
     for recipient in notification.notificationrecipient_set.all():
+        if recipient.status != NotificationRecipient.NOT_SENT:
+            continue
         if recipient.method == NotificationRecipient.EMAIL:
-            if recipient.status == NotificationRecipient.NOT_SENT:
-                try:
-                    logger.info(
-                        "[%d] sending email notification to %s",
-                        job.id,
-                        recipient.email_address,
-                    )
-                    title = "LAVA notification for Test Job %s %s" % (
-                        job.id,
-                        job.description[:200],
-                    )
-                    kwargs["user"] = get_recipient_args(recipient)
-                    body = create_notification_body(notification.template, **kwargs)
-                    result = send_mail(
-                        title, body, settings.SERVER_EMAIL, [recipient.email_address]
-                    )
-                    if result:
-                        recipient.status = NotificationRecipient.SENT
-                        recipient.save()
-                except Exception as exc:
-                    logger.exception(exc)
-                    logger.warning(
-                        "[%d] failed to send email notification to %s",
-                        job.id,
-                        recipient.email_address,
-                    )
-        else:  # IRC method
-            if recipient.status == NotificationRecipient.NOT_SENT:
-                if recipient.irc_server_name:
-
-                    logger.info(
-                        "[%d] sending IRC notification to %s on %s",
-                        job.id,
-                        recipient.irc_handle_name,
-                        recipient.irc_server_name,
-                    )
-                    try:
-                        irc_message = create_irc_notification(job)
-                        utils.send_irc_notification(
-                            Notification.DEFAULT_IRC_HANDLE,
-                            recipient=recipient.irc_handle_name,
-                            message=irc_message,
-                            server=recipient.irc_server_name,
-                        )
-                        recipient.status = NotificationRecipient.SENT
-                        recipient.save()
-                        logger.info(
-                            "[%d] IRC notification sent to %s",
-                            job.id,
-                            recipient.irc_handle_name,
-                        )
-                    # FIXME: this bare except should be constrained
-                    except Exception as e:
-                        logger.warning(
-                            "[%d] IRC notification not sent. Reason: %s - %s",
-                            job.id,
-                            e.__class__.__name__,
-                            str(e),
-                        )
+            endpoint = "smtp"
+        elif recipient.irc_server_name:
+            endpoint = "irc://%s" % recipient.irc_server_name
+        else:
+            continue
+        tasks.append(
+            NotificationTask(
+                notification=notification,
+                recipient=recipient,
+                endpoint=endpoint,
+                **snapshot
+            )
+        )
+    NotificationTask.objects.bulk_create(tasks)
+
+
+def send_notification(task):
+    """
+    Send the email, IRC message or callback of the given NotificationTask.
+    Return False if it should be retried.
+    """
+    # Describe the job as it was when the task was queued
+    job = task.notification.test_job
+    if task.job_state is not None:
+        job.state = task.job_state
+        job.health = task.job_health
+
+    if task.callback is not None:
+        return task.callback.invoke_callback(job)
+
+    recipient = task.recipient
+    # Already sent by a previous task
+    if recipient.status == NotificationRecipient.SENT:
+        return True
+    if recipient.method == NotificationRecipient.EMAIL:
+        sent = send_email_notification(job, recipient)
+    else:
+        sent = send_irc_notification(job, recipient)
+    if sent:
+        recipient.status = NotificationRecipient.SENT
+        recipient.save()
+    return sent
 
 
 def notification_criteria(criteria, state, health, old_health):
@@ -17,13 +17,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
+import contextlib
 import datetime
+import time
+import yaml
 
 from django.contrib.auth.models import User
 from django.db import transaction
 from django.utils import timezone
 
 from lava_common.compat import yaml_safe_load, yaml_safe_dump
+from lava_scheduler_app.auth import permission_cache
 from lava_scheduler_app.dbutils import match_vlan_interface
 from lava_scheduler_app.models import (
     DeviceType,
@@ -34,9 +39,11 @@ from lava_scheduler_app.models import (
 )
 
 
-def schedule(logger, available_dt=None):
+def schedule(logger, available_dt=None, index=None):
+    # The permissions might have been updated by another process
+    permission_cache.clear()
     (available_devices, jobs) = schedule_health_checks(logger, available_dt)
-    jobs.extend(schedule_jobs(logger, available_devices))
+    jobs.extend(schedule_jobs(logger, available_devices, index))
     return jobs
 
 
@@ -181,16 +188,277 @@ def schedule_health_check(device, definition):
     return job.id
 
 
-def schedule_jobs(logger, available_devices):
+class QueuedJob:
+    """
+    Scheduling information about a queued job.
+    Only the fields needed to match the job against a device are kept.
+    """
+
+    __slots__ = (
+        "id",
+        "state",
+        "priority",
+        "submit_time",
+        "target_group",
+        "submitter_id",
+        "device_type",
+        "tags",
+        "vland",
+    )
+
+    def __init__(
+        self,
+        job_id,
+        state,
+        priority,
+        submit_time,
+        target_group,
+        submitter_id,
+        device_type,
+        tags=frozenset(),
+        vland=None,
+    ):
+        self.id = job_id
+        self.state = state
+        self.priority = priority
+        self.submit_time = submit_time
+        self.target_group = target_group
+        self.submitter_id = submitter_id
+        self.device_type = device_type
+        self.tags = tags
+        self.vland = vland
+
+    @property
+    def key(self):
+        # Same order as the database query used to be:
+        # "-state", "-priority", "submit_time", "target_group", "id"
+        # With postgresql, NULL values are sorted last.
+        return (
+            -self.state,
+            -self.priority,
+            self.submit_time,
+            self.target_group is None,
+            self.target_group or "",
+            self.id,
+        )
+
+
+class SchedulingIndex:
+    """
+    In-memory index of the queued jobs, grouped by device-type and sorted by
+    priority.
+    The index is kept in sync with the database by calling sync(). Only the
+    new jobs are loaded from the database (with their tags and vland
+    requirements), so keeping the index alive between scheduling passes is
+    cheap.
+    """
+
+    # Maximum number of ids in a single "IN" query
+    CHUNK_SIZE = 1000
+
+    def __init__(self):
+        self.jobs = {}
+        self.queues = {}
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, job):
+        self.remove(job.id)
+        self.jobs[job.id] = job
+        bisect.insort(self.queues.setdefault(job.device_type, []), (job.key, job.id))
+
+    def remove(self, job_id):
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return
+        queue = self.queues[job.device_type]
+        item = (job.key, job.id)
+        idx = bisect.bisect_left(queue, item)
+        if idx < len(queue) and queue[idx] == item:
+            del queue[idx]
+
+    def queue(self, device_type):
+        """
+        Return the queued jobs for the given device-type, by priority
+        """
+        return [self.jobs[job_id] for (_, job_id) in self.queues.get(device_type, [])]
+
+    def handle_event(self, data):
+        """
+        Update the index from a testjob event.
+        Submitted jobs will be loaded by the next call to sync().
+        """
+        with contextlib.suppress(KeyError, TypeError, ValueError):
+            if data["state"] != "Submitted":
+                self.remove(int(data["job"]))
+
+    def sync(self, device_types=None):
+        """
+        Synchronize the index with the database.
+        Only the new jobs are fully loaded.
+        Returns the number of new and removed jobs.
+        """
+        query = TestJob.objects.filter(
+            state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING]
+        )
+        query = query.filter(actual_device__isnull=True)
+        query = query.filter(requested_device_type__isnull=False)
+        if device_types is not None:
+            query = query.filter(requested_device_type__pk__in=device_types)
+        rows = query.values_list(
+            "id",
+            "state",
+            "priority",
+            "submit_time",
+            "target_group",
+            "submitter_id",
+            "requested_device_type_id",
+        )
+
+        seen = set()
+        new_jobs = {}
+        for row in rows:
+            job = QueuedJob(*row)
+            seen.add(job.id)
+            current = self.jobs.get(job.id)
+            if current is None:
+                new_jobs[job.id] = job
+            elif current.key != job.key or current.device_type != job.device_type:
+                # Fields used for sorting can change (priority, state)
+                job.tags = current.tags
+                job.vland = current.vland
+                self.add(job)
+
+        # Drop the jobs that are not queued anymore
+        removed = [
+            job.id
+            for job in self.jobs.values()
+            if job.id not in seen
+            and (device_types is None or job.device_type in device_types)
+        ]
+        for job_id in removed:
+            self.remove(job_id)
+
+        # Load tags and vland requirements for the new jobs
+        ids = list(new_jobs.keys())
+        for i in range(0, len(ids), self.CHUNK_SIZE):
+            chunk = ids[i : i + self.CHUNK_SIZE]
+            tags = {}
+            for (job_id, tag_id) in TestJob.tags.through.objects.filter(
+                testjob_id__in=chunk
+            ).values_list("testjob_id", "tag_id"):
+                tags.setdefault(job_id, set()).add(tag_id)
+            for (job_id, definition) in TestJob.objects.filter(
+                id__in=chunk
+            ).values_list("id", "definition"):
+                job = new_jobs[job_id]
+                job.tags = frozenset(tags.get(job_id, []))
+                job.vland = self._parse_vland(definition)
+                self.add(job)
+
+        return (len(new_jobs), len(removed))
+
+    @staticmethod
+    def _parse_vland(definition):
+        # Only parse the definitions that could request vlans
+        if "lava-vland" not in definition:
+            return None
+        with contextlib.suppress(yaml.YAMLError, AttributeError, TypeError):
+            return yaml_safe_load(definition)["protocols"]["lava-vland"]
+        return None
+
+    def match(self, device_type, devices, accept, assign):
+        """
+        Match the queued jobs with the given devices in one pass.
+        For each job, by priority, the first device accepting the job
+        (accept(device, job)) is selected. If assign(device, job) does return
+        False, the job is no longer valid and is dropped from the index.
+        Returns the ids of the assigned jobs.
+        """
+        devices = list(devices)
+        assigned = []
+        for job in self.queue(device_type):
+            if not devices:
+                break
+            for device in devices:
+                if not accept(device, job):
+                    continue
+                if assign(device, job):
+                    assigned.append(job.id)
+                    devices.remove(device)
+                self.remove(job.id)
+                break
+        return assigned
+
+
+class DeviceMatcher:
+    """
+    Check that a queued job can run on the given device.
+    Results of the database lookups are cached for the duration of a
+    scheduling pass.
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.tags = {}
+        self.permissions = {}
+
+    def user(self, user_id):
+        if user_id not in self.users:
+            self.users[user_id] = User.objects.get(pk=user_id)
+        return self.users[user_id]
+
+    def __call__(self, device, job):
+        key = (device.hostname, job.submitter_id)
+        if key not in self.permissions:
+            self.permissions[key] = device.can_submit(self.user(job.submitter_id))
+        if not self.permissions[key]:
+            return False
+
+        if device.hostname not in self.tags:
+            self.tags[device.hostname] = frozenset(
+                device.tags.values_list("pk", flat=True)
+            )
+        if not job.tags.issubset(self.tags[device.hostname]):
+            return False
+
+        if job.vland is not None:
+            job_dict = {"protocols": {"lava-vland": job.vland}}
+            if not match_vlan_interface(device, job_dict):
+                return False
+        return True
+
+
+def schedule_jobs(logger, available_devices, index=None):
     logger.info("scheduling jobs:")
+    # Without a long-lived index, build one for this pass only
+    if index is None:
+        index = SchedulingIndex()
+
+    start = time.monotonic()
+    (new, removed) = index.sync(list(available_devices.keys()))
+    logger.debug(
+        "index: %d queued jobs (%d new, %d removed) in %.3fs",
+        len(index),
+        new,
+        removed,
+        time.monotonic() - start,
+    )
+
     jobs = []
     for dt in DeviceType.objects.all().order_by("name"):
         # Check that some devices are available for this device-type
         if not available_devices.get(dt.name):
             continue
+        # Nothing to schedule
+        if not index.queue(dt.name):
+            continue
         with transaction.atomic():
             jobs.extend(
-                schedule_jobs_for_device_type(logger, dt, available_devices[dt.name])
+                schedule_jobs_for_device_type(
+                    logger, dt, available_devices[dt.name], index
+                )
             )
 
     with transaction.atomic():
@@ -199,7 +467,7 @@ def schedule_jobs(logger, available_devices):
     return jobs
 
 
-def schedule_jobs_for_device_type(logger, dt, available_devices):
+def schedule_jobs_for_device_type(logger, dt, available_devices, index):
     logger.debug("- %s", dt.name)
 
     devices = dt.device_set.select_for_update()
@@ -211,7 +479,7 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
     # never be used.
     devices = devices.order_by("?")
 
-    jobs = []
+    valid_devices = []
     for device in devices:
         # Check that the device had been marked available by
         # schedule_health_checks. In fact, it's possible that a device is made
@@ -233,35 +501,19 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
                 % (prev_health_display, device.get_health_display(), device.hostname)
             )
             continue
+        valid_devices.append(device)
 
-        new_job = schedule_jobs_for_device(logger, device)
-        if new_job is not None:
-            jobs.append(new_job)
-    return jobs
-
-
-def schedule_jobs_for_device(logger, device):
-    jobs = TestJob.objects.filter(
-        state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING]
-    )
-    jobs = jobs.filter(actual_device__isnull=True)
-    jobs = jobs.filter(requested_device_type__pk=device.device_type.pk)
-    jobs = jobs.select_related("submitter")
-    jobs = jobs.order_by("-state", "-priority", "submit_time", "target_group", "id")
-
-    device_tags = set(device.tags.all())
-    for job in jobs:
-        if not device.can_submit(job.submitter):
-            continue
-
-        job_tags = set(job.tags.all())
-        if not job_tags.issubset(device_tags):
-            continue
-
-        job_dict = yaml_safe_load(job.definition)
-        if "protocols" in job_dict and "lava-vland" in job_dict["protocols"]:
-            if not match_vlan_interface(device, job_dict):
-                continue
+    def assign(device, queued):
+        # The index can be outdated: lock the job and check that it's still
+        # waiting for a device.
+        try:
+            job = TestJob.objects.select_for_update().get(
+                pk=queued.id,
+                state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING],
+                actual_device__isnull=True,
+            )
+        except TestJob.DoesNotExist:
+            return False
 
         logger.debug(
             " -> %s (%s, %s)",
@@ -276,8 +528,9 @@ def schedule_jobs_for_device(logger, device):
         else:
             job.go_state_scheduled(device)
         job.save()
-        return job.id
-    return None
+        return True
+
+    return index.match(dt.name, valid_devices, DeviceMatcher(), assign)
 
 
 def transition_multinode_jobs(logger):
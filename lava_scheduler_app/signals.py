@@ -29,14 +29,30 @@ from zmq.utils.strtypes import b
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
-from django.db.models.signals import post_init, post_save, pre_delete, pre_save
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 
 from lava_common.compat import yaml_safe_load
-from lava_scheduler_app.models import Device, TestJob, Worker
+from lava_scheduler_app.auth import permission_cache
+from lava_scheduler_app.models import (
+    Device,
+    GroupDevicePermission,
+    GroupDeviceTypePermission,
+    TestJob,
+    Worker,
+)
 from lava_scheduler_app.notifications import (
     create_notification,
+    enqueue_notifications,
     notification_criteria,
-    send_notifications,
 )
 
 
@@ -157,7 +173,7 @@ def testjob_notifications(sender, **kwargs):
                 job.notification
             except ObjectDoesNotExist:
                 create_notification(job, job_def["notify"])
-            send_notifications(job)
+            enqueue_notifications(job)
 
 
 @log_exception
@@ -244,6 +260,11 @@ def worker_post_handler(sender, **kwargs):
         send_event(".worker", "lavaserver", data)
 
 
+@log_exception
+def permission_cache_handler(sender, **kwargs):
+    permission_cache.clear()
+
+
 pre_delete.connect(
     testjob_pre_delete_handler,
     sender=TestJob,
@@ -264,6 +285,31 @@ pre_save.connect(
     dispatch_uid="testjob_notifications",
 )
 
+# Clear the permission cache when the permissions are updated and for each
+# request as the permissions might have been updated by another process
+for model in [GroupDevicePermission, GroupDeviceTypePermission]:
+    post_save.connect(
+        permission_cache_handler,
+        sender=model,
+        weak=False,
+        dispatch_uid="permission_cache_save_%s" % model.__name__,
+    )
+    post_delete.connect(
+        permission_cache_handler,
+        sender=model,
+        weak=False,
+        dispatch_uid="permission_cache_delete_%s" % model.__name__,
+    )
+m2m_changed.connect(
+    permission_cache_handler,
+    sender=User.groups.through,
+    weak=False,
+    dispatch_uid="permission_cache_user_groups",
+)
+request_started.connect(
+    permission_cache_handler, weak=False, dispatch_uid="permission_cache_request"
+)
+
 # Only activate theses signals when EVENT_NOTIFICATION is in use
 if settings.EVENT_NOTIFICATION:
     post_init.connect(
@@ -26,7 +26,6 @@ from django.utils.timesince import timesince
 import django_tables2 as tables
 
 from lava_common.compat import yaml_dump
-from lava_results_app.models import TestCase
 from lava_scheduler_app.models import TestJob, Device, DeviceType, Worker
 from lava_server.lavatable import LavaTable
 from django.db.models import Q
@@ -119,45 +118,31 @@ class JobErrorsTable(LavaTable):
     job = tables.Column(verbose_name="Job", empty_values=[""])
     job.orderable = False
     end_time = tables.DateColumn(format="Nd, g:ia")
-    end_time.orderable = False
     device = tables.Column(empty_values=[""])
     device.orderable = False
     error_type = tables.Column(empty_values=[""])
-    error_type.orderable = False
     error_msg = tables.Column(empty_values=[""])
     error_msg.orderable = False
 
-    def render_end_time(self, record):
-        if record.suite.job is None:
-            return ""
-        return record.suite.job.end_time
-
     def render_device(self, record):
-        if record.suite.job.actual_device is None:
+        if record.actual_device is None:
             return ""
         else:
             return mark_safe(  # nosec - internal data
                 '<a href="%s" title="device details">%s</a>'
                 % (
-                    record.suite.job.actual_device.get_absolute_url(),
-                    escape(record.suite.job.actual_device.hostname),
+                    record.actual_device.get_absolute_url(),
+                    escape(record.actual_device.hostname),
                 )
             )
 
-    def render_error_type(self, record):
-        return record.action_metadata["error_type"]
-
-    def render_error_msg(self, record):
-        return record.action_metadata["error_msg"]
-
     def render_job(self, record):
         return mark_safe(  # nosec - internal data
-            '<a href="%s">%s</a>'
-            % (record.suite.job.get_absolute_url(), record.suite.job.pk)
+            '<a href="%s">%s</a>' % (record.get_absolute_url(), record.pk)
         )
 
     class Meta(LavaTable.Meta):
-        model = TestCase
+        model = TestJob
         fields = ("job", "end_time", "device", "error_type", "error_msg")
         sequence = ("job", "end_time", "device", "error_type", "error_msg")
 
@@ -184,7 +169,6 @@ class JobTable(LavaTable):
         accessor="requested_device_type", verbose_name="Device type"
     )
     duration = tables.Column()
-    duration.orderable = False
     submit_time = tables.DateColumn(format="Nd, g:ia")
     end_time = tables.DateColumn(format="Nd, g:ia")
     state = tables.Column()
@@ -388,7 +372,6 @@ class FailedJobTable(JobTable):
     actions.orderable = False
     device = tables.Column(accessor="actual_device")
     duration = tables.Column()
-    duration.orderable = False
     failure_tags = TagsColumn()
     failure_comment = tables.Column(empty_values=())
     submit_time = tables.DateColumn("Nd, g:ia")
@@ -397,20 +380,9 @@ class FailedJobTable(JobTable):
     def render_failure_comment(self, record):
         if record.failure_comment:
             return record.failure_comment
-        try:
-            failure = TestCase.objects.get(
-                suite__job=record,
-                result=TestCase.RESULT_FAIL,
-                suite__name="lava",
-                name="job",
-            )
-        except TestCase.DoesNotExist:
-            return ""
-        action_metadata = failure.action_metadata
-        if action_metadata is not None and "error_msg" in action_metadata:
-            return yaml_dump(failure.action_metadata["error_msg"])
-        else:
-            return ""
+        if record.error_msg:
+            return yaml_dump(record.error_msg)
+        return ""
 
     class Meta(JobTable.Meta):
         fields = ("id", "actions", "state", "device", "submit_time")
@@ -467,7 +439,6 @@ class OverviewJobsTable(JobTable):
     actions.orderable = False
     device = tables.Column(accessor="actual_device", verbose_name="Device")
     duration = tables.Column()
-    duration.orderable = False
     submit_time = tables.DateColumn("Nd, g:ia")
     end_time = tables.DateColumn("Nd, g:ia")
 
@@ -495,7 +466,6 @@ class RecentJobsTable(JobTable):
     )
     actions.orderable = False
     duration = tables.Column()
-    duration.orderable = False
     submit_time = tables.DateColumn("Nd, g:ia")
     end_time = tables.DateColumn("Nd, g:ia")
 
@@ -26,7 +26,6 @@ import logging
 import os
 import simplejson
 import tarfile
-import re
 import voluptuous
 import yaml
 
@@ -38,7 +37,6 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied, FieldDoesNotExist
 from django.urls import reverse
 from django.db import transaction
-from django.db.models import Case, IntegerField, Sum, When
 from django.template.loader import render_to_string
 from django.http import (
     FileResponse,
@@ -48,6 +46,7 @@ from django.http import (
     HttpResponseForbidden,
     HttpResponseRedirect,
     JsonResponse,
+    StreamingHttpResponse,
 )
 from django.shortcuts import get_object_or_404, redirect, render
 from django.db.models import Q
@@ -56,7 +55,7 @@ from django.utils.timesince import timeuntil
 from django.views.decorators.http import require_POST
 from django_tables2 import RequestConfig
 
-from lava_common.compat import yaml_load, yaml_safe_load
+from lava_common.compat import yaml_safe_load
 from lava_common.schemas import validate
 
 from lava_server.views import index as lava_index
@@ -73,11 +72,20 @@ from lava_scheduler_app.models import (
 from lava_scheduler_app.dbutils import (
     device_type_summary,
     invalid_template,
+    job_reports,
     load_devicetype_template,
     testjob_submission,
     validate_job,
 )
-from lava_scheduler_app.logutils import open_logs, size_logs, read_logs
+from lava_scheduler_app.logutils import (
+    compute_timings,
+    iter_logs,
+    logs_line_count,
+    open_logs,
+    read_timings,
+    size_logs,
+    write_timings,
+)
 from lava_scheduler_app.templatetags.utils import udecode
 
 from lava_server.lavatable import LavaView
@@ -92,6 +100,7 @@ from lava_results_app.models import (
     QueryCondition,
     TestCase,
     TestData,
+    result_counts,
 )
 
 from django.contrib.auth.models import User
@@ -307,12 +316,11 @@ class DeviceTableView(JobTableView):
 
 class JobErrorsView(LavaView):
     def get_queryset(self):
-        q = TestCase.objects.filter(
-            suite__name="lava", result=TestCase.RESULT_FAIL
+        q = TestJob.objects.filter(
+            error_type__in=["Configuration", "Infrastructure", "Bug"]
         ).visible_by_user(self.request.user)
-        q = q.filter(metadata__regex="error_type: (Configuration|Infrastructure|Bug)")
-        q = q.select_related("suite", "suite__job__actual_device")
-        return q.order_by("-suite__job__id")
+        q = q.select_related("actual_device")
+        return q.order_by("-id")
 
 
 @BreadCrumb("Scheduler", parent=lava_index)
@@ -385,123 +393,11 @@ def workers(request):
     )
 
 
-def type_report_data(start_day, end_day, dt, health_check):
-    now = timezone.now()
-    start_date = now + datetime.timedelta(start_day)
-    end_date = now + datetime.timedelta(end_day)
-
-    res = TestJob.objects.filter(
-        actual_device__in=Device.objects.filter(device_type=dt),
-        health_check=health_check,
-        start_time__range=(start_date, end_date),
-    )
-    url = reverse("lava.scheduler.failure_report")
-    params = "start=%s&end=%s&device_type=%s&health_check=%d" % (
-        start_day,
-        end_day,
-        dt,
-        health_check,
-    )
-    return {
-        "pass": res.filter(health=TestJob.HEALTH_COMPLETE).count(),
-        "fail": res.filter(
-            health__in=[TestJob.HEALTH_CANCELED, TestJob.HEALTH_INCOMPLETE]
-        ).count(),
-        "date": start_date.strftime("%m-%d"),
-        "failure_url": "%s?%s" % (url, params),
-    }
-
-
-def device_report_data(start_day, end_day, device, health_check):
-    now = timezone.now()
-    start_date = now + datetime.timedelta(start_day)
-    end_date = now + datetime.timedelta(end_day)
-
-    res = TestJob.objects.filter(
-        actual_device=device,
-        health_check=health_check,
-        start_time__range=(start_date, end_date),
-    )
-    url = reverse("lava.scheduler.failure_report")
-    params = "start=%s&end=%s&device=%s&health_check=%d" % (
-        start_day,
-        end_day,
-        device.pk,
-        health_check,
-    )
-    return {
-        "pass": res.filter(health=TestJob.HEALTH_COMPLETE).count(),
-        "fail": res.filter(
-            health__in=[TestJob.HEALTH_CANCELED, TestJob.HEALTH_INCOMPLETE]
-        ).count(),
-        "date": start_date.strftime("%m-%d"),
-        "failure_url": "%s?%s" % (url, params),
-    }
-
-
-def job_report(start_day, end_day, health_check):
-    now = timezone.now()
-    start_date = now + datetime.timedelta(start_day)
-    end_date = now + datetime.timedelta(end_day)
-
-    res = TestJob.objects.filter(
-        health_check=health_check, start_time__range=(start_date, end_date)
-    )
-    res = res.filter(state=TestJob.STATE_FINISHED)
-    res = res.values("health")
-    res = res.aggregate(
-        passing=Sum(
-            Case(
-                When(health=TestJob.HEALTH_COMPLETE, then=1),
-                default=0,
-                output_field=IntegerField(),
-            )
-        ),
-        failing=Sum(
-            Case(
-                When(
-                    health__in=[TestJob.HEALTH_CANCELED, TestJob.HEALTH_INCOMPLETE],
-                    then=1,
-                ),
-                default=0,
-                output_field=IntegerField(),
-            )
-        ),
-    )
-
-    url = reverse("lava.scheduler.failure_report")
-    params = "start=%s&end=%s&health_check=%d" % (start_day, end_day, health_check)
-    return {
-        "pass": res["passing"] or 0,
-        "fail": res["failing"] or 0,
-        "date": start_date.strftime("%m-%d"),
-        "failure_url": "%s?%s" % (url, params),
-    }
-
-
 @BreadCrumb("Reports", parent=index)
 def reports(request):
-    health_day_report = []
-    health_week_report = []
-    job_day_report = []
-    job_week_report = []
-    for day in reversed(range(7)):
-        health_day_report.append(job_report(day * -1 - 1, day * -1, True))
-        job_day_report.append(job_report(day * -1 - 1, day * -1, False))
-    for week in reversed(range(10)):
-        health_week_report.append(job_report(week * -7 - 7, week * -7, True))
-        job_week_report.append(job_report(week * -7 - 7, week * -7, False))
-    return render(
-        request,
-        "lava_scheduler_app/reports.html",
-        {
-            "health_week_report": health_week_report,
-            "health_day_report": health_day_report,
-            "job_week_report": job_week_report,
-            "job_day_report": job_day_report,
-            "bread_crumb_trail": BreadCrumbTrail.leading_to(index),
-        },
-    )
+    data = job_reports()
+    data["bread_crumb_trail"] = BreadCrumbTrail.leading_to(index)
+    return render(request, "lava_scheduler_app/reports.html", data)
 
 
 @BreadCrumb("Failure Report", parent=reports)
@@ -962,28 +858,9 @@ def device_type_health_history_log(request, pk):
 @BreadCrumb("Report", parent=device_type_detail, needs=["pk"])
 def device_type_reports(request, pk):
     device_type = get_object_or_404(DeviceType, pk=pk)
-    health_day_report = []
-    health_week_report = []
-    job_day_report = []
-    job_week_report = []
-    for day in reversed(range(7)):
-        health_day_report.append(
-            type_report_data(day * -1 - 1, day * -1, device_type, True)
-        )
-        job_day_report.append(
-            type_report_data(day * -1 - 1, day * -1, device_type, False)
-        )
-    for week in reversed(range(10)):
-        health_week_report.append(
-            type_report_data(week * -7 - 7, week * -7, device_type, True)
-        )
-        job_week_report.append(
-            type_report_data(week * -7 - 7, week * -7, device_type, False)
-        )
-
     long_running = (
         TestJob.objects.filter(
-            actual_device__in=Device.objects.filter(device_type=device_type),
+            actual_device__device_type=device_type,
             state__in=[TestJob.STATE_RUNNING, TestJob.STATE_CANCELING],
         )
         .visible_by_user(request.user)
@@ -992,15 +869,12 @@ def device_type_reports(request, pk):
     return render(
         request,
         "lava_scheduler_app/devicetype_reports.html",
-        {
-            "device_type": device_type,
-            "health_week_report": health_week_report,
-            "health_day_report": health_day_report,
-            "job_week_report": job_week_report,
-            "job_day_report": job_day_report,
-            "long_running": long_running,
-            "bread_crumb_trail": BreadCrumbTrail.leading_to(device_type_reports, pk=pk),
-        },
+        dict(
+            job_reports(device_type=device_type),
+            device_type=device_type,
+            long_running=long_running,
+            bread_crumb_trail=BreadCrumbTrail.leading_to(device_type_reports, pk=pk),
+        ),
     )
 
 
@@ -1107,7 +981,7 @@ def job_list(request):
 
 @BreadCrumb("Errors", parent=job_list)
 def job_errors(request):
-    data = JobErrorsView(request, model=TestCase, table_class=JobErrorsTable)
+    data = JobErrorsView(request, model=TestJob, table_class=JobErrorsTable)
     ptable = JobErrorsTable(
         data.get_table_data(), request=request, prefix="job_errors_"
     )
@@ -1215,6 +1089,37 @@ def job_submit(request):
         return render(request, "lava_scheduler_app/job_submit.html", response_data)
 
 
+class LogData:
+    """
+    Lazily parse the job logs while rendering the template.
+    The number of lines is known in advance, from the index, so the template
+    does not have to load the whole logs in memory.
+    The logs are read up to their size at creation time: the lines appended
+    while rendering are left to the incremental updates.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.size = size_logs(directory)
+        self.count = logs_line_count(directory, self.size)
+        self.results = {}
+        self.invalid = False
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        try:
+            for line in iter_logs(self.directory, 0, self.count, self.size):
+                if line["lvl"] == "results":
+                    key = (line["msg"].get("definition"), line["msg"].get("case"))
+                    if key in self.results:
+                        line["msg"]["case_id"] = self.results[key]
+                yield line
+        except (OSError, yaml.YAMLError):
+            self.invalid = True
+
+
 @BreadCrumb("{pk}", parent=job_list, needs=["pk"])
 def job_detail(request, pk):
     job = get_restricted_job(request.user, pk, request=request)
@@ -1288,43 +1193,26 @@ def job_detail(request, pk):
             log_data = []
             data["size_warning"] = True
         else:
-            log_data = read_logs(job.output_dir)
-            log_data = yaml_load(log_data)
+            log_data = LogData(job.output_dir)
     except OSError:
         log_data = []
-    except yaml.YAMLError:
-        log_data = None
 
     if log_data:
-        test_case_count = TestCase.objects.filter(suite__job=job).count()
+        test_case_count = result_counts(job, TestCase.objects.filter(suite__job=job))[
+            "total"
+        ]
         if test_case_count <= settings.TESTCASE_COUNT_LIMIT:
-            results = {
+            log_data.results = {
                 (t.suite.name, t.name): t.id
                 for t in TestCase.objects.filter(suite__job=job).select_related("suite")
             }
-            # list all related results
-            for line in [line for line in log_data if line["lvl"] == "results"]:
-                key = (line["msg"].get("definition"), line["msg"].get("case"))
-                if key in results:
-                    line["msg"]["case_id"] = results[key]
 
-    # Get lava.job result if available
+    # Error reported by the lava.job result
     lava_job_result = None
-    with contextlib.suppress(TestCase.DoesNotExist):
-        lava_job_obj = TestCase.objects.get(
-            suite__job=job, suite__name="lava", name="job"
-        )
-        # Only print it if it's a failure
-        if lava_job_obj.result == TestCase.RESULT_FAIL:
-            lava_job_result = lava_job_obj.action_metadata
+    if job.error_type or job.error_msg:
+        lava_job_result = {"error_type": job.error_type, "error_msg": job.error_msg}
 
-    data.update(
-        {
-            "log_data": log_data if log_data else [],
-            "invalid_log_data": log_data is None,
-            "lava_job_result": lava_job_result,
-        }
-    )
+    data.update({"log_data": log_data, "lava_job_result": lava_job_result})
 
     return render(request, "lava_scheduler_app/job.html", data)
 
@@ -1531,72 +1419,40 @@ def job_status(request, pk):
 
 def job_timing(request, pk):
     job = get_restricted_job(request.user, pk, request=request)
-    try:
-        data = read_logs(job.output_dir)
-        logs = yaml_load(data)
-    except OSError:
-        raise Http404
-
-    # start and end patterns
-    pattern_start = re.compile(
-        "^start: (?P<level>[\\d.]+) (?P<action>[\\w_-]+) \\(timeout (?P<timeout>\\d+:\\d+:\\d+)\\)"
-    )
-    pattern_end = re.compile(
-        "^end: (?P<level>[\\d.]+) (?P<action>[\\w_-]+) \\(duration (?P<duration>\\d+:\\d+:\\d+)\\)"
-    )
+    table = read_timings(job.output_dir)
+    if table is None:
+        try:
+            table = compute_timings(job.output_dir)
+        except OSError:
+            raise Http404
+        # Store the table for the next requests
+        if job.state == TestJob.STATE_FINISHED:
+            with contextlib.suppress(OSError):
+                write_timings(job.output_dir, table)
 
-    timings = {}
     total_duration = 0
     max_duration = 0
     summary = []
-    for line in logs:
-        # Only parse debug and info levels
-        if line["lvl"] not in ["debug", "info"]:
-            continue
-
-        # Will raise if the log message is a python object
-        try:
-            match = pattern_start.match(line["msg"])
-        except TypeError:
-            continue
-
-        if match is not None:
-            d = match.groupdict()
-            parts = d["timeout"].split(":")
-            timeout = float(parts[0]) * 3600 + float(parts[1]) * 60 + float(parts[2])
-            timings[d["level"]] = {"name": d["action"], "timeout": float(timeout)}
-            continue
-
-        # No need to catch TypeError here as we know it's a string
-        match = pattern_end.match(line["msg"])
-        if match is not None:
-            d = match.groupdict()
-            # TODO: validate does not have a proper start line
-            if d["action"] == "validate":
-                continue
-            level = d["level"]
-            parts = d["duration"].split(":")
-            duration = float(parts[0]) * 3600 + float(parts[1]) * 60 + float(parts[2])
-            # We create the entry because with some timeout, the start line
-            # might be missing.
-            timings.setdefault(level, {})["duration"] = duration
-
-            max_duration = max(max_duration, duration)
-            if "." not in level:
-                total_duration += duration
-                summary.append([d["action"], duration, 0])
-
-    levels = sorted(timings.keys())
-
-    # Construct the report
     pipeline = []
-    for lvl in levels:
-        duration = timings[lvl].get("duration", 0.0)
-        timeout = timings[lvl].get("timeout", 0.0)
-        name = timings[lvl].get("name", "???")
+    for action in table:
+        duration = action["duration"] or 0.0
+        timeout = action["timeout"] or 0.0
         pipeline.append(
-            (lvl, name, duration, timeout, bool(duration >= (timeout * 0.85)))
+            (
+                action["level"],
+                action["action"],
+                duration,
+                timeout,
+                bool(duration >= (timeout * 0.85)),
+            )
         )
+        # Actions without an end line are not part of the summary
+        if action["duration"] is None:
+            continue
+        max_duration = max(max_duration, duration)
+        if "." not in action["level"]:
+            total_duration += duration
+            summary.append([action["action"], duration, 0])
 
     # Compute the percentage
     if total_duration:
@@ -1676,14 +1532,10 @@ def job_log_incremental(request, pk):
         response["X-Size-Warning"] = "1"
         return response
 
-    try:
-        data = read_logs(job.output_dir, first_line)
-        data = yaml_load(data)
-        # When reaching EOF, yaml.load does return None instead of []
-        if not data:
-            data = []
-        else:
-            for line in data:
+    def stream(logs):
+        yield "["
+        try:
+            for index, line in enumerate(logs):
                 line["msg"] = udecode(line["msg"])
                 if line["lvl"] == "results":
                     case_id = TestCase.objects.filter(
@@ -1693,11 +1545,14 @@ def job_log_incremental(request, pk):
                     ).values_list("id", flat=True)
                     if case_id:
                         line["msg"]["case_id"] = case_id[0]
+                yield ("," if index else "") + simplejson.dumps(line)
+        except (OSError, yaml.YAMLError):
+            pass
+        yield "]"
 
-    except (OSError, StopIteration, yaml.YAMLError):
-        data = []
-
-    response = HttpResponse(simplejson.dumps(data), content_type="application/json")
+    response = StreamingHttpResponse(
+        stream(iter_logs(job.output_dir, first_line)), content_type="application/json"
+    )
 
     if job.state == TestJob.STATE_FINISHED:
         response["X-Is-Finished"] = "1"
@@ -2000,23 +1855,6 @@ def device_reports(request, pk):
     device = get_object_or_404(Device, pk=pk)
     if not device.can_view(request.user):
         raise PermissionDenied()
-    health_day_report = []
-    health_week_report = []
-    job_day_report = []
-    job_week_report = []
-    for day in reversed(range(7)):
-        health_day_report.append(
-            device_report_data(day * -1 - 1, day * -1, device, True)
-        )
-        job_day_report.append(device_report_data(day * -1 - 1, day * -1, device, False))
-    for week in reversed(range(10)):
-        health_week_report.append(
-            device_report_data(week * -7 - 7, week * -7, device, True)
-        )
-        job_week_report.append(
-            device_report_data(week * -7 - 7, week * -7, device, False)
-        )
-
     long_running = (
         TestJob.objects.filter(
             actual_device=device,
@@ -2028,15 +1866,12 @@ def device_reports(request, pk):
     return render(
         request,
         "lava_scheduler_app/device_reports.html",
-        {
-            "device": device,
-            "health_week_report": health_week_report,
-            "health_day_report": health_day_report,
-            "job_week_report": job_week_report,
-            "job_day_report": job_day_report,
-            "long_running": long_running,
-            "bread_crumb_trail": BreadCrumbTrail.leading_to(device_reports, pk=pk),
-        },
+        dict(
+            job_reports(device=device),
+            device=device,
+            long_running=long_running,
+            bread_crumb_trail=BreadCrumbTrail.leading_to(device_reports, pk=pk),
+        ),
     )
 
 
@@ -18,24 +18,25 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
 import os
 import xmlrpc.client
 import yaml
 
-from django.http import Http404
 from django.conf import settings
-from django.contrib.auth.models import Group
-from django.core.exceptions import PermissionDenied
+from django.contrib.auth.models import AnonymousUser, Group
+from django.db.models import Q
 
 from lava_common.compat import yaml_safe_dump, yaml_safe_load
 from lava_common.version import __version__
+from lava_scheduler_app import environment
 from lava_scheduler_app.api import check_perm
-from lava_scheduler_app.views import get_restricted_job
 from lava_scheduler_app.models import (
     Device,
     DeviceType,
     GroupDevicePermission,
     GroupDeviceTypePermission,
+    TestJob,
 )
 from linaro_django_xmlrpc.models import errors, Mapper, SystemAPI
 
@@ -247,17 +248,34 @@ class LavaSystemAPI(SystemAPI):
             raise xmlrpc.client.Fault(
                 errors.BAD_REQUEST, "job list argument must be a list"
             )
-        username = self._switch_user(username)
+        self._switch_user(username)
+
+        # Job ids are either primary keys or multinode sub ids ("x.y")
+        pks = set()
+        sub_ids = set()
+        for job_id in job_list:
+            if "." in str(job_id):
+                sub_ids.add(str(job_id))
+            else:
+                with contextlib.suppress(TypeError, ValueError):
+                    pks.add(int(job_id))
+
+        jobs = TestJob.objects.filter(Q(pk__in=pks) | Q(sub_id__in=sub_ids))
+        existing = set()
+        for (pk, sub_id) in jobs.values_list("id", "sub_id"):
+            existing.add(str(pk))
+            if sub_id:
+                existing.add(sub_id)
+
+        # Every existing job can be viewed
         retval = {}
         for job_id in job_list:
-            try:
-                get_restricted_job(username, job_id)
-            except Http404:
-                continue
-            except PermissionDenied:
-                retval[str(job_id)] = False
-                continue
-            retval[str(job_id)] = True
+            key = str(job_id)
+            if "." not in key:
+                with contextlib.suppress(ValueError):
+                    key = str(int(key))
+            if key in existing:
+                retval[str(job_id)] = True
         return retval
 
     def user_can_view_bundles(self, bundle_list, username=None):
@@ -363,18 +381,27 @@ class LavaSystemAPI(SystemAPI):
             raise xmlrpc.client.Fault(
                 errors.BAD_REQUEST, "device list argument must be a list"
             )
-        username = self._switch_user(username)
+        user = self._switch_user(username)
+        # Inactive users only see the unrestricted devices, like anonymous
+        # users
+        if not user.is_active:
+            user = AnonymousUser()
+
+        devices = Device.objects.filter(hostname__in=device_list)
+        device_types = dict(devices.values_list("hostname", "device_type__name"))
+        visible_devices = set(
+            devices.visible_by_user(user).values_list("hostname", flat=True)
+        )
+
         retval = {}
         for hostname in device_list:
-            try:
-                device = Device.objects.get(hostname=hostname)
-            except Device.DoesNotExist:
+            if hostname not in device_types:
                 continue
-            device_type = device.device_type
-            retval.setdefault(device_type.name, [])
-            visible = device.can_view(username)
+            device_type = device_types[hostname]
+            retval.setdefault(device_type, [])
+            visible = hostname in visible_devices
             if visible:
-                retval[device_type.name].append(
+                retval[device_type].append(
                     {
                         hostname: {
                             "is_pipeline": True,
@@ -384,7 +411,7 @@ class LavaSystemAPI(SystemAPI):
                     }
                 )
             else:
-                retval[device_type.name].append({hostname: {"visible": visible}})
+                retval[device_type].append({hostname: {"visible": visible}})
         return retval
 
     def user_can_submit_to_types(self, type_list, username=None):
@@ -443,14 +470,17 @@ class LavaSystemAPI(SystemAPI):
             )
         user = self._switch_user(username)
 
-        retval = {}
         device_types = DeviceType.objects.filter(name__in=type_list)
-
-        for device_type in device_types:
-            accessible = False
-            if user.has_perm(DeviceType.SUBMIT_PERMISSION, device_type):
-                accessible = True
-            retval[device_type.name] = accessible
+        retval = {name: False for name in device_types.values_list("name", flat=True)}
+        if not user.is_active:
+            return retval
+        # Same as user.has_perm(): the permission should be granted
+        # explicitly, either globally or to one of the groups of the user.
+        perm = DeviceType.SUBMIT_PERMISSION
+        if not (user.is_superuser or user.has_perm(perm)):
+            device_types = device_types.filter_by_perm(perm, user).exclude(perm_count=0)
+        for name in device_types.values_list("name", flat=True):
+            retval[name] = True
         return retval
 
     def pipeline_network_map(self, switch=None):
@@ -487,29 +517,22 @@ class LavaSystemAPI(SystemAPI):
 
         """
         self._authenticate()
-        # get all device dictionaries, build the entire map.
-        dictionaries = [
-            (device.hostname, device.load_configuration())
-            for device in Device.objects.visible_by_user(self.user)
-        ]
+        # Build the entire map from the cached device configurations: only the
+        # device dictionaries modified since the last call are rendered again.
+        configurations = environment.device_configurations()
         network_map = {"switches": {}}
-        for (hostname, params) in dictionaries:
-            if "interfaces" not in params:
-                continue
-            for interface in params["interfaces"]:
-                for map_switch, port in params["map"][interface].items():
-                    port_list = []
-                    device = {
-                        "interface": interface,
-                        "mac": params["mac_addr"][interface],
-                        "sysfs": params["sysfs"][interface],
-                        "hostname": hostname,
-                    }
-                    port_list.append({"port": port, "device": device})
-                    switch_port = network_map["switches"].setdefault(map_switch, [])
-                    # Any switch can only have one entry for one port
-                    if port not in switch_port:
-                        switch_port.extend(port_list)
+        ports = {}
+        for hostname in Device.objects.visible_by_user(self.user).values_list(
+            "hostname", flat=True
+        ):
+            for (map_switch, port, interface) in configurations.get(hostname).network():
+                # Any switch can only have one entry for one port
+                if port in ports.setdefault(map_switch, set()):
+                    continue
+                ports[map_switch].add(port)
+                network_map["switches"].setdefault(map_switch, []).append(
+                    {"port": port, "device": dict(interface, hostname=hostname)}
+                )
 
         if switch:
             if switch in network_map["switches"]:
@@ -129,7 +129,7 @@ class LAVADaemonCommand(BaseCommand):
         return (pipe_r, pipe_w)
 
 
-def watch_directory(directory):
+def watch_directory(directory, inotify_fd=None):
     IN_MODIFY = 0x00000002
     IN_ATTRIB = 0x00000004
     IN_MOVED_FROM = 0x00000040
@@ -152,11 +152,13 @@ def watch_directory(directory):
 
     # watch a directory using inotify
     # return the corresponding file descriptor
+    # If inotify_fd is given, the directory is added to this file descriptor.
     libc_name = ctypes.util.find_library("c")
     libc = ctypes.cdll.LoadLibrary(libc_name)
 
     # create the inotify file descriptor
-    inotify_fd = libc.inotify_init()
+    if inotify_fd is None:
+        inotify_fd = libc.inotify_init()
     # watch the "test" directory
     ret = libc.inotify_add_watch(inotify_fd, directory.encode("utf-8"), IN_EVENTS)
     return None if ret == -1 else inotify_fd
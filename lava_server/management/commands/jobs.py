@@ -25,6 +25,7 @@ import re
 from shutil import chown, rmtree
 import time
 import voluptuous
+import yaml
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -35,6 +36,13 @@ from django.utils import timezone
 
 from lava_common.compat import yaml_safe_load
 from lava_common.schemas import validate
+from lava_scheduler_app.logutils import (
+    compress_logs,
+    compute_timings,
+    is_block_compressed,
+    read_timings,
+    write_timings,
+)
 from lava_scheduler_app.models import TestJob
 from lava_server.compat import get_sub_parser_class
 
@@ -44,6 +52,13 @@ def _create_output_size(base, size):
     chown(str(base / "output.yaml.size"), "lavaserver", "lavaserver")
 
 
+def _compress_logs(base):
+    size = compress_logs(base)
+    chown(str(base / "output.yaml.xz"), "lavaserver", "lavaserver")
+    chown(str(base / "output.yaml.xz.idx"), "lavaserver", "lavaserver")
+    return size
+
+
 class Command(BaseCommand):
     help = "Manage jobs"
 
@@ -178,6 +193,47 @@ class Command(BaseCommand):
             help="Be nice with the system by sleeping regularly",
         )
 
+        timings = sub.add_parser(
+            "timings", help="Compute and store the action timings of finished jobs"
+        )
+        timings.add_argument(
+            "--newer-than",
+            default=None,
+            type=str,
+            help="Only jobs newer than this. The time is of the "
+            "form: 1h (one hour) or 2d (two days). "
+            "By default, all jobs are considered.",
+        )
+        timings.add_argument(
+            "--older-than",
+            default=None,
+            type=str,
+            help="Only jobs older than this. The time is of the "
+            "form: 1h (one hour) or 2d (two days). "
+            "By default, all jobs are considered.",
+        )
+        timings.add_argument(
+            "--submitter", default=None, type=str, help="Filter jobs by submitter"
+        )
+        timings.add_argument(
+            "--force",
+            default=False,
+            action="store_true",
+            help="Recompute the timings even if already stored",
+        )
+        timings.add_argument(
+            "--dry-run",
+            default=False,
+            action="store_true",
+            help="Do not store the timings, simulate the output",
+        )
+        timings.add_argument(
+            "--slow",
+            default=False,
+            action="store_true",
+            help="Be nice with the system by sleeping regularly",
+        )
+
     def handle(self, *_, **options):
         """ forward to the right sub-handler """
         if options["sub_command"] == "rm":
@@ -205,6 +261,15 @@ class Command(BaseCommand):
                 options["dry_run"],
                 options["slow"],
             )
+        elif options["sub_command"] == "timings":
+            self.handle_timings(
+                options["older_than"],
+                options["newer_than"],
+                options["submitter"],
+                options["force"],
+                options["dry_run"],
+                options["slow"],
+            )
 
     def handle_fail(self, job_id):
         try:
@@ -368,37 +433,93 @@ class Command(BaseCommand):
         for (index, job) in enumerate(jobs):
             base = pathlib.Path(job.output_dir)
             if not (base / "output.yaml").exists():
-                if (base / "output.yaml.size").exists():
+                if not (base / "output.yaml.xz").exists():
+                    continue
+                if is_block_compressed(base):
                     self.stdout.write(
                         "* %d (%s): %s [SKIP]" % (job.id, job.end_time, job.output_dir)
                     )
-                elif (base / "output.yaml.xz").exists():
-                    self.stdout.write(
-                        "* %d (%s): %s [create size file]"
-                        % (job.id, job.end_time, job.output_dir)
-                    )
-                    if not simulate:
-                        with contextlib.suppress(FileNotFoundError):
-                            with lzma.open(str(base / "output.yaml.xz"), "rb") as f_in:
-                                _create_output_size(base, f_in.seek(0, 2))
-                continue
+                    continue
+                # Logs compressed as a single xz stream: convert them to the
+                # block-compressed format
+                self.stdout.write(
+                    "* %d (%s): %s [convert to block-compressed logs]"
+                    % (job.id, job.end_time, job.output_dir)
+                )
+            else:
+                self.stdout.write(
+                    "* %d (%s): %s" % (job.id, job.end_time, job.output_dir)
+                )
 
-            self.stdout.write("* %d (%s): %s" % (job.id, job.end_time, job.output_dir))
             try:
                 if not simulate:
-                    # Read the logs
-                    data = (base / "output.yaml").read_bytes()
-                    # Save the uncompressed size for later use
-                    _create_output_size(base, len(data))
-                    # Compresse the logs
-                    with lzma.open(str(base / "output.yaml.xz"), "wb") as f_out:
-                        f_out.write(data)
-                    chown(str(base / "output.yaml.xz"), "lavaserver", "lavaserver")
+                    # Compress the logs and save the uncompressed size for
+                    # later use
+                    _create_output_size(base, _compress_logs(base))
                     # Remove the original file
-                    (base / "output.yaml").unlink()
-            except OSError as exc:
+                    with contextlib.suppress(FileNotFoundError):
+                        (base / "output.yaml").unlink()
+            except (OSError, lzma.LZMAError) as exc:
                 self.stderr.write("  -> Unable to compress the logs: %s" % str(exc))
 
             if slow and index % 100 == 99:
                 self.stdout.write("sleeping 2s...")
                 time.sleep(2)
+
+    def handle_timings(self, older_than, newer_than, submitter, force, simulate, slow):
+        jobs = TestJob.objects.all().order_by("id").filter(state=TestJob.STATE_FINISHED)
+        if older_than is not None:
+            pattern = re.compile(r"^(?P<time>\d+)(?P<unit>(h|d))$")
+            match = pattern.match(older_than)
+            if match is None:
+                raise CommandError("Invalid older-than format")
+
+            if match.groupdict()["unit"] == "d":
+                delta = datetime.timedelta(days=int(match.groupdict()["time"]))
+            else:
+                delta = datetime.timedelta(hours=int(match.groupdict()["time"]))
+            jobs = jobs.filter(end_time__lt=(timezone.now() - delta))
+
+        if newer_than is not None:
+            pattern = re.compile(r"^(?P<time>\d+)(?P<unit>(h|d))$")
+            match = pattern.match(newer_than)
+            if match is None:
+                raise CommandError("Invalid newer-than format")
+
+            if match.groupdict()["unit"] == "d":
+                delta = datetime.timedelta(days=int(match.groupdict()["time"]))
+            else:
+                delta = datetime.timedelta(hours=int(match.groupdict()["time"]))
+            jobs = jobs.filter(end_time__gt=(timezone.now() - delta))
+
+        if submitter is not None:
+            try:
+                user = User.objects.get(username=submitter)
+            except User.DoesNotExist:
+                raise CommandError("Unable to find submitter '%s'" % submitter)
+            jobs = jobs.filter(submitter=user)
+
+        self.stdout.write("Computing the timings of %d jobs:" % jobs.count())
+        # Loop on all jobs
+        for (index, job) in enumerate(jobs.iterator()):
+            base = pathlib.Path(job.output_dir)
+            if not force and read_timings(base) is not None:
+                self.stdout.write(
+                    "* %d (%s): %s [SKIP]" % (job.id, job.end_time, job.output_dir)
+                )
+                continue
+            self.stdout.write("* %d (%s): %s" % (job.id, job.end_time, job.output_dir))
+
+            try:
+                table = compute_timings(base)
+                if not simulate:
+                    write_timings(base, table)
+                    chown(str(base / "timings.yaml"), "lavaserver", "lavaserver")
+            except FileNotFoundError:
+                self.stdout.write("  -> no logs")
+            except (OSError, lzma.LZMAError, yaml.YAMLError) as exc:
+                self.stderr.write("  -> Unable to compute the timings: %s" % str(exc))
+
+            if slow and index % 100 == 99:
+                self.stdout.write("sleeping 2s...")
+                time.sleep(2)
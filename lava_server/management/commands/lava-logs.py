@@ -20,9 +20,14 @@
 
 import contextlib
 import logging
+import multiprocessing
 import os
+import shutil
+import signal
+import tempfile
 import time
 import yaml
+import zlib
 import zmq
 import zmq.auth
 from zmq.utils.strtypes import u
@@ -38,8 +43,18 @@ from lava_server.cmdutils import LAVADaemonCommand, watch_directory
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.signals import send_event
 from lava_scheduler_app.utils import mkdir
-from lava_scheduler_app.logutils import line_count, write_logs
-from lava_results_app.dbutils import map_scanned_results, create_metadata_store
+from lava_scheduler_app.logutils import (
+    ActionTimings,
+    compute_timings,
+    line_count,
+    write_lines,
+    write_timings,
+)
+from lava_results_app.dbutils import (
+    create_metadata_store,
+    map_scanned_results,
+    update_result_counters,
+)
 
 
 # Constants
@@ -47,25 +62,71 @@ FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
 TIMEOUT = 10
 BULK_CREATE_TIMEOUT = 10
 FD_TIMEOUT = 60
+STATS_INTERVAL = 60
+# Sent by the front process to ask a shard to leave
+SHARD_STOP = [b""]
+# Time given to the shards to handle the queued logs before being terminated
+SHARD_STOP_TIMEOUT = 300
 
 
 class JobHandler:
     def __init__(self, job):
+        self.job = job
         self.output_dir = job.output_dir
-        self.output = open(os.path.join(self.output_dir, "output.yaml"), "ab")
-        self.index = open(os.path.join(self.output_dir, "output.idx"), "ab")
+        self.output = None
+        self.index = None
+        self.open()
         self.last_usage = time.time()
         self.markers = {}
+        # TestSuite objects of this job, by name
+        self.suites = {}
+        # Lines waiting to be written
+        self.lines = []
+        # Timing of the actions. If the logs are not empty (lava-logs was
+        # restarted), the start of the logs was not seen.
+        self.timings = ActionTimings()
+        self.partial_timings = line_count(self.index) > 0
+
+    @property
+    def closed(self):
+        return self.index is None
+
+    def open(self):
+        if self.closed:
+            self.output = open(os.path.join(self.output_dir, "output.yaml"), "ab")
+            self.index = open(os.path.join(self.output_dir, "output.idx"), "ab")
 
     def write(self, message):
-        write_logs(self.output, self.index, (message + "\n").encode("utf-8"))
+        self.lines.append((message + "\n").encode("utf-8"))
+
+    def flush(self):
+        if self.lines:
+            self.open()
+            write_lines(self.output, self.index, self.lines)
+            self.lines = []
 
     def line_count(self):
-        return line_count(self.index)
+        self.open()
+        return line_count(self.index) + len(self.lines)
+
+    def write_timings(self):
+        if self.partial_timings:
+            table = compute_timings(self.output_dir)
+        else:
+            table = self.timings.table()
+        write_timings(self.output_dir, table)
 
     def close(self):
-        self.index.close()
-        self.output.close()
+        """
+        Close the file handlers, keeping the state of the job (timings,
+        markers, ...). The files are reopened when needed.
+        """
+        self.flush()
+        if not self.closed:
+            self.index.close()
+            self.output.close()
+            self.output = None
+            self.index = None
 
 
 class Command(LAVADaemonCommand):
@@ -90,6 +151,15 @@ class Command(LAVADaemonCommand):
         # Master status
         self.last_ping = 0
         self.ping_interval = TIMEOUT
+        # Ingestion statistics
+        self.batch_size = 1
+        self.stats = {"lines": 0, "batches": 0, "busy": 0.0, "start": time.time()}
+        self.last_gc = self.last_bulk_create = time.time()
+        # Sharded mode: (process, socket) of each shard in the front process
+        # and the index of the shard in the shard processes.
+        self.shards = []
+        self.shard = None
+        self.leaving = False
 
     def add_arguments(self, parser):
         super().add_arguments(parser)
@@ -125,6 +195,21 @@ class Command(LAVADaemonCommand):
             help="Directory for slaves certificates",
         )
 
+        perf = parser.add_argument_group("performance")
+        perf.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of log messages handled for each wake-up. Default: 1000",
+        )
+        perf.add_argument(
+            "--shards",
+            type=int,
+            default=1,
+            help="Number of processes handling the logs, each job being handled "
+            "by the same process. Default: 1",
+        )
+
     def handle(self, *args, **options):
         # Initialize logging.
         self.setup_logging("lava-logs", options["level"], options["log_file"], FORMAT)
@@ -137,13 +222,30 @@ class Command(LAVADaemonCommand):
             self.logger.error("[INIT] Unable to drop privileges")
             return
 
+        self.batch_size = max(options["batch_size"], 1)
+        self.logger.info("[INIT] Handling up to %d messages per batch", self.batch_size)
+
         filename = os.path.join(settings.MEDIA_ROOT, "lava-logs-config.yaml")
         self.logger.debug("[INIT] Dumping config to %s", filename)
         with open(filename, "w") as output:
             yaml.dump(options, output)
 
+        # Start the shards before creating the zmq context: the context and
+        # the database connection are not shared with the child processes.
+        shards = []
+        shards_dir = None
+        if options["shards"] > 1:
+            shards_dir = tempfile.mkdtemp(prefix="lava-logs-")
+            shards = self.start_shards(options["shards"], shards_dir)
+
         # Create the sockets
         context = zmq.Context()
+        for (process, endpoint) in shards:
+            sock = context.socket(zmq.PUSH)
+            # Do not block forever on a dead shard
+            sock.setsockopt(zmq.SNDTIMEO, TIMEOUT * 1000)
+            sock.bind(endpoint)
+            self.shards.append((process, sock))
         self.log_socket = context.socket(zmq.PULL)
         self.controler = context.socket(zmq.ROUTER)
         self.controler.setsockopt(zmq.IDENTITY, b"lava-logs")
@@ -240,17 +342,100 @@ class Command(LAVADaemonCommand):
             self.flush_test_cases()
             self.logger.info("[EXIT] Closing the logging socket: the queue is empty")
             self.log_socket.close()
+            self.stop_shards()
+            if shards_dir is not None:
+                shutil.rmtree(shards_dir, ignore_errors=True)
             if options["encrypt"]:
                 self.auth.stop()
             context.term()
 
+    def start_shards(self, count, shards_dir):
+        self.logger.info("[INIT] Starting %d shards", count)
+        # Close the database connection before forking
+        connection.close()
+        shards = []
+        for index in range(count):
+            endpoint = "ipc://%s" % os.path.join(shards_dir, "shard-%d" % index)
+            process = multiprocessing.get_context("fork").Process(
+                target=self.shard_loop, args=(index, endpoint)
+            )
+            process.start()
+            shards.append((process, endpoint))
+        return shards
+
+    def stop_shards(self):
+        # The stop message is queued after the logs of each shard: the logs
+        # are handled before leaving.
+        deadline = time.monotonic() + SHARD_STOP_TIMEOUT
+        for (index, (process, sock)) in enumerate(self.shards):
+            self.logger.info("[EXIT] Stopping shard %d", index)
+            while process.is_alive() and time.monotonic() < deadline:
+                try:
+                    sock.send_multipart(SHARD_STOP)
+                    break
+                except zmq.error.Again:
+                    self.logger.warning("[SHARD %d] not reading the logs", index)
+        for (index, (process, sock)) in enumerate(self.shards):
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                # The shards ignore SIGTERM
+                self.logger.error("[EXIT] Shard %d is stuck, killing it", index)
+                process.kill()
+                process.join()
+            sock.close(linger=0)
+            self.logger.info("[EXIT] Shard %d stopped (%s)", index, process.exitcode)
+
+    def shard_loop(self, index, endpoint):
+        """
+        Handle the logs forwarded by the front process.
+        Each shard has its own file handlers, test cases buffer and database
+        connection.
+        """
+        # The front process is stopping the shards once the queue is empty
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        self.shard = index
+        self.stats["start"] = time.time()
+        context = zmq.Context()
+        self.log_socket = context.socket(zmq.PULL)
+        self.log_socket.connect(endpoint)
+        self.logger.info("[SHARD %d] listening for logs", index)
+
+        try:
+            while not self.leaving:
+                try:
+                    if self.log_socket.poll(TIMEOUT * 1000):
+                        self.logging_socket()
+                    self.periodic_tasks(time.time())
+                except (OperationalError, InterfaceError):
+                    self.logger.info("[RESET] database connection reset")
+                    connection.close()
+                except Exception as exc:
+                    # The front process leaves when a shard dies: only skip
+                    # the faulty iteration.
+                    self.logger.error("[SHARD %d] Unknown exception raised", index)
+                    self.logger.exception(exc)
+        except BaseException as exc:
+            self.logger.error("[SHARD %d] Unknown exception raised, leaving!", index)
+            self.logger.exception(exc)
+        finally:
+            self.flush_test_cases()
+            for handler in self.jobs.values():
+                handler.close()
+            self.log_socket.close(linger=0)
+            context.term()
+            self.logger.info("[SHARD %d] leaving", index)
+
     def flush_test_cases(self):
         if not self.test_cases:
             return
 
         # Try to save into the database
         try:
-            TestCase.objects.bulk_create(self.test_cases)
+            with transaction.atomic():
+                TestCase.objects.bulk_create(self.test_cases)
+                update_result_counters(self.test_cases)
             self.logger.info("Saving %d test cases", len(self.test_cases))
             self.test_cases = []
         except DatabaseError as exc:
@@ -262,36 +447,61 @@ class Command(LAVADaemonCommand):
             saved = 0
             for tc in self.test_cases:
                 with contextlib.suppress(DatabaseError):
-                    tc.save()
+                    with transaction.atomic():
+                        tc.save()
+                        update_result_counters([tc])
                     saved += 1
             self.logger.info(
                 "%d test cases saved, %d dropped", saved, len(self.test_cases) - saved
             )
             self.test_cases = []
 
-    def main_loop(self):
-        last_gc = time.time()
-        last_bulk_create = time.time()
+    def periodic_tasks(self, now):
+        # Dump TestCase into the database
+        if now - self.last_bulk_create > BULK_CREATE_TIMEOUT:
+            self.last_bulk_create = now
+            self.flush_test_cases()
+
+        # Close old file handlers
+        if now - self.last_gc > FD_TIMEOUT:
+            self.last_gc = now
+            idle = [
+                job_id
+                for (job_id, handler) in self.jobs.items()
+                if now - handler.last_usage > FD_TIMEOUT
+            ]
+            for job_id in idle:
+                if not self.jobs[job_id].closed:
+                    self.logger.info("[%s] closing log file", job_id)
+                    self.jobs[job_id].close()
+            # The state of running jobs (like the timings) is kept: only
+            # forget about the finished jobs.
+            try:
+                finished = TestJob.objects.filter(
+                    id__in=idle, state=TestJob.STATE_FINISHED
+                ).values_list("id", flat=True)
+                for job_id in finished:
+                    del self.jobs[str(job_id)]
+            except (OperationalError, InterfaceError):
+                self.logger.info("[RESET] database connection reset")
+                connection.close()
+
+        # Report the ingestion throughput
+        if now - self.stats["start"] > STATS_INTERVAL:
+            self.report_stats(now)
 
+    def main_loop(self):
         # Wait for messages
         # TODO: fix timeout computation
         while self.wait_for_messages(False):
             now = time.time()
+            self.periodic_tasks(now)
 
-            # Dump TestCase into the database
-            if now - last_bulk_create > BULK_CREATE_TIMEOUT:
-                last_bulk_create = now
-                self.flush_test_cases()
-
-            # Close old file handlers
-            if now - last_gc > FD_TIMEOUT:
-                last_gc = now
-                # Iterate while removing keys is not compatible with iterator
-                for job_id in list(self.jobs.keys()):
-                    if now - self.jobs[job_id].last_usage > FD_TIMEOUT:
-                        self.logger.info("[%s] closing log file", job_id)
-                        self.jobs[job_id].close()
-                        del self.jobs[job_id]
+            # Leave if a shard died: the logs of its jobs would be lost
+            for (index, (process, _)) in enumerate(self.shards):
+                if not process.is_alive():
+                    self.logger.error("[SHARD %d] died, leaving", index)
+                    return
 
             # Ping the master
             if now - self.last_ping > self.ping_interval:
@@ -354,18 +564,94 @@ class Command(LAVADaemonCommand):
             connection.close()
         return True
 
+    def report_stats(self, now):
+        elapsed = now - self.stats["start"]
+        self.logger.info(
+            "[STATS]%s %d lines (%d batches): %.1f lines/s, %.1f lines/s when busy (%.1f%%)",
+            "" if self.shard is None else " shard %d:" % self.shard,
+            self.stats["lines"],
+            self.stats["batches"],
+            self.stats["lines"] / elapsed,
+            self.stats["lines"] / self.stats["busy"] if self.stats["busy"] else 0,
+            100 * self.stats["busy"] / elapsed,
+        )
+        self.stats = {"lines": 0, "batches": 0, "busy": 0.0, "start": now}
+
     def logging_socket(self):
-        msg = self.log_socket.recv_multipart()
-        try:
-            (job_id, message) = (u(m) for m in msg)
-        except UnicodeDecodeError:
-            self.logger.error("[POLL] Invalid log message: can't be decoded")
-            return
-        except ValueError:
-            # do not let a bad message stop the master.
+        start = time.time()
+        # Unqueue up to batch_size messages and group them by job, keeping
+        # the order for each job.
+        batch = {}
+        count = 0
+        while count < self.batch_size:
+            try:
+                msg = self.log_socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.error.Again:
+                break
+            if self.shard is not None and msg == SHARD_STOP:
+                self.leaving = True
+                break
+            count += 1
+            if self.shards:
+                self.forward(msg)
+                continue
+            try:
+                (job_id, message) = (u(m) for m in msg)
+            except UnicodeDecodeError:
+                self.logger.error("[POLL] Invalid log message: can't be decoded")
+                continue
+            except ValueError:
+                # do not let a bad message stop the master.
+                self.logger.error(
+                    "[POLL] failed to parse log message, skipping: %s", msg
+                )
+                continue
+            batch.setdefault(job_id, []).append(message)
+
+        # Handle the messages and write the logs once per job. An error only
+        # drops the faulty message, not the rest of the batch.
+        for job_id, messages in batch.items():
+            try:
+                for message in messages:
+                    try:
+                        self.handle_message(job_id, message)
+                    except (OperationalError, InterfaceError):
+                        self.logger.error(
+                            "[%s] database connection reset, dropping a message", job_id
+                        )
+                        # Closing the database connection will force Django to
+                        # reopen the connection
+                        connection.close()
+                    except Exception as exc:
+                        self.logger.error(
+                            "[%s] unable to handle a message, dropping", job_id
+                        )
+                        self.logger.exception(exc)
+            finally:
+                if job_id in self.jobs:
+                    self.jobs[job_id].flush()
+
+        self.stats["lines"] += count
+        self.stats["batches"] += 1
+        self.stats["busy"] += time.time() - start
+
+    def forward(self, msg):
+        # Send all the logs of a job to the same shard, keeping the order
+        if len(msg) != 2:
             self.logger.error("[POLL] failed to parse log message, skipping: %s", msg)
             return
+        index = zlib.crc32(msg[0]) % len(self.shards)
+        (process, sock) = self.shards[index]
+        while True:
+            try:
+                sock.send_multipart(msg)
+                return
+            except zmq.error.Again:
+                if not process.is_alive():
+                    raise RuntimeError("shard %d died" % index)
+                self.logger.warning("[SHARD %d] not reading the logs", index)
 
+    def handle_message(self, job_id, message):
         try:
             scanned = yaml_load(message)
         except yaml.YAMLError:
@@ -431,19 +717,17 @@ class Command(LAVADaemonCommand):
         self.jobs[job_id].last_usage = time.time()
         # The format is a list of dictionaries
         self.jobs[job_id].write("- %s" % message)
+        self.jobs[job_id].timings.add(message_lvl, message_msg)
 
         if message_lvl == "results":
-            try:
-                job = TestJob.objects.get(pk=job_id)
-            except TestJob.DoesNotExist:
-                self.logger.error("[%s] unknown job id", job_id)
-                return
+            job = self.jobs[job_id].job
             meta_filename = create_metadata_store(message_msg, job)
             new_test_case = map_scanned_results(
                 results=message_msg,
                 job=job,
                 markers=self.jobs[job_id].markers,
                 meta_filename=meta_filename,
+                suites=self.jobs[job_id].suites,
             )
 
             if new_test_case is None:
@@ -458,8 +742,15 @@ class Command(LAVADaemonCommand):
                 message_msg.get("definition") == "lava"
                 and message_msg.get("case") == "job"
             ):
-                # Flush cached test cases
+                # Flush cached test cases and logs
                 self.flush_test_cases()
+                self.jobs[job_id].flush()
+                try:
+                    self.jobs[job_id].write_timings()
+                except (OSError, yaml.YAMLError) as exc:
+                    self.logger.error(
+                        "[%s] unable to write the timings: %s", job_id, str(exc)
+                    )
 
                 if message_msg.get("result") == "pass":
                     health = TestJob.HEALTH_COMPLETE
@@ -481,6 +772,9 @@ class Command(LAVADaemonCommand):
                 with transaction.atomic():
                     # TODO: find a way to lock actual_device
                     job = TestJob.objects.select_for_update().get(id=job_id)
+                    job.set_error(
+                        message_msg.get("error_type"), message_msg.get("error_msg")
+                    )
                     job.go_state_finished(health, infrastructure_error)
                     job.save()
 
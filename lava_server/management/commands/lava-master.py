@@ -18,7 +18,10 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import collections
+import concurrent.futures
 import contextlib
+import hashlib
 import jinja2
 import simplejson
 import lzma
@@ -31,16 +34,17 @@ from zmq.utils.strtypes import b, u
 from zmq.auth.thread import ThreadAuthenticator
 
 from django.conf import settings
-from django.db import connection, transaction
+from django.db import close_old_connections, connection, transaction
 from django.db.utils import OperationalError, InterfaceError
 from django.utils import timezone
 
 from lava_common.compat import yaml_safe_load
 from lava_common.version import __version__
+from lava_results_app.dbutils import update_result_counters
 from lava_results_app.models import TestCase, TestSuite
 from lava_scheduler_app.dbutils import parse_job_description
 from lava_scheduler_app.models import TestJob, Worker
-from lava_scheduler_app.scheduler import schedule
+from lava_scheduler_app.scheduler import SchedulingIndex, schedule
 from lava_scheduler_app.utils import mkdir
 from lava_server.cmdutils import LAVADaemonCommand, watch_directory
 
@@ -51,11 +55,24 @@ from lava_server.cmdutils import LAVADaemonCommand, watch_directory
 # master.
 PROTOCOL_VERSION = 3
 
+# Optional extension of the protocol, advertised by the slave in the HELLO and
+# PING messages: the configuration files are sent as blobs identified by their
+# hash and cached by the slave.
+BLOBS_EXTENSION = "blobs"
+# Number of blobs cached by the slave (should match the slave value)
+BLOBS_CACHE_SIZE = 1024
+# Job definitions larger than that are compressed (in bytes)
+COMPRESS_THRESHOLD = 4096
+
 # Slave ping interval and timeout
 PING_INTERVAL = 20
 DISPATCHER_TIMEOUT = 3 * PING_INTERVAL
 SCHEDULE_INTERVAL = 20
 
+# Maximum number of END messages waiting for a worker. When the queue is full,
+# END messages are not acknowledged: the slaves will send them again.
+END_QUEUE_SIZE = 1000
+
 # Log format
 FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
 
@@ -115,17 +132,30 @@ class SlaveDispatcher:
                 worker.save()
 
 
+# Content of the configuration files: filename => ((mtime, size), content)
+config_files = {}
+
+
 def load_optional_yaml_file(filename, fallback=None):
     """
     Returns the string after checking for YAML errors which would cause issues later.
     Only raise an error if the file exists but is not readable or parsable
+    The content is cached until the modification time or the size of the file
+    changes.
     """
     try:
+        stat = os.stat(filename)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = config_files.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1]
         with open(filename, "r") as f_in:
             data_str = f_in.read()
         yaml_safe_load(data_str)
+        config_files[filename] = (key, data_str)
         return data_str
     except FileNotFoundError:
+        config_files.pop(filename, None)
         # This is ok if the file does not exist
         if fallback is None:
             return ""
@@ -137,6 +167,73 @@ def load_optional_yaml_file(filename, fallback=None):
         raise OSError("", "Not a valid YAML file", filename)
 
 
+def process_end(logger, hostname, job_id, error_msg, compressed_description, queued):
+    """
+    Post-process the END message of a job. Called in the worker threads.
+    Return the time spent in each stage (in seconds).
+    """
+    start = time.monotonic()
+    timings = {"queue": start - queued}
+    # Each thread has its own database connection
+    close_old_connections()
+    try:
+        try:
+            job = TestJob.objects.get(id=job_id)
+        except TestJob.DoesNotExist:
+            logger.error("[%d] Unknown job", job_id)
+            return timings
+
+        filename = os.path.join(job.output_dir, "description.yaml")
+        # If description.yaml already exists: a END was already received
+        if os.path.exists(filename):
+            logger.info("[%d] %s => END (duplicated), skipping", job_id, hostname)
+            return timings
+
+        if compressed_description:
+            logger.info("[%d] %s => END", job_id, hostname)
+        else:
+            logger.info(
+                "[%d] %s => END (lava-run crashed, mark job as INCOMPLETE)",
+                job_id,
+                hostname,
+            )
+            with transaction.atomic():
+                # TODO: find a way to lock actual_device
+                job = TestJob.objects.select_for_update().get(id=job_id)
+
+                job.go_state_finished(TestJob.HEALTH_INCOMPLETE)
+                if error_msg:
+                    logger.error("[%d] Error: %s", job_id, error_msg)
+                    job.failure_comment = error_msg
+                job.save()
+        timings["state"] = time.monotonic() - start
+
+        # Create description.yaml even if it's empty
+        # Allows to know when END messages are duplicated
+        try:
+            start = time.monotonic()
+            # Create the directory if it was not already created
+            mkdir(os.path.dirname(filename))
+            # TODO: check that compressed_description is not ""
+            description = lzma.decompress(compressed_description)
+            with open(filename, "w") as f_description:
+                f_description.write(description.decode("utf-8"))
+            timings["description"] = time.monotonic() - start
+            if description:
+                start = time.monotonic()
+                parse_job_description(job)
+                timings["metadata"] = time.monotonic() - start
+        except (OSError, lzma.LZMAError) as exc:
+            logger.error("[%d] Unable to dump 'description.yaml'", job_id)
+            logger.exception("[%d] %s", job_id, exc)
+        return timings
+    except (OperationalError, InterfaceError):
+        # Closing the database connection will force Django to reopen
+        # the connection
+        connection.close()
+        raise
+
+
 class Command(LAVADaemonCommand):
     """
     worker_host is the hostname of the worker this field is set by the admin
@@ -160,6 +257,18 @@ class Command(LAVADaemonCommand):
         # database. This will help to know if the slave as restarted or not.
         self.dispatchers = {"lava-logs": SlaveDispatcher("lava-logs", online=False)}
         self.events = {"canceling": set(), "available_dt": set()}
+        # Queued jobs, kept in memory between scheduling passes
+        self.index = SchedulingIndex()
+        # END messages being processed: future => (hostname, job id, time)
+        self.executor = None
+        self.ends = {}
+        self.end_pipe_r = None
+        self.end_pipe_w = None
+        # Blobs cached by the slaves supporting the extension:
+        # hostname => OrderedDict of hashes (least recently used first)
+        self.blobs = {}
+        # START messages waiting for START_OK: job id => (hostname, message)
+        self.starting = {}
 
     def add_arguments(self, parser):
         super().add_arguments(parser)
@@ -191,6 +300,14 @@ class Command(LAVADaemonCommand):
             default="/etc/lava-dispatcher/certificates.d",
             help="Directory for slaves certificates",
         )
+        config = parser.add_argument_group("config")
+        config.add_argument(
+            "--end-workers",
+            type=int,
+            default=settings.MASTER_END_WORKERS,
+            help="Number of END messages processed in parallel. Default: %d"
+            % settings.MASTER_END_WORKERS,
+        )
 
     def send_status(self, hostname):
         """
@@ -254,6 +371,8 @@ class Command(LAVADaemonCommand):
             self._handle_end(hostname, msg)
         elif action == "START_OK":
             self._handle_start_ok(hostname, msg)
+        elif action == "BLOBS_MISSING":
+            self._handle_blobs_missing(hostname, msg)
         else:
             self.logger.error(
                 "<%s> sent unknown action=%s, args=(%s)", hostname, action, msg[1:]
@@ -277,6 +396,7 @@ class Command(LAVADaemonCommand):
             return True
 
         if topic.endswith(".testjob"):
+            self.index.handle_event(data)
             if data["state"] == "Canceling":
                 self.events["canceling"].add(int(data["job"]))
             elif data["state"] == "Submitted":
@@ -304,56 +424,62 @@ class Command(LAVADaemonCommand):
             self.logger.error("Invalid END message from <%s> '%s'", hostname, msg)
             return
 
-        try:
-            job = TestJob.objects.get(id=job_id)
-        except TestJob.DoesNotExist:
-            self.logger.error("[%d] Unknown job", job_id)
-            # ACK even if the job is unknown to let the dispatcher
-            # forget about it
-            send_multipart_u(self.controler, [hostname, "END_OK", str(job_id)])
+        # Mark the dispatcher as alive
+        self.dispatcher_alive(hostname)
+        self.starting.pop(job_id, None)
+
+        # The END message will be acknowledged once processed. The slave will
+        # send it again in the meantime.
+        if any(end[1] == job_id for end in self.ends.values()):
+            self.logger.debug("[%d] %s => END (already queued)", job_id, hostname)
+            return
+        if len(self.ends) >= END_QUEUE_SIZE:
+            self.logger.warning(
+                "[%d] %s => END (queue full, dropping)", job_id, hostname
+            )
             return
 
-        filename = os.path.join(job.output_dir, "description.yaml")
-        # If description.yaml already exists: a END was already received
-        if os.path.exists(filename):
-            self.logger.info("[%d] %s => END (duplicated), skipping", job_id, hostname)
-        else:
-            if compressed_description:
-                self.logger.info("[%d] %s => END", job_id, hostname)
-            else:
-                self.logger.info(
-                    "[%d] %s => END (lava-run crashed, mark job as INCOMPLETE)",
-                    job_id,
-                    hostname,
-                )
-                with transaction.atomic():
-                    # TODO: find a way to lock actual_device
-                    job = TestJob.objects.select_for_update().get(id=job_id)
-
-                    job.go_state_finished(TestJob.HEALTH_INCOMPLETE)
-                    if error_msg:
-                        self.logger.error("[%d] Error: %s", job_id, error_msg)
-                        job.failure_comment = error_msg
-                    job.save()
-
-            # Create description.yaml even if it's empty
-            # Allows to know when END messages are duplicated
+        future = self.executor.submit(
+            process_end,
+            self.logger,
+            hostname,
+            job_id,
+            error_msg,
+            compressed_description,
+            time.monotonic(),
+        )
+        self.ends[future] = (hostname, job_id, time.monotonic())
+        future.add_done_callback(self._end_done)
+        self.logger.debug("[%d] END queued (%d in queue)", job_id, len(self.ends))
+
+    def _end_done(self, future):
+        # Called in the worker threads: wake up the main loop
+        with contextlib.suppress(OSError):
+            os.write(self.end_pipe_w, b"\0")
+
+    def collect_ends(self):
+        with contextlib.suppress(BlockingIOError):
+            os.read(self.end_pipe_r, 4096)
+        for future in [f for f in self.ends if f.done()]:
+            (hostname, job_id, queued) = self.ends.pop(future)
             try:
-                # Create the directory if it was not already created
-                mkdir(os.path.dirname(filename))
-                # TODO: check that compressed_description is not ""
-                description = lzma.decompress(compressed_description)
-                with open(filename, "w") as f_description:
-                    f_description.write(description.decode("utf-8"))
-                if description:
-                    parse_job_description(job)
-            except (OSError, lzma.LZMAError) as exc:
-                self.logger.error("[%d] Unable to dump 'description.yaml'", job_id)
-                self.logger.exception("[%d] %s", job_id, exc)
-
-        # ACK the job and mark the dispatcher as alive
-        send_multipart_u(self.controler, [hostname, "END_OK", str(job_id)])
-        self.dispatcher_alive(hostname)
+                timings = future.result()
+            except Exception as exc:
+                # The END message will be handled again when resent by the slave
+                self.logger.error("[%d] Unable to handle END: %s", job_id, exc)
+                continue
+            self.logger.info(
+                "[%d] END processed in %.1fms (%s), %d in queue",
+                job_id,
+                (time.monotonic() - queued) * 1000,
+                ", ".join(
+                    "%s: %.1fms" % (stage, duration * 1000)
+                    for (stage, duration) in timings.items()
+                ),
+                len(self.ends),
+            )
+            # ACK the job
+            send_multipart_u(self.controler, [hostname, "END_OK", str(job_id)])
 
     def _handle_hello(self, hostname, action, msg):
         # Check the protocol version
@@ -374,6 +500,11 @@ class Command(LAVADaemonCommand):
             return
 
         send_multipart_u(self.controler, [hostname, "HELLO_OK"])
+        # The slave cache is empty after a restart
+        if BLOBS_EXTENSION in [u(m) for m in msg[3:]]:
+            self.blobs[hostname] = collections.OrderedDict()
+        else:
+            self.blobs.pop(hostname, None)
         # If the dispatcher is known and sent an HELLO, means that
         # the slave has restarted
         if hostname in self.dispatchers:
@@ -396,6 +527,10 @@ class Command(LAVADaemonCommand):
         self.logger.debug("%s => PING(%d)", hostname, PING_INTERVAL)
         # Send back a signal
         send_multipart_u(self.controler, [hostname, "PONG", str(PING_INTERVAL)])
+        # The extensions are also advertised in PING: the HELLO message is
+        # not sent again when the master restarts.
+        if hostname not in self.blobs and BLOBS_EXTENSION in [u(m) for m in msg[2:]]:
+            self.blobs[hostname] = collections.OrderedDict()
         self.dispatcher_alive(hostname)
 
     def _handle_start_ok(self, hostname, msg):
@@ -405,6 +540,7 @@ class Command(LAVADaemonCommand):
             self.logger.error("Invalid START_OK message from <%s> '%s'", hostname, msg)
             return
         self.logger.info("[%d] %s => START_OK", job_id, hostname)
+        self.starting.pop(job_id, None)
         try:
             with transaction.atomic():
                 # TODO: find a way to lock actual_device
@@ -415,6 +551,87 @@ class Command(LAVADaemonCommand):
         except TestJob.DoesNotExist:
             self.logger.error("[%d] Unknown job", job_id)
 
+    def _handle_blobs_missing(self, hostname, msg):
+        try:
+            job_id = int(msg[2])
+        except (IndexError, ValueError):
+            self.logger.error(
+                "Invalid BLOBS_MISSING message from <%s> '%s'", hostname, msg
+            )
+            return
+        self.logger.warning("[%d] %s => BLOBS_MISSING", job_id, hostname)
+        # The slave dropped some blobs: forget about the cached blobs and send
+        # back the full configuration.
+        if hostname in self.blobs:
+            self.blobs[hostname].clear()
+        (start_hostname, start) = self.starting.get(job_id, (None, None))
+        if start_hostname != hostname:
+            self.logger.error("[%d] Unknown START message", job_id)
+            return
+        self.logger.info("[%d] START => %s (full)", job_id, hostname)
+        send_multipart_u(self.controler, [hostname, "START"] + start)
+        self.dispatcher_alive(hostname)
+
+    def send_start(
+        self,
+        hostname,
+        job_id,
+        job_def_str,
+        device_cfg,
+        dispatcher_cfg,
+        env_str,
+        env_dut_str,
+    ):
+        """
+        Send the START message to the slave.
+        When supported by the slave, only the hashes of the configuration files
+        are sent, along with the blobs that are not already cached by the slave.
+        """
+        start = [
+            str(job_id),
+            job_def_str,
+            device_cfg,
+            dispatcher_cfg,
+            env_str,
+            env_dut_str,
+        ]
+        self.starting[job_id] = (hostname, start)
+        cached = self.blobs.get(hostname)
+        if cached is None:
+            send_multipart_u(self.controler, [hostname, "START"] + start)
+            return
+
+        encoding = ""
+        if len(job_def_str) > COMPRESS_THRESHOLD:
+            encoding = "lzma"
+            job_def_str = lzma.compress(job_def_str.encode("utf-8"))
+
+        hashes = []
+        blobs = []
+        for data in [device_cfg, dispatcher_cfg, env_str, env_dut_str]:
+            digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+            hashes.append(digest)
+            if digest in cached:
+                cached.move_to_end(digest)
+            else:
+                blobs.extend([digest, data])
+                cached[digest] = None
+        while len(cached) > BLOBS_CACHE_SIZE:
+            cached.popitem(last=False)
+
+        self.logger.debug(
+            "[%d] %d blobs sent, %d cached",
+            job_id,
+            len(blobs) // 2,
+            4 - len(blobs) // 2,
+        )
+        send_multipart_u(
+            self.controler,
+            [hostname, "START_BLOBS", str(job_id), encoding, job_def_str]
+            + hashes
+            + blobs,
+        )
+
     def save_job_config(
         self, job, job_def_str, device_cfg, env_str, env_dut_str, dispatcher_cfg
     ):
@@ -468,18 +685,14 @@ class Command(LAVADaemonCommand):
         self.logger.info(
             "[%d] START => %s (%s)", job.id, worker.hostname, device.hostname
         )
-        send_multipart_u(
-            self.controler,
-            [
-                worker.hostname,
-                "START",
-                str(job.id),
-                job_def_str,
-                device_cfg_str,
-                dispatcher_cfg,
-                env_str,
-                env_dut_str,
-            ],
+        self.send_start(
+            worker.hostname,
+            job.id,
+            job_def_str,
+            device_cfg_str,
+            dispatcher_cfg,
+            env_str,
+            env_dut_str,
         )
 
         if not job.is_multinode:
@@ -514,18 +727,14 @@ class Command(LAVADaemonCommand):
             self.logger.info(
                 "[%d] START => %s (connection)", sub_job.id, worker.hostname
             )
-            send_multipart_u(
-                self.controler,
-                [
-                    worker.hostname,
-                    "START",
-                    str(sub_job.id),
-                    sub_job_def_str,
-                    min_device_cfg_str,
-                    dispatcher_cfg,
-                    env_str,
-                    env_dut_str,
-                ],
+            self.send_start(
+                worker.hostname,
+                sub_job.id,
+                sub_job_def_str,
+                min_device_cfg_str,
+                dispatcher_cfg,
+                env_str,
+                env_dut_str,
             )
 
     def start_jobs(self, jobs=None):
@@ -587,12 +796,14 @@ class Command(LAVADaemonCommand):
                     "result": "fail",
                 }
                 suite, _ = TestSuite.objects.get_or_create(name="lava", job=job)
-                TestCase.objects.create(
+                test_case = TestCase.objects.create(
                     name="job",
                     suite=suite,
                     result=TestCase.RESULT_FAIL,
                     metadata=yaml.dump(metadata),
                 )
+                update_result_counters([test_case])
+                job.set_error(metadata["error_type"], msg)
                 job.go_state_finished(TestJob.HEALTH_INCOMPLETE, True)
                 job.save()
 
@@ -617,6 +828,7 @@ class Command(LAVADaemonCommand):
             )
             self.logger.info("[%d] CANCEL => %s", job.id, worker.hostname)
             send_multipart_u(self.controler, [worker.hostname, "CANCEL", str(job.id)])
+            self.starting.pop(job.id, None)
 
     def handle(self, *args, **options):
         # Initialize logging.
@@ -704,6 +916,13 @@ class Command(LAVADaemonCommand):
         (self.pipe_r, _) = self.setup_zmq_signal_handler()
         self.poller.register(self.pipe_r, zmq.POLLIN)
 
+        # END messages are processed by a pool of threads, each one with its
+        # own database connection. The main loop is woken up through a pipe.
+        self.logger.info("[INIT] Starting %d END workers", options["end_workers"])
+        self.executor = concurrent.futures.ThreadPoolExecutor(options["end_workers"])
+        (self.end_pipe_r, self.end_pipe_w) = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self.poller.register(self.end_pipe_r, zmq.POLLIN)
+
         self.logger.info("[INIT] Starting main loop")
         try:
             self.main_loop(options)
@@ -711,6 +930,9 @@ class Command(LAVADaemonCommand):
             self.logger.error("[CLOSE] Unknown exception raised, leaving!")
             self.logger.exception(exc)
         finally:
+            self.logger.info("[CLOSE] Waiting for %d END messages", len(self.ends))
+            self.executor.shutdown(wait=True)
+            self.collect_ends()
             # Drop controler socket: the protocol does handle lost messages
             self.logger.info(
                 "[CLOSE] Closing the controler socket and dropping messages"
@@ -753,6 +975,10 @@ class Command(LAVADaemonCommand):
                     while self.controler_socket():  # Unqueue all pending messages
                         pass
 
+                # END messages processed by the workers
+                if sockets.get(self.end_pipe_r) == zmq.POLLIN:
+                    self.collect_ends()
+
                 # Events socket
                 if sockets.get(self.event_socket) == zmq.POLLIN:
                     self.logger.info("[EVENT] handling events")
@@ -798,13 +1024,21 @@ class Command(LAVADaemonCommand):
                                     "[STATE] Dispatcher <%s> goes OFFLINE", hostname
                                 )
                             self.dispatchers[hostname].go_offline()
+                            # The START messages will not be acknowledged
+                            self.starting = {
+                                job_id: start
+                                for (job_id, start) in self.starting.items()
+                                if start[0] != hostname
+                            }
+                    if self.ends:
+                        self.logger.info("[END] %d messages in queue", len(self.ends))
                     last_dispatcher_check = now
 
                 # Limit accesses to the database. This will also limit the rate of
                 # CANCEL and START messages
                 if time.time() - last_schedule > SCHEDULE_INTERVAL:
                     if self.dispatchers["lava-logs"].online:
-                        schedule(self.logger)
+                        schedule(self.logger, index=self.index)
 
                         # Dispatch scheduled jobs
                         with transaction.atomic():
@@ -826,7 +1060,9 @@ class Command(LAVADaemonCommand):
                         self.events["canceling"] = set()
                     # Schedule for available device-types
                     if self.events["available_dt"]:
-                        jobs = schedule(self.logger, self.events["available_dt"])
+                        jobs = schedule(
+                            self.logger, self.events["available_dt"], self.index
+                        )
                         self.events["available_dt"] = set()
                         # Dispatch scheduled jobs
                         with transaction.atomic():
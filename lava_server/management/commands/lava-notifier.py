@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import concurrent.futures
+import datetime
+import logging
+import select
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.utils import InterfaceError, OperationalError
+from django.utils import timezone
+
+from lava_common.version import __version__
+from lava_scheduler_app.models import NotificationTask
+from lava_scheduler_app.notifications import send_notification
+from lava_server.cmdutils import LAVADaemonCommand
+
+
+# Interval between two checks of the queue (in seconds)
+POLL_INTERVAL = 1
+# Maximum number of queued tasks read at each check
+QUEUE_WINDOW = 1000
+
+FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
+
+
+def retry_delay(attempts):
+    delay = settings.NOTIFICATION_RETRY_DELAY * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(delay, settings.NOTIFICATION_MAX_RETRY_DELAY))
+
+
+def deliver(task_id):
+    """
+    Send the notification and update the queue. Called in the worker threads.
+    Return True if the notification was sent, False if it failed and None if
+    the task does not exist anymore.
+    """
+    # Each thread has its own database connection
+    close_old_connections()
+    try:
+        task = NotificationTask.objects.select_related(
+            "notification__test_job", "callback", "recipient"
+        ).get(id=task_id)
+    except NotificationTask.DoesNotExist:
+        return None
+
+    try:
+        sent = send_notification(task)
+    except Exception as exc:
+        logging.getLogger("lava-notifier").exception(exc)
+        sent = False
+
+    if sent:
+        task.delete()
+        return True
+    task.attempts += 1
+    if task.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+        task.state = NotificationTask.STATE_FAILED
+    else:
+        task.next_attempt = timezone.now() + retry_delay(task.attempts)
+    task.save(update_fields=["state", "attempts", "next_attempt"])
+    return False
+
+
+class Command(LAVADaemonCommand):
+    help = "LAVA notification sender"
+    default_logfile = "/var/log/lava-server/lava-notifier.log"
+
+    def __init__(self, *args, **options):
+        super().__init__(*args, **options)
+        self.executor = None
+        # Tasks being sent: future => task
+        self.running = {}
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        config = parser.add_argument_group("config")
+        config.add_argument(
+            "--workers",
+            type=int,
+            default=settings.NOTIFICATION_WORKERS,
+            help="Number of notifications sent in parallel. Default: %d"
+            % settings.NOTIFICATION_WORKERS,
+        )
+        config.add_argument(
+            "--endpoint-concurrency",
+            type=int,
+            default=settings.NOTIFICATION_ENDPOINT_CONCURRENCY,
+            help="Number of notifications sent in parallel to the same endpoint. "
+            "Default: %d" % settings.NOTIFICATION_ENDPOINT_CONCURRENCY,
+        )
+
+    def collect(self):
+        for future in [f for f in self.running if f.done()]:
+            task = self.running.pop(future)
+            try:
+                sent = future.result()
+            except Exception as exc:
+                # The database update failed: the task will be sent again
+                self.logger.error("[%d] Unable to update the task: %s", task.id, exc)
+                continue
+            if sent:
+                self.logger.info("[%d] Sent to %s", task.id, task.endpoint)
+            elif sent is not None:
+                self.logger.warning("[%d] Failed to send to %s", task.id, task.endpoint)
+
+    def schedule(self, workers, endpoint_concurrency):
+        available = workers - len(self.running)
+        if available <= 0:
+            return
+        running = set(task.id for task in self.running.values())
+        per_endpoint = collections.Counter(
+            task.endpoint for task in self.running.values()
+        )
+
+        query = NotificationTask.objects.filter(
+            state=NotificationTask.STATE_QUEUED, next_attempt__lte=timezone.now()
+        )
+        query = query.exclude(id__in=running).only("id", "endpoint")
+        for task in query.order_by("next_attempt", "id")[:QUEUE_WINDOW]:
+            if per_endpoint[task.endpoint] >= endpoint_concurrency:
+                continue
+            self.logger.debug("[%d] Sending to %s", task.id, task.endpoint)
+            self.running[self.executor.submit(deliver, task.id)] = task
+            per_endpoint[task.endpoint] += 1
+            available -= 1
+            if not available:
+                break
+
+    def handle(self, *args, **options):
+        self.setup_logging(
+            "lava-notifier", options["level"], options["log_file"], FORMAT
+        )
+
+        self.logger.info("[INIT] Starting lava-notifier")
+        self.logger.info("[INIT] Version %s", __version__)
+
+        self.logger.info("[INIT] Dropping privileges")
+        if not self.drop_privileges(options["user"], options["group"]):
+            self.logger.error("[INIT] Unable to drop privileges")
+            return
+
+        (pipe_r, _) = self.setup_zmq_signal_handler()
+
+        self.logger.info(
+            "[INIT] Starting %d workers (%d per endpoint)",
+            options["workers"],
+            options["endpoint_concurrency"],
+        )
+        self.executor = concurrent.futures.ThreadPoolExecutor(options["workers"])
+        try:
+            while True:
+                if select.select([pipe_r], [], [], POLL_INTERVAL)[0]:
+                    self.logger.info("[POLL] Received a signal, leaving")
+                    break
+                try:
+                    self.collect()
+                    self.schedule(options["workers"], options["endpoint_concurrency"])
+                except (OperationalError, InterfaceError):
+                    self.logger.info("[RESET] database connection reset.")
+                    # Closing the database connection will force Django to reopen
+                    # the connection
+                    connection.close()
+        finally:
+            self.logger.info("[CLOSE] Waiting for %d notifications", len(self.running))
+            self.executor.shutdown(wait=True)
+            self.collect()
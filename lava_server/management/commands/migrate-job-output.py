@@ -20,10 +20,15 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from lava_scheduler_app.logutils import compress_logs, is_block_compressed
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.utils import mkdir
 
+import contextlib
+import lzma
 import os
+import pathlib
+from shutil import chown
 import time
 
 
@@ -37,6 +42,12 @@ class Command(BaseCommand):
             action="store_true",
             help="Do not move any data, simulate the output",
         )
+        parser.add_argument(
+            "--compress",
+            default=False,
+            action="store_true",
+            help="Convert the logs of finished jobs to block-compressed logs",
+        )
         parser.add_argument(
             "--slow",
             default=False,
@@ -80,9 +91,26 @@ class Command(BaseCommand):
                         self.stdout.write("  -> no output directory")
                         continue
                     os.rename(old_path, date_path)
+                    if options["compress"] and job.state == TestJob.STATE_FINISHED:
+                        self.compress(pathlib.Path(date_path))
             start += count
             if count == 0:
                 break
             if options["slow"]:
                 self.stdout.write("sleeping 2s...")
                 time.sleep(2)
+
+    def compress(self, base):
+        if not (base / "output.yaml").exists():
+            if not (base / "output.yaml.xz").exists() or is_block_compressed(base):
+                return
+        self.stdout.write("  -> compressing the logs")
+        try:
+            size = compress_logs(base)
+            (base / "output.yaml.size").write_text(str(size), encoding="utf-8")
+            for name in ["output.yaml.xz", "output.yaml.xz.idx", "output.yaml.size"]:
+                chown(str(base / name), "lavaserver", "lavaserver")
+            with contextlib.suppress(FileNotFoundError):
+                (base / "output.yaml").unlink()
+        except (OSError, lzma.LZMAError) as exc:
+            self.stderr.write("  -> Unable to compress the logs: %s" % str(exc))
@@ -132,6 +132,19 @@ LOG_SIZE_LIMIT = 5
 # resolved.
 TESTCASE_COUNT_LIMIT = 10000
 
+# Time (in seconds) the chart data of the non-live queries are kept in the
+# cache. The data is invalidated when the query is refreshed.
+CHART_DATA_CACHE_TIMEOUT = 24 * 3600
+
+# Number of queries refreshed in parallel by "lava-server manage refresh_queries"
+QUERY_REFRESH_WORKERS = 4
+
+# Time (in seconds) the device and device-type job reports are kept in the cache
+REPORTS_CACHE_TIMEOUT = 5 * 60
+
+# Number of END messages (end of jobs) processed in parallel by lava-master
+MASTER_END_WORKERS = 4
+
 # Default URL after login
 LOGIN_REDIRECT_URL = "/"
 
@@ -209,6 +222,17 @@ ALLOW_ADMIN_DELETE = True
 # Default callback http timeout in seconds
 CALLBACK_TIMEOUT = 5
 
+# Notifications (emails, IRC messages and callbacks) are sent by lava-notifier
+# Number of notifications sent in parallel
+NOTIFICATION_WORKERS = 8
+# Maximum number of notifications sent in parallel to the same endpoint (smtp,
+# IRC server or callback host)
+NOTIFICATION_ENDPOINT_CONCURRENCY = 2
+# Failed notifications are retried, doubling the delay (in seconds) each time
+NOTIFICATION_MAX_ATTEMPTS = 6
+NOTIFICATION_RETRY_DELAY = 30
+NOTIFICATION_MAX_RETRY_DELAY = 3600
+
 # DRF may need this to be true when used in some instances.
 USE_X_FORWARDED_HOST = False
 REST_FRAMEWORK = {
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Replay recorded job logs to a running lava-logs, at a configurable rate, to
+# measure the ingestion throughput (for instance with different values of
+# --shards).
+# A running test job is created in the database for each replayed job and
+# the logs are sent as lava-run would do. The lava.job result is sent last:
+# the logs are fully handled when all the jobs are finished. The test jobs
+# and their logs are removed at the end.
+# Encryption is not supported.
+
+import argparse
+import collections
+import os
+import shutil
+import sys
+import time
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lava_server.settings.development")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from lava_common.compat import yaml_load  # noqa: E402
+from lava_scheduler_app.logutils import open_logs  # noqa: E402
+from lava_scheduler_app.models import DeviceType, TestJob  # noqa: E402
+
+JOB_RESULT = (
+    b'{"dt": "2019-01-01T00:00:00.000000", "lvl": "results", '
+    b'"msg": {"definition": "lava", "case": "job", "result": "pass"}}'
+)
+
+
+def is_job_result(line):
+    if b"results" not in line:
+        return False
+    data = yaml_load(line)
+    return (
+        isinstance(data, dict)
+        and data.get("lvl") == "results"
+        and isinstance(data.get("msg"), dict)
+        and data["msg"].get("definition") == "lava"
+        and data["msg"].get("case") == "job"
+    )
+
+
+def load_logs(dirname):
+    """
+    Return the log lines as sent by lava-run, the lava.job result being moved
+    at the end.
+    """
+    with open_logs(dirname) as f_log:
+        lines = [line[2:].rstrip(b"\n") for line in f_log if line.startswith(b"- ")]
+    return [line for line in lines if not is_job_result(line)] + [JOB_RESULT]
+
+
+def create_jobs(logs, count):
+    user, _ = User.objects.get_or_create(username="lava-logs-benchmark")
+    device_type, _ = DeviceType.objects.get_or_create(name="lava-logs-benchmark")
+    jobs = []
+    for index in range(count):
+        dirname = logs[index % len(logs)]
+        definition = "job_name: lava-logs-benchmark\n"
+        if os.path.exists(os.path.join(dirname, "job.yaml")):
+            with open(os.path.join(dirname, "job.yaml"), "r") as f_in:
+                definition = f_in.read()
+        jobs.append(
+            TestJob.objects.create(
+                description="lava-logs benchmark",
+                definition=definition,
+                submitter=user,
+                requested_device_type=device_type,
+                state=TestJob.STATE_RUNNING,
+                start_time=timezone.now(),
+            )
+        )
+    return jobs
+
+
+def replay(sock, streams, rate):
+    """
+    Send one line of each job in turn, limiting the rate (in lines per second)
+    """
+    sent = 0
+    start = time.monotonic()
+    pending = collections.deque(streams)
+    while pending:
+        (job_id, lines) = pending.popleft()
+        line = next(lines, None)
+        if line is None:
+            continue
+        sock.send_multipart([job_id, line])
+        pending.append((job_id, lines))
+        sent += 1
+        if rate:
+            delay = sent / rate - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+    return (sent, time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "logs", nargs="+", help="output directories of recorded jobs (output.yaml)"
+    )
+    parser.add_argument(
+        "--url", default="tcp://localhost:5555", help="lava-logs socket"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=10, help="number of jobs replayed in parallel"
+    )
+    parser.add_argument(
+        "--rate", type=int, default=0, help="lines per second (0 for no limit)"
+    )
+    parser.add_argument(
+        "--timeout", type=int, default=600, help="time to wait for lava-logs"
+    )
+    parser.add_argument(
+        "--keep", default=False, action="store_true", help="keep the test jobs"
+    )
+    options = parser.parse_args()
+
+    logs = {dirname: load_logs(dirname) for dirname in options.logs}
+    jobs = create_jobs(options.logs, options.jobs)
+    streams = [
+        (str(job.id).encode("utf-8"), iter(logs[options.logs[index % len(logs)]]))
+        for (index, job) in enumerate(jobs)
+    ]
+
+    context = zmq.Context()
+    sock = context.socket(zmq.PUSH)
+    sock.connect(options.url)
+    try:
+        start = time.monotonic()
+        (sent, duration) = replay(sock, streams, options.rate)
+        print(
+            "sent: %d lines in %.1fs, %.1f lines/s" % (sent, duration, sent / duration)
+        )
+
+        # The jobs are finished once all the lines are handled
+        query = TestJob.objects.filter(id__in=[job.id for job in jobs])
+        query = query.exclude(state=TestJob.STATE_FINISHED)
+        while query.exists():
+            if time.monotonic() - start > options.timeout:
+                print("timeout: %d jobs not finished" % query.count())
+                return 1
+            time.sleep(0.1)
+        duration = time.monotonic() - start
+        print(
+            "handled: %d lines in %.1fs, %.1f lines/s"
+            % (sent, duration, sent / duration)
+        )
+    finally:
+        sock.close(linger=-1)
+        context.term()
+        if not options.keep:
+            for job in jobs:
+                shutil.rmtree(job.output_dir, ignore_errors=True)
+                job.delete()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
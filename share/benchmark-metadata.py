@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measure the time and the number of queries needed to map the pipeline
+# description to the job metadata (TestData, ActionData), as done by
+# lava-master at the end of each job.
+# The database is used: every run is done in a transaction that is rolled
+# back. The pipeline of the description can be repeated to simulate larger
+# jobs.
+
+import argparse
+import copy
+import glob
+import os
+import statistics
+import sys
+import time
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lava_server.settings.development")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from lava_common.compat import yaml_dump  # noqa: E402
+from lava_results_app.dbutils import map_metadata  # noqa: E402
+from lava_results_app.models import TestCase, TestSuite  # noqa: E402
+from lava_scheduler_app.models import DeviceType, TestJob  # noqa: E402
+
+DESCRIPTIONS = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "tests",
+    "lava_scheduler_app",
+    "pipeline_refs",
+    "*-description.yaml",
+)
+
+
+class DescriptionLoader(yaml.SafeLoader):
+    pass
+
+
+# Older descriptions are dumping the PipelineDevice object: the device is not
+# used by map_metadata
+DescriptionLoader.add_multi_constructor(
+    "tag:yaml.org,2002:python/", lambda loader, suffix, node: None
+)
+
+
+def renumber(actions, index):
+    for action in actions:
+        level = action["level"].split(".")
+        action["level"] = ".".join([str(int(level[0]) + index)] + level[1:])
+        renumber(action.get("pipeline", []), index)
+
+
+def scale(description, repeat):
+    pipeline = description["pipeline"]
+    description["pipeline"] = []
+    for count in range(repeat):
+        actions = copy.deepcopy(pipeline)
+        renumber(actions, count * len(pipeline))
+        description["pipeline"].extend(actions)
+
+
+def levels(actions):
+    for action in actions:
+        yield action["level"]
+        yield from levels(action.get("pipeline", []))
+
+
+def run(description, data):
+    with transaction.atomic():
+        user = User.objects.create(username="benchmark-metadata")
+        job = TestJob.objects.create(
+            definition=yaml_dump(data["job"]),
+            submitter=user,
+            requested_device_type=DeviceType.objects.create(name="benchmark"),
+        )
+        # Results of each action, as sent by the dispatcher
+        suite = TestSuite.objects.create(job=job, name="lava")
+        TestCase.objects.bulk_create(
+            [
+                TestCase(
+                    suite=suite,
+                    name="action-%s" % level,
+                    result=TestCase.RESULT_PASS,
+                    metadata=yaml_dump({"level": level}),
+                )
+                for level in levels(data["pipeline"])
+            ]
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.monotonic()
+            map_metadata(description, job)
+            duration = time.monotonic() - start
+        transaction.set_rollback(True)
+    return (duration, len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "descriptions",
+        nargs="*",
+        help="pipeline descriptions (default to the descriptions in the tests)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=10, help="number of copies of the pipeline"
+    )
+    parser.add_argument("--runs", type=int, default=10, help="number of runs")
+    options = parser.parse_args()
+
+    for filename in options.descriptions or sorted(glob.glob(DESCRIPTIONS)):
+        with open(filename, "r") as f_in:
+            data = yaml.load(f_in, Loader=DescriptionLoader)  # nosec
+        data.pop("device", None)
+        scale(data, options.repeat)
+        description = yaml_dump(data)
+
+        timings = []
+        for _ in range(options.runs):
+            (duration, queries) = run(description, data)
+            timings.append(duration)
+
+        print(
+            "%s: %d actions, %d queries"
+            % (os.path.basename(filename), len(list(levels(data["pipeline"]))), queries)
+        )
+        print(
+            "map_metadata: %.1fms (median), %.1fms (max)"
+            % (statistics.median(timings) * 1000, max(timings) * 1000)
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
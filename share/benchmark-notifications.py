@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measure the time needed to compare the results of two jobs when building
+# the notification arguments. The database is not used: test cases are
+# generated randomly, as returned by the two test cases queries.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lava_server.settings.development")
+
+import django  # noqa: E402
+
+django.setup()
+
+from lava_results_app.models import TestCase  # noqa: E402
+from lava_scheduler_app.notifications import compare_results  # noqa: E402
+
+
+def generate_cases(first_id, count, suites, changes):
+    results = list(TestCase.RESULT_REVERSE.keys())
+    cases = []
+    for index in range(count):
+        name = "test-case-%05d" % index
+        # Rename some test cases to add and remove them
+        if random.random() < changes:
+            name += "-%d" % first_id
+        result = TestCase.RESULT_PASS
+        if random.random() < changes:
+            result = random.choice(results)
+        cases.append((first_id + index, "suite-%03d" % (index % suites), name, result))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=20000, help="test cases per job")
+    parser.add_argument("--suites", type=int, default=50, help="suites per job")
+    parser.add_argument(
+        "--changes", type=float, default=0.05, help="ratio of changed test cases"
+    )
+    parser.add_argument("--runs", type=int, default=10, help="number of runs")
+    options = parser.parse_args()
+
+    suites = set("suite-%03d" % i for i in range(options.suites))
+    timings = []
+    for _ in range(options.runs):
+        new_cases = generate_cases(1, options.cases, options.suites, options.changes)
+        old_cases = generate_cases(
+            options.cases + 1, options.cases, options.suites, options.changes
+        )
+        start = time.monotonic()
+        (added, removed, _, _, changed) = compare_results(
+            new_cases, old_cases, suites, set()
+        )
+        timings.append(time.monotonic() - start)
+
+    print(
+        "%d test cases per job, %d suites: %d added, %d removed, %d changed"
+        % (options.cases, options.suites, len(added), len(removed), len(changed))
+    )
+    print(
+        "compare: %.1fms (median), %.1fms (max)"
+        % (statistics.median(timings) * 1000, max(timings) * 1000)
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
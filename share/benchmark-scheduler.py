@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measure the latency of the in-memory scheduling index (building the
+# priority queues and matching the queued jobs against the idle devices).
+# The database is not used: jobs and devices are generated randomly.
+
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lava_server.settings.development")
+
+import django  # noqa: E402
+
+django.setup()
+
+from lava_scheduler_app.scheduler import QueuedJob, SchedulingIndex  # noqa: E402
+
+
+class FakeDevice:
+    def __init__(self, hostname, tags):
+        self.hostname = hostname
+        self.tags = tags
+
+
+def generate_jobs(count, device_types, tags):
+    now = datetime.datetime.now()
+    for job_id in range(1, count + 1):
+        yield QueuedJob(
+            job_id,
+            random.choice([0, 0, 0, 1]),
+            random.choice([0, 50, 100]),
+            now + datetime.timedelta(seconds=job_id),
+            None,
+            random.randint(1, 20),
+            random.choice(device_types),
+            frozenset(random.sample(tags, random.randint(0, 2))),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=10000, help="queued jobs")
+    parser.add_argument("--device-types", type=int, default=20, help="device-types")
+    parser.add_argument("--devices", type=int, default=500, help="idle devices")
+    parser.add_argument("--tags", type=int, default=10, help="number of tags")
+    parser.add_argument("--runs", type=int, default=10, help="number of runs")
+    options = parser.parse_args()
+
+    device_types = ["dt-%02d" % i for i in range(options.device_types)]
+    tags = list(range(options.tags))
+    devices = {}
+    for i in range(options.devices):
+        dt = device_types[i % len(device_types)]
+        devices.setdefault(dt, []).append(
+            FakeDevice("%s-%03d" % (dt, i), frozenset(random.sample(tags, 3)))
+        )
+
+    def accept(device, job):
+        return job.tags.issubset(device.tags)
+
+    def assign(device, job):
+        return True
+
+    build = []
+    match = []
+    for _ in range(options.runs):
+        jobs = list(generate_jobs(options.jobs, device_types, tags))
+        start = time.monotonic()
+        index = SchedulingIndex()
+        for job in jobs:
+            index.add(job)
+        build.append(time.monotonic() - start)
+
+        start = time.monotonic()
+        scheduled = 0
+        for dt in device_types:
+            scheduled += len(index.match(dt, devices.get(dt, []), accept, assign))
+        match.append(time.monotonic() - start)
+
+    print(
+        "%d jobs, %d device-types, %d devices, %d jobs scheduled per pass"
+        % (options.jobs, options.device_types, options.devices, scheduled)
+    )
+    print(
+        "build: %.1fms (median), %.1fms (max)"
+        % (statistics.median(build) * 1000, max(build) * 1000)
+    )
+    print(
+        "match: %.1fms (median), %.1fms (max)"
+        % (statistics.median(match) * 1000, max(match) * 1000)
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -36,6 +36,7 @@ services = [
     "lava-coordinator",
     "lava-logs",
     "lava-master",
+    "lava-notifier",
     "lava-publisher",
     "lava-server-gunicorn",
     "lava-slave",
@@ -0,0 +1,139 @@
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import multiprocessing
+import os
+import time
+
+from lava_dispatcher.utils.cache import ArtifactCache, clone_file
+
+
+def test_from_config(tmpdir):
+    assert ArtifactCache.from_config(None) is None  # nosec
+    assert ArtifactCache.from_config({}) is None  # nosec
+    cache = ArtifactCache.from_config({"download_cache": {"path": str(tmpdir)}})
+    assert cache.path == str(tmpdir)  # nosec
+    assert cache.max_size == 10 * 1024 * 1024 * 1024  # nosec
+    assert cache.hardlink is False  # nosec
+    cache = ArtifactCache.from_config(
+        {"download_cache": {"path": str(tmpdir), "max_size": 1, "hardlink": True}}
+    )
+    assert cache.max_size == 1024 * 1024  # nosec
+    assert cache.hardlink is True  # nosec
+
+
+def test_clone_file(tmpdir):
+    (tmpdir / "src").write_text("hello", encoding="utf-8")
+    assert clone_file(str(tmpdir / "src"), str(tmpdir / "dst")) in [  # nosec
+        "reflink",
+        "copy",
+    ]
+    assert (tmpdir / "dst").read_text(encoding="utf-8") == "hello"  # nosec
+    assert os.stat(str(tmpdir / "src")).st_nlink == 1  # nosec
+
+    assert (  # nosec
+        clone_file(str(tmpdir / "src"), str(tmpdir / "link"), hardlink=True)
+        == "hardlink"
+    )
+    assert os.stat(str(tmpdir / "src")).st_nlink == 2  # nosec
+
+
+def test_entry(tmpdir):
+    cache = ArtifactCache(str(tmpdir / "cache"), 1024 * 1024)
+    (tmpdir / "rootfs.ext4").write_binary(b"rootfs")
+
+    entry = cache.entry("sha256:1234 [raw]")
+    assert entry.lock(time.time()) is True  # nosec
+    assert entry.load() is None  # nosec
+    # The lock is exclusive
+    other = cache.entry("sha256:1234 [raw]")
+    assert other.lock(time.time()) is False  # nosec
+    entry.store(str(tmpdir / "rootfs.ext4"), {"size": 6, "checksums": {}})
+    entry.release()
+
+    assert other.lock(time.time()) is True  # nosec
+    metadata = other.load()
+    assert metadata == {  # nosec
+        "size": 6,
+        "checksums": {},
+        "key": "sha256:1234 [raw]",
+    }
+    other.materialize(str(tmpdir / "job.ext4"))
+    other.release()
+    assert (tmpdir / "job.ext4").read_binary() == b"rootfs"  # nosec
+
+    # Other keys are not in the cache
+    entry = cache.entry("sha256:1234 [unxz]")
+    assert entry.lock(time.time()) is True  # nosec
+    assert entry.load() is None  # nosec
+    entry.release()
+
+
+def test_entry_lock_cancelled(tmpdir):
+    cache = ArtifactCache(str(tmpdir / "cache"), 1024 * 1024)
+    entry = cache.entry("sha256:1234 [raw]")
+
+    # Another process holds the lock
+    locked = multiprocessing.Event()
+    release = multiprocessing.Event()
+
+    def hold_lock():
+        other = cache.entry("sha256:1234 [raw]")
+        assert other.lock(time.time()) is True  # nosec
+        locked.set()
+        release.wait(60)
+        other.release()
+
+    process = multiprocessing.Process(target=hold_lock)
+    process.start()
+    try:
+        assert locked.wait(60) is True  # nosec
+        start = time.time()
+        assert entry.lock(start + 60, lambda: time.time() > start + 1) is False  # nosec
+        assert time.time() - start < 30  # nosec
+    finally:
+        release.set()
+        process.join()
+    assert entry.lock(time.time(), lambda: True) is True  # nosec
+    entry.release()
+
+
+def test_evict(tmpdir):
+    cache = ArtifactCache(str(tmpdir / "cache"), 3 * 4096)
+    entries = []
+    for index in range(4):
+        (tmpdir / "data").write_binary(b"x" * 4096)
+        entry = cache.entry("key-%d" % index)
+        assert entry.lock(time.time()) is True  # nosec
+        entry.store(str(tmpdir / "data"), {"size": 4096, "checksums": {}})
+        os.utime(entry.meta, (index, index))
+        entry.release()
+        entries.append(entry)
+
+    # Mark key-1 as used: key-0 and key-2 will be the oldest
+    entries[1].materialize(str(tmpdir / "used"))
+    cache.max_size = 2 * 4096
+    cache.evict()
+    assert [e.load() is not None for e in entries] == [  # nosec
+        False,
+        True,
+        False,
+        True,
+    ]
+    # The lock files are kept
+    assert os.path.exists(entries[0].data + ".lock")  # nosec
@@ -18,13 +18,22 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import bz2
+import contextlib
 import copy
+import gzip
+import lzma
 import os
 import hashlib
-from lava_common.exceptions import InfrastructureError
+import pytest
+import shutil
+import subprocess  # nosec - unit test
+from lava_common.compat import yaml_safe_dump, yaml_safe_load
+from lava_common.exceptions import InfrastructureError, JobError
 from tests.lava_dispatcher.test_basic import Factory, StdoutTestCase
 from lava_dispatcher.utils.compression import decompress_file
 from lava_dispatcher.utils.compression import decompress_command_map
+from lava_dispatcher.utils.compression import Decompressor
 
 
 class TestDecompression(StdoutTestCase):
@@ -109,3 +118,82 @@ class TestDecompression(StdoutTestCase):
         with self.assertRaises(InfrastructureError):
             decompress_file("/tmp/test.xz", "zip")  # nosec - unit test only.
         self.assertEqual(copy_of_command_map, decompress_command_map)
+
+
+def zstd_compress(data):
+    with contextlib.suppress(ImportError):
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    if shutil.which("zstd") is None:
+        pytest.skip("zstandard and zstd are not available")
+    return subprocess.run(  # nosec - unit test
+        ["zstd", "-c"], input=data, stdout=subprocess.PIPE, check=True
+    ).stdout
+
+
+def test_zstd_validation(tmpdir):
+    data = b"hello world\n" * 1000
+    compressed = zstd_compress(data)
+    (tmpdir / "image.zst").write_binary(compressed)
+    filename = os.path.join(
+        os.path.dirname(__file__), "sample_jobs/compression-zstd.yaml"
+    )
+    with open(filename) as f_in:
+        job_data = yaml_safe_load(f_in)
+    image = job_data["actions"][0]["deploy"]["images"]["testzstd"]
+    image["url"] = "file://%s" % (tmpdir / "image.zst")
+    image["sha256sum"] = hashlib.sha256(compressed).hexdigest()
+    (tmpdir / "job.yaml").write_text(yaml_safe_dump(job_data), encoding="utf-8")
+
+    factory = Factory()
+    job = factory.create_kvm_job(str(tmpdir / "job.yaml"), validate=True)
+    job.validate()
+    deployaction = [
+        action for action in job.pipeline.actions if action.name == "deployimages"
+    ][0]
+    fileaction = [
+        action
+        for action in deployaction.pipeline.actions[0].pipeline.actions
+        if action.name == "file-download"
+    ][0]
+    assert fileaction.errors == []  # nosec - unit test
+    assert (  # nosec - unit test
+        fileaction.get_namespace_data(
+            action="download-action", label="testzstd", key="compression"
+        )
+        == "zstd"
+    )
+
+    fileaction.parameters = fileaction.parameters["images"]
+    fileaction.run(None, None)
+    output = fileaction.get_namespace_data(
+        action="download-action", label="testzstd", key="file"
+    )
+    with open(output, "rb") as f_out:
+        assert f_out.read() == data  # nosec - unit test
+
+
+@pytest.mark.parametrize(
+    "compression,compress",
+    [("xz", lzma.compress), ("gz", gzip.compress), ("bz2", bz2.compress)],
+)
+def test_decompressor(compression, compress):
+    data = b"hello world\n" * 1000
+    # Multi-stream files, with some padding
+    compressed = compress(data[:5000]) + compress(data[5000:]) + b"\0" * 4
+    for size in [1, 100, len(compressed)]:
+        decompressor = Decompressor(compression)
+        output = b"".join(
+            decompressor.decompress(compressed[i : i + size])
+            for i in range(0, len(compressed), size)
+        )
+        assert output + decompressor.flush() == data  # nosec - unit test
+
+    decompressor = Decompressor(compression)
+    decompressor.decompress(compressed[:20])
+    with pytest.raises(JobError):
+        decompressor.flush()
+
+    with pytest.raises(JobError):
+        Decompressor(compression).decompress(b"not compressed at all")
@@ -18,11 +18,13 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import fcntl
 import os
 import shutil
 import subprocess  # nosec - unit test support.
 import tempfile
 import unittest
+from unittest.mock import patch
 
 from tests.lava_dispatcher.test_uboot import UBootFactory, StdoutTestCase
 from lava_dispatcher.actions.boot.u_boot import UBootAction, UBootRetry
@@ -183,6 +185,56 @@ class TestGit(StdoutTestCase):
             os.path.exists(os.path.join(self.tmpdir, "git.clone1", ".git"))
         )
 
+    def test_clone_with_cache(self):
+        cache = vcs.GitCache(os.path.join(self.tmpdir, "cache"), 300, 1024 ** 3, 3600)
+        git = vcs.GitHelper("git", cache)
+        self.assertEqual(
+            git.clone("git.clone1"), "a7af835862da0e0592eeeac901b90e8de2cf5b67"
+        )
+        mirrors = [m for m in os.listdir(cache.path) if m.endswith(".git")]
+        self.assertEqual(len(mirrors), 1)
+        self.assertEqual(
+            subprocess.check_output(  # nosec - unit test support.
+                ["git", "-C", "git.clone1", "remote", "get-url", "origin"]
+            ),
+            b"git\n",
+        )
+        self.assertEqual(
+            git.clone("git.clone2", shallow=True),
+            "a7af835862da0e0592eeeac901b90e8de2cf5b67",
+        )
+        self.assertEqual(
+            git.clone("git.clone3", branch="testing", history=False),
+            "f2589a1b7f0cfc30ad6303433ba4d5db1a542c2d",
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmpdir, "git.clone3", ".git"))
+        )
+        # Clones from a fresh mirror only take a shared lock and do not evict
+        lock = os.path.join(cache.path, mirrors[0][:-4] + ".lock")
+        with open(lock, "a") as f_lock, patch.object(cache, "evict") as evict:
+            fcntl.flock(f_lock, fcntl.LOCK_SH)
+            self.assertEqual(
+                git.clone("git.clone4"), "a7af835862da0e0592eeeac901b90e8de2cf5b67"
+            )
+            evict.assert_not_called()
+        self.assertRaises(InfrastructureError, git.clone, "foo.bar", False, "badhash")
+
+        # Unused mirrors are evicted
+        cache.max_age = 0
+        os.utime(os.path.join(cache.path, mirrors[0][:-4] + ".lock"), (0, 0))
+        cache.evict()
+        self.assertFalse(os.path.exists(os.path.join(cache.path, mirrors[0])))
+
+    def test_cache_from_config(self):
+        self.assertIsNone(vcs.GitCache.from_config(None))
+        self.assertIsNone(vcs.GitCache.from_config({}))
+        cache = vcs.GitCache.from_config({"git_cache": {"path": "/var/cache/git"}})
+        self.assertEqual(cache.path, "/var/cache/git")
+        self.assertEqual(cache.fetch_interval, 300)
+        self.assertEqual(cache.max_size, 5 * 1024 * 1024 * 1024)
+        self.assertEqual(cache.max_age, 30 * 24 * 3600)
+
 
 class TestConstants(StdoutTestCase):
     """
@@ -196,6 +196,8 @@ class TestRestApi:
     def hit(self, client, url):
         response = client.get(url)
         assert response.status_code == 200  # nosec - unit test support
+        if response.streaming:
+            return b"".join(response.streaming_content).decode("utf-8")
         if hasattr(response, "content"):
             text = response.content.decode("utf-8")
             if response["Content-Type"] == "application/json":
@@ -665,6 +667,31 @@ ok 2 - bar
         )
         assert response.status_code == 400  # nosec
 
+    def test_devicetype_reports(self):
+        data = self.hit(
+            self.userclient,
+            reverse("api-root", args=[self.version])
+            + "devicetypes/%s/reports/" % self.public_device_type1.name,
+        )
+        assert len(data["jobs"]) == 70  # nosec - unit test support
+        assert len(data["health_check"]) == 70  # nosec - unit test support
+        assert data["jobs"][0] == {"pass": 0, "fail": 0}  # nosec - unit test support
+
+        response = self.userclient.get(
+            reverse("api-root", args=[self.version])
+            + "devicetypes/%s/reports/" % self.restricted_device_type1.name
+        )
+        assert response.status_code == 404  # nosec - unit test support
+
+    def test_device_reports(self):
+        data = self.hit(
+            self.userclient,
+            reverse("api-root", args=[self.version])
+            + "devices/%s/reports/" % self.public_device1.hostname,
+        )
+        assert len(data["jobs"]) == 70  # nosec - unit test support
+        assert "date" in data  # nosec - unit test support
+
     def test_workers(self):
         data = self.hit(
             self.userclient,
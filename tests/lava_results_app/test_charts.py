@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+import yaml
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from lava_results_app.dbutils import rebuild_result_counters
+from lava_results_app.models import (
+    ChartQuery,
+    NamedTestAttribute,
+    TestCase,
+    TestData,
+    TestSuite,
+)
+from lava_scheduler_app.models import DeviceType, TestJob
+
+
+@pytest.fixture
+def job(db):
+    user = User.objects.create_superuser("tester", "tester@example.com", "tester")
+    job = TestJob.objects.create(
+        description="test job 01",
+        submitter=user,
+        requested_device_type=DeviceType.objects.create(name="qemu"),
+        state=TestJob.STATE_FINISHED,
+        health=TestJob.HEALTH_COMPLETE,
+        end_time=timezone.now(),
+    )
+    suite = TestSuite.objects.create(job=job, name="smoke")
+    for (name, result, measurement) in [
+        ("pwd", TestCase.RESULT_PASS, 10),
+        ("uname", TestCase.RESULT_FAIL, 20),
+        ("vmstat", TestCase.RESULT_SKIP, None),
+    ]:
+        TestCase.objects.create(
+            suite=suite,
+            name=name,
+            result=result,
+            measurement=measurement,
+            metadata=yaml.dump({"case": name, "time": "1.5"}),
+        )
+    TestSuite.objects.create(job=job, name="empty")
+    NamedTestAttribute.objects.create(
+        content_object=TestData.objects.create(testjob=job), name="kernel", value="5.4"
+    )
+    rebuild_result_counters([job.id])
+    return job
+
+
+def test_chart_passfail_data(job):
+    user = job.submitter
+    chart = ChartQuery(chart_type="pass/fail")
+    data = chart.get_chart_passfail_data(user, TestJob.objects.filter(id=job.id))
+    assert [
+        (d["id"], d["passes"], d["failures"], d["total"]) for d in data
+    ] == [  # nosec
+        ("smoke", 1, 1, 3),
+        ("empty", 0, 0, 0),
+    ]
+    assert data[0]["link"] == job.get_absolute_url()  # nosec
+    assert data[0]["attribute"] == data[0]["date"] == str(job.end_time)  # nosec
+    assert data[0]["pass"] is False  # nosec
+
+    chart.xaxis_attribute = "kernel"
+    data = chart.get_chart_passfail_data(user, TestJob.objects.filter(id=job.id))
+    assert [d["attribute"] for d in data] == ["5.4", "5.4"]  # nosec
+    chart.xaxis_attribute = "missing"
+    assert chart.get_chart_passfail_data(user, TestJob.objects.all()) == []  # nosec
+
+
+def test_chart_measurement_data(job):
+    user = job.submitter
+    chart = ChartQuery(chart_type="measurement")
+    data = chart.get_chart_measurement_data(user, TestJob.objects.all())
+    assert [(d["id"], d["measurement"], d["pass"]) for d in data] == [  # nosec
+        ("smoke", 15, False),
+        ("empty", None, True),
+    ]
+    data = chart.get_chart_measurement_data(
+        user, TestSuite.objects.filter(name="smoke")
+    )
+    assert [(d["id"], d["measurement"], d["pass"]) for d in data] == [  # nosec
+        ("pwd", 10, True),
+        ("uname", 20, False),
+        ("vmstat", None, False),
+    ]
+
+
+def test_chart_attributes_data(job):
+    user = job.submitter
+    chart = ChartQuery(chart_type="attributes", attributes="time, kernel")
+    data = chart.get_chart_attributes_data(user, TestJob.objects.all())
+    assert [(d["id"], d["attr_value"], d["pass"]) for d in data] == [  # nosec
+        ("kernel", 5.4, True)
+    ]
+    data = chart.get_chart_attributes_data(user, TestCase.objects.order_by("id"))
+    assert [(d["id"], d["attr_value"], d["pass"]) for d in data] == [  # nosec
+        ("time", 1.5, True),
+        ("time", 1.5, False),
+        ("time", 1.5, False),
+    ]
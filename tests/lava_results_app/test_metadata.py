@@ -11,9 +11,12 @@ from tests.lava_results_app.test_names import TestCaseWithFactory
 from lava_scheduler_app.models import TestJob, Device
 from lava_scheduler_app.utils import mkdir
 from lava_results_app.dbutils import (
+    append_failure_comment,
     map_metadata,
     map_scanned_results,
     create_metadata_store,
+    rebuild_result_counters,
+    update_result_counters,
     _get_action_metadata,
 )
 from lava_results_app.models import ActionData, MetaType, TestData, TestCase, TestSuite
@@ -118,6 +121,15 @@ class TestMetaTypes(TestCaseWithFactory):
         action_data.save(update_fields=["timeout"])
         self.assertEqual(action_data.timeout, 300)
 
+    def test_append_failure_comment(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        # Another process updated the failure comment in the meantime
+        TestJob.objects.filter(id=job.id).update(failure_comment="first. ")
+        append_failure_comment(job, "second.")
+        self.assertEqual(job.failure_comment, "first. second.")
+        job.refresh_from_db()
+        self.assertEqual(job.failure_comment, "first. second.")
+
     def test_decimal_yaml_dump(self):
         job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
         test_dict = {
@@ -129,6 +141,74 @@ class TestMetaTypes(TestCaseWithFactory):
         test_case = map_scanned_results(test_dict, job, {}, None)
         self.assertEqual(yaml_load(test_case.metadata)["measurement"], "1234.5")
 
+    def test_result_counters(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        test_cases = [
+            map_scanned_results(
+                {"definition": "unit-test", "case": "case-%d" % i, "result": result},
+                job,
+                {},
+                None,
+            )
+            for (i, result) in enumerate(["pass", "pass", "fail", "skip"])
+        ]
+        test_cases.append(
+            map_scanned_results(
+                {
+                    "definition": "smoke",
+                    "case": "bench",
+                    "result": "unknown",
+                    "measurement": 12.5,
+                },
+                job,
+                {},
+                None,
+            )
+        )
+        TestCase.objects.bulk_create(test_cases)
+        update_result_counters(test_cases)
+
+        suite = TestSuite.objects.get(job=job, name="unit-test")
+        self.assertEqual(
+            suite.get_result_counts(),
+            {
+                "pass": 2,
+                "fail": 1,
+                "skip": 1,
+                "unknown": 0,
+                "total": 4,
+                "measurement": 0,
+            },
+        )
+        self.assertEqual(suite.testcase_count("pass"), 2)
+        job.refresh_from_db()
+        expected = {
+            "pass": 2,
+            "fail": 1,
+            "skip": 1,
+            "unknown": 1,
+            "total": 5,
+            "measurement": 1,
+        }
+        self.assertEqual((job.count_total, job.count_measurement), (5, 1))
+
+        # Counters are computed from the test cases until they are built
+        TestSuite.objects.update(count_pass=None, count_total=None)
+        TestJob.objects.filter(id=job.id).update(count_total=None)
+        suite = TestSuite.objects.get(job=job, name="smoke")
+        self.assertEqual(suite.get_result_counts()["unknown"], 1)
+        update_result_counters(test_cases[:1])
+        suite = TestSuite.objects.get(job=job, name="unit-test")
+        self.assertIsNone(suite.count_total)
+
+        rebuild_result_counters([job.id])
+        job.refresh_from_db()
+        self.assertEqual(
+            {name: getattr(job, "count_%s" % name) for name in expected}, expected
+        )
+        suite = TestSuite.objects.get(job=job, name="unit-test")
+        self.assertEqual(suite.get_result_counts()["pass"], 2)
+
     def test_case_as_url(self):
         job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
         test_dict = {
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
+from lava_results_app.models import Query, QueryCondition, QueryMaterializedView
+from lava_scheduler_app.models import DeviceType, TestJob
+
+
+@pytest.fixture
+def user(db):
+    return User.objects.create_superuser("tester", "tester@example.com", "tester")
+
+
+def create_job(user, description, state=TestJob.STATE_FINISHED):
+    return TestJob.objects.create(
+        description=description,
+        submitter=user,
+        requested_device_type=DeviceType.objects.get_or_create(name="qemu")[0],
+        state=state,
+    )
+
+
+def results(query, user):
+    return [job.description for job in query.get_results(user)]
+
+
+def test_incremental_refresh(user):
+    content_type = ContentType.objects.get_for_model(TestJob)
+    query = Query.objects.create(
+        owner=user, name="query01", content_type=content_type, limit=2
+    )
+    QueryCondition.objects.create(
+        query=query,
+        table=content_type,
+        field="description",
+        operator=QueryCondition.ICONTAINS,
+        value="match",
+    )
+    job01 = create_job(user, "match 01")
+    create_job(user, "other")
+    job03 = create_job(user, "match 03", state=TestJob.STATE_RUNNING)
+
+    query.refresh_from_db()
+    query.refresh_view()
+    assert QueryMaterializedView.view_kind(query.id) == "r"  # nosec
+    assert query.refresh_mark == job03.id  # nosec
+    assert results(query, user) == ["match 03", "match 01"]  # nosec
+
+    # Only the new results and the unfinished jobs are evaluated again
+    job03.description = "not matching anymore"
+    job03.state = TestJob.STATE_FINISHED
+    job03.save()
+    create_job(user, "match 04")
+    query.refresh_view()
+    assert query.refresh_mark == job03.id + 2  # nosec
+    assert results(query, user) == ["match 04", "match 01"]  # nosec
+
+    # Results outside of the refreshed range are not evaluated again
+    job01.description = "changed"
+    job01.save()
+    create_job(user, "match 05")
+    create_job(user, "match 06")
+    query.refresh_view()
+    assert results(query, user) == ["match 06", "match 05"]  # nosec
+
+    # Truncated results are fetched again
+    job07 = create_job(user, "match 07", state=TestJob.STATE_RUNNING)
+    query.refresh_view()
+    assert results(query, user) == ["match 07", "match 06"]  # nosec
+    job07.description = "canceled"
+    job07.state = TestJob.STATE_FINISHED
+    job07.save()
+    query.refresh_view()
+    assert results(query, user) == ["match 06", "match 05"]  # nosec
+
+    # Evaluate the query from scratch
+    query.refresh_view(full=True)
+    assert results(query, user) == ["match 06", "match 05"]  # nosec
+
+    QueryMaterializedView.drop(query.id)
+    assert QueryMaterializedView.view_kind(query.id) is None  # nosec
@@ -3,6 +3,7 @@ import pathlib
 import pytest
 
 from lava_scheduler_app import environment
+from lava_scheduler_app.auth import permission_cache
 
 
 @pytest.fixture(autouse=True)
@@ -34,3 +35,9 @@ def update_settings(settings, monkeypatch):
 
     monkeypatch.setattr(environment, "devices", devices)
     monkeypatch.setattr(environment, "device_types", device_types)
+
+
+@pytest.fixture(autouse=True)
+def clear_permission_cache():
+    # The test transactions are rolled back without sending any signal
+    permission_cache.clear()
@@ -72,6 +72,29 @@ class PermissionAuthTest(TestCaseWithFactory):
             permissions, {"change_device", "view_device", "submit_to_device"}
         )
 
+    def test_permission_cache(self):
+        # The cached permissions are updated with the group permissions.
+        auth = PermissionAuth(self.user)
+        self.assertEqual(auth.get_group_perms(self.device), set())
+        self.assertFalse(
+            self.device.is_permission_restricted("lava_scheduler_app.view_device")
+        )
+        GroupDevicePermission.objects.assign_perm(
+            "view_device", self.group, self.device
+        )
+        self.assertEqual(auth.get_group_perms(self.device), {"view_device"})
+        self.assertTrue(
+            self.device.is_permission_restricted("lava_scheduler_app.view_device")
+        )
+        self.user.groups.remove(self.group)
+        self.assertEqual(auth.get_group_perms(self.device), set())
+        GroupDevicePermission.objects.remove_perm(
+            "view_device", self.group, self.device
+        )
+        self.assertFalse(
+            self.device.is_permission_restricted("lava_scheduler_app.view_device")
+        )
+
     def test_anonymous_unrestricted_device_type(self):
         guy_fawkes = AnonymousUser()
         auth = PermissionAuth(guy_fawkes)
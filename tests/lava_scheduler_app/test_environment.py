@@ -0,0 +1,92 @@
+import pytest
+
+from lava_scheduler_app.environment import DeviceConfigurationCache
+from lava_scheduler_app.models import Device
+
+
+@pytest.fixture
+def devices_path(settings, tmp_path):
+    settings.DEVICES_PATH = str(tmp_path)
+    (tmp_path / "qemu-01.jinja2").write_text(
+        "{% extends 'qemu.jinja2' %}\n{% set mac_addr = 'DE:AD:BE:EF:28:01' %}",
+        encoding="utf-8",
+    )
+    return tmp_path
+
+
+@pytest.fixture
+def cache():
+    cache = DeviceConfigurationCache()
+    yield cache
+    cache.close()
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_device_configuration_cache(devices_path, cache, inotify):
+    config = cache.get("qemu-01")
+    if not inotify:
+        cache.close()
+    assert config.raw.startswith("{% extends 'qemu.jinja2' %}")
+    assert config.extends == ["qemu.jinja2"]
+    assert config.deps[0].endswith("/qemu.jinja2")
+    assert "DE:AD:BE:EF:28:01" in config.rendered
+    assert config.load()["actions"] is not config.load()["actions"]
+
+    # Cached while nothing changed
+    assert cache.get("qemu-01") is config
+    assert cache.get("qemu-01", {"arch": "arm64"}) is not config
+
+    # Modifying the device dictionary invalidates the cache
+    (devices_path / "qemu-01.jinja2").write_text(
+        "{% extends 'qemu.jinja2' %}\n{% set mac_addr = 'DE:AD:BE:EF:28:02' %}",
+        encoding="utf-8",
+    )
+    config = cache.get("qemu-01")
+    assert "DE:AD:BE:EF:28:02" in config.rendered
+    assert cache.get("qemu-01") is config
+
+
+def test_device_configuration_cache_missing(devices_path, cache):
+    config = cache.get("qemu-02")
+    assert config.raw is None
+    assert config.rendered is None
+    assert config.load() is None
+
+
+def test_device_is_valid(devices_path):
+    device = Device(hostname="qemu-01")
+    assert device.is_valid() is True
+    assert device.get_extends() == "qemu"
+    assert device.load_configuration(output_format="yaml").startswith("\n")
+
+    device = Device(hostname="qemu-02")
+    assert device.is_valid() is False
+    assert device.get_extends() is None
+    assert device.load_configuration() is None
+
+
+def test_device_configuration_network(cache):
+    config = cache.get("bbb-01")
+    assert config.network() == [
+        (
+            "192.168.0.2",
+            5,
+            {
+                "interface": "eth0",
+                "mac": "f0:de:f1:46:8c:21",
+                "sysfs": "/sys/devices/pci0000:00/0000:00:19.0/net/eth0",
+            },
+        ),
+        (
+            "192.168.0.2",
+            7,
+            {
+                "interface": "eth1",
+                "mac": "00:24:d7:9b:c0:8c",
+                "sysfs": "/sys/devices/pci0000:00/0000:00:1c.1/0000:03:00.0/net/eth1",
+            },
+        ),
+    ]
+    # Computed once per rendered configuration
+    assert config.network() is config.network()
+    assert cache.get("qemu-01").network() == []
@@ -18,8 +18,24 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 import lzma
+import struct
 
-from lava_scheduler_app.logutils import read_logs, size_logs, write_logs
+from lava_scheduler_app.logutils import (
+    PACK_FORMAT,
+    compress_logs,
+    compute_timings,
+    is_block_compressed,
+    iter_logs,
+    line_count,
+    logs_line_count,
+    read_logs,
+    read_timings,
+    size_logs,
+    stream_logs,
+    write_lines,
+    write_logs,
+    write_timings,
+)
 
 
 def test_read_logs_uncompressed(tmpdir):
@@ -80,3 +96,148 @@ def test_write_logs(tmpdir):
     with open(str(tmpdir / "output.idx"), "rb") as f_idx:
         assert f_idx.read(8) == b"\x00\x00\x00\x00\x00\x00\x00\x00"  # nosec
         assert f_idx.read(8) == b"\x0c\x00\x00\x00\x00\x00\x00\x00"  # nosec
+
+
+def test_write_lines(tmpdir):
+    with open(str(tmpdir / "output.yaml"), "wb") as f_logs:
+        with open(str(tmpdir / "output.idx"), "wb") as f_idx:
+            write_lines(f_logs, f_idx, [b"hello world\n", b"how are you?\n"])
+            write_lines(f_logs, f_idx, [])
+            write_lines(f_logs, f_idx, [b"fine\n"])
+            assert line_count(f_idx) == 3  # nosec
+    assert read_logs(str(tmpdir)) == "hello world\nhow are you?\nfine\n"  # nosec
+    assert read_logs(str(tmpdir), start=1, end=2) == "how are you?\n"  # nosec
+    assert read_logs(str(tmpdir), start=2) == "fine\n"  # nosec
+
+
+def test_compress_logs(tmpdir):
+    data = "".join("line %d\n" % i for i in range(1000))
+    (tmpdir / "output.yaml").write_text(data, encoding="utf-8")
+    assert read_logs(str(tmpdir), start=10, end=12) == "line 10\nline 11\n"  # nosec
+
+    assert compress_logs(str(tmpdir), chunk_size=100) == len(data)  # nosec
+    assert is_block_compressed(str(tmpdir))  # nosec
+    (tmpdir / "output.yaml").remove()
+
+    # Independent streams are still a valid xz file
+    with lzma.open(str(tmpdir / "output.yaml.xz"), "rb") as f_logs:
+        assert f_logs.read().decode("utf-8") == data  # nosec
+
+    assert read_logs(str(tmpdir)) == data  # nosec
+    assert read_logs(str(tmpdir), start=10, end=12) == "line 10\nline 11\n"  # nosec
+    assert read_logs(str(tmpdir), start=998) == "line 998\nline 999\n"  # nosec
+    assert read_logs(str(tmpdir), start=1000) == ""  # nosec
+
+    # Convert from a single xz stream
+    (tmpdir / "output.yaml.xz.idx").remove()
+    with lzma.open(str(tmpdir / "output.yaml.xz"), "wb") as f_logs:
+        f_logs.write(data.encode("utf-8"))
+    assert not is_block_compressed(str(tmpdir))  # nosec
+    assert compress_logs(str(tmpdir), chunk_size=64) == len(data)  # nosec
+    assert is_block_compressed(str(tmpdir))  # nosec
+    assert read_logs(str(tmpdir), start=500, end=501) == "line 500\n"  # nosec
+
+
+def test_iter_logs(tmpdir):
+    lines = [
+        '- {"dt": "2019-11-04T15:39:52.345099", "lvl": "info", "msg": "line %d"}\n' % i
+        for i in range(5)
+    ]
+    (tmpdir / "output.yaml").write_text("".join(lines), encoding="utf-8")
+    records = list(iter_logs(str(tmpdir)))
+    assert [r["msg"] for r in records] == ["line %d" % i for i in range(5)]  # nosec
+    records = list(iter_logs(str(tmpdir), start=1, end=3))
+    assert [r["msg"] for r in records] == ["line 1", "line 2"]  # nosec
+    assert list(iter_logs(str(tmpdir), start=5)) == []  # nosec
+    assert logs_line_count(str(tmpdir)) == 5  # nosec
+
+    data = b"".join(stream_logs(str(tmpdir), start=3, size=10))
+    assert data.decode("utf-8") == "".join(lines[3:])  # nosec
+    data = b"".join(stream_logs(str(tmpdir), start=1, end=2, size=10))
+    assert data.decode("utf-8") == lines[1]  # nosec
+
+    # Lines in the index but not yet in the logs are not counted
+    with open(str(tmpdir / "output.idx"), "ab") as f_idx:
+        f_idx.write(struct.pack(PACK_FORMAT, len("".join(lines))))
+    assert logs_line_count(str(tmpdir)) == 5  # nosec
+
+    compress_logs(str(tmpdir), chunk_size=100)
+    (tmpdir / "output.yaml").remove()
+    (tmpdir / "output.idx").remove()
+    records = list(iter_logs(str(tmpdir), start=4))
+    assert [r["msg"] for r in records] == ["line 4"]  # nosec
+
+
+def test_iter_logs_size(tmpdir):
+    lines = [
+        '- {"dt": "2019-11-04T15:39:52.345099", "lvl": "info", "msg": "line %d"}\n' % i
+        for i in range(5)
+    ]
+    with open(str(tmpdir / "output.yaml"), "wb") as f_log:
+        with open(str(tmpdir / "output.idx"), "wb") as f_idx:
+            write_lines(f_log, f_idx, [line.encode("utf-8") for line in lines])
+            size = size_logs(str(tmpdir))
+            # Lines appended after the size was taken are neither counted
+            # nor read
+            write_lines(f_log, f_idx, [lines[0].encode("utf-8")])
+    assert logs_line_count(str(tmpdir)) == 6  # nosec
+    assert logs_line_count(str(tmpdir), size) == 5  # nosec
+    records = list(iter_logs(str(tmpdir), 0, 5, size))
+    assert [r["msg"] for r in records] == ["line %d" % i for i in range(5)]  # nosec
+    records = list(iter_logs(str(tmpdir), 3, None, size))
+    assert [r["msg"] for r in records] == ["line 3", "line 4"]  # nosec
+
+
+def test_timings(tmpdir):
+    lines = [
+        "start: 1 tftp-deploy (timeout 00:10:00) [common]",
+        "start: 1.1 download-retry (timeout 00:10:00) [common]",
+        "end: 1.1 download-retry (duration 00:01:00) [common]",
+        "end: 1 tftp-deploy (duration 00:01:02) [common]",
+        "start: 2 auto-login-action (timeout 00:05:00) [common]",
+        "end: 10 finalize (duration 00:00:01) [common]",
+        "end: 0 validate (duration 00:00:01) [common]",
+    ]
+    data = "".join(
+        '- {"dt": "2019-11-04T15:39:52.345099", "lvl": "info", "msg": "%s"}\n' % line
+        for line in lines
+    )
+    data += '- {"dt": "2019-11-04T15:39:52.345099", "lvl": "target", "msg": "%s"}\n' % (
+        lines[0]
+    )
+    (tmpdir / "output.yaml").write_text(data, encoding="utf-8")
+
+    assert read_timings(str(tmpdir)) is None  # nosec
+    table = compute_timings(str(tmpdir))
+    assert table == [  # nosec
+        {
+            "level": "1",
+            "action": "tftp-deploy",
+            "namespace": "common",
+            "timeout": 600.0,
+            "duration": 62.0,
+        },
+        {
+            "level": "1.1",
+            "action": "download-retry",
+            "namespace": "common",
+            "timeout": 600.0,
+            "duration": 60.0,
+        },
+        {
+            "level": "2",
+            "action": "auto-login-action",
+            "namespace": "common",
+            "timeout": 300.0,
+            "duration": None,
+        },
+        {
+            "level": "10",
+            "action": "finalize",
+            "namespace": "common",
+            "timeout": None,
+            "duration": 1.0,
+        },
+    ]
+    write_timings(str(tmpdir), table)
+    assert read_timings(str(tmpdir)) == table  # nosec
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import importlib
+import pytest
+
+from django.contrib.auth.models import User
+
+from lava_results_app.models import TestCase
+from lava_scheduler_app.models import (
+    DeviceType,
+    NotificationRecipient,
+    NotificationTask,
+    TestJob,
+)
+from lava_scheduler_app import notifications
+from lava_scheduler_app.notifications import (
+    compare_results,
+    create_notification,
+    enqueue_notifications,
+)
+
+
+NOTIFY = {
+    "criteria": {"status": "finished"},
+    "recipients": [
+        {"to": {"method": "email", "email": "tester@example.com"}},
+        {"to": {"method": "irc", "handle": "tester", "server": "irc.example.com"}},
+    ],
+    "callbacks": [{"url": "https://example.com/callback/{ID}", "method": "GET"}],
+}
+
+
+@pytest.fixture
+def job(db):
+    user = User.objects.create_user(username="tester", password="tester")  # nosec
+    job = TestJob.objects.create(
+        description="test job 01",
+        submitter=user,
+        requested_device_type=DeviceType.objects.create(name="qemu"),
+        state=TestJob.STATE_FINISHED,
+        health=TestJob.HEALTH_COMPLETE,
+    )
+    create_notification(job, NOTIFY)
+    return job
+
+
+def test_enqueue_notifications(job):
+    enqueue_notifications(job)
+    tasks = NotificationTask.objects.order_by("id")
+    assert [t.endpoint for t in tasks] == [  # nosec
+        "https://example.com",
+        "smtp",
+        "irc://irc.example.com",
+    ]
+    assert all(t.state == NotificationTask.STATE_QUEUED for t in tasks)  # nosec
+    assert all(t.job_state == TestJob.STATE_FINISHED for t in tasks)  # nosec
+    assert all(t.job_health == TestJob.HEALTH_COMPLETE for t in tasks)  # nosec
+
+    # Recipients already notified are not queued again
+    NotificationTask.objects.all().delete()
+    NotificationRecipient.objects.update(status=NotificationRecipient.SENT)
+    enqueue_notifications(job)
+    assert NotificationTask.objects.count() == 1  # nosec
+
+
+def test_deliver(job, monkeypatch, settings):
+    lava_notifier = importlib.import_module(
+        "lava_server.management.commands.lava-notifier"
+    )
+    settings.NOTIFICATION_MAX_ATTEMPTS = 2
+    enqueue_notifications(job)
+    task = NotificationTask.objects.get(endpoint="smtp")
+
+    monkeypatch.setattr(notifications, "send_mail", lambda *args: 0)
+    assert lava_notifier.deliver(task.id) is False  # nosec
+    task.refresh_from_db()
+    assert task.attempts == 1  # nosec
+    assert task.state == NotificationTask.STATE_QUEUED  # nosec
+    assert task.next_attempt > task.created  # nosec
+
+    assert lava_notifier.deliver(task.id) is False  # nosec
+    task.refresh_from_db()
+    assert task.state == NotificationTask.STATE_FAILED  # nosec
+
+    monkeypatch.setattr(notifications, "send_mail", lambda *args: 1)
+    assert lava_notifier.deliver(task.id) is True  # nosec
+    assert not NotificationTask.objects.filter(id=task.id).exists()  # nosec
+    recipient = NotificationRecipient.objects.get(id=task.recipient_id)
+    assert recipient.status == NotificationRecipient.SENT  # nosec
+    assert lava_notifier.deliver(task.id) is None  # nosec
+
+
+def test_send_notification_snapshot(job, monkeypatch):
+    enqueue_notifications(job)
+    task = NotificationTask.objects.get(endpoint="smtp")
+    # The job changed before the notification was sent
+    TestJob.objects.filter(id=job.id).update(health=TestJob.HEALTH_INCOMPLETE)
+
+    sent = []
+    monkeypatch.setattr(
+        notifications,
+        "send_email_notification",
+        lambda job, recipient: sent.append((job.state, job.health)) or True,
+    )
+    assert notifications.send_notification(task) is True  # nosec
+    assert sent == [(TestJob.STATE_FINISHED, TestJob.HEALTH_COMPLETE)]  # nosec
+
+
+def test_compare_results():
+    (PASS, FAIL, SKIP) = (
+        TestCase.RESULT_PASS,
+        TestCase.RESULT_FAIL,
+        TestCase.RESULT_SKIP,
+    )
+    new_cases = [
+        (1, "smoke", "linux-linaro-ubuntu-pwd", PASS),
+        (2, "smoke", "linux-linaro-ubuntu-uname", FAIL),
+        (3, "smoke", "linux-linaro-ubuntu-vmstat", PASS),
+        (4, "smoke", "dup", PASS),
+        (5, "ltp", "syscalls", SKIP),
+        (6, "new-suite", "new-case", PASS),
+        (7, "smoke", "ignored", PASS),
+    ]
+    old_cases = [
+        (11, "smoke", "linux-linaro-ubuntu-pwd", PASS),
+        (12, "smoke", "linux-linaro-ubuntu-uname", PASS),
+        (13, "smoke", "dup", PASS),
+        (14, "smoke", "dup", FAIL),
+        (15, "ltp", "syscalls", FAIL),
+        (16, "old-suite", "old-case", PASS),
+        (17, "smoke", "removed-case", PASS),
+    ]
+    (added, removed, left, right, changed) = compare_results(
+        new_cases, old_cases, {"smoke", "ltp"}, {"ignored"}
+    )
+    assert added == [3, 6]  # nosec
+    assert removed == [16, 17]  # nosec
+    assert left == {"smoke": (4, 1, 0), "ltp": (0, 0, 1)}  # nosec
+    assert right == {"smoke": (4, 1, 0), "ltp": (0, 1, 0)}  # nosec
+    # Test cases with a duplicated name are not compared
+    assert changed == {2: PASS, 5: FAIL}  # nosec
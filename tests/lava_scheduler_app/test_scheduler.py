@@ -26,8 +26,13 @@ from django.test import TestCase
 from django.utils import timezone
 
 from tests.lava_dispatcher.utils import DummyLogger
-from lava_scheduler_app.models import Device, DeviceType, TestJob, Worker
-from lava_scheduler_app.scheduler import schedule, schedule_health_checks
+from lava_scheduler_app.models import Device, DeviceType, Tag, TestJob, Worker
+from lava_scheduler_app.scheduler import (
+    QueuedJob,
+    SchedulingIndex,
+    schedule,
+    schedule_health_checks,
+)
 
 
 def _minimal_valid_job(self):
@@ -635,3 +640,80 @@ class TestPriorities(TestCase):
         self._check_job(jobs[2], TestJob.STATE_SCHEDULED, self.device01)
         self._check_job(jobs[3], TestJob.STATE_SUBMITTED)
         self._check_job(jobs[4], TestJob.STATE_SUBMITTED)
+
+
+class TestSchedulingIndex(TestCase):
+    def setUp(self):
+        self.device_type01 = DeviceType.objects.create(name="panda")
+        self.device_type02 = DeviceType.objects.create(name="juno")
+        self.tag01 = Tag.objects.create(name="usb")
+        self.user = User.objects.create(username="user-01")
+
+    def _job(self, device_type, priority=TestJob.MEDIUM):
+        return TestJob.objects.create(
+            requested_device_type=device_type,
+            submitter=self.user,
+            definition=_minimal_valid_job(None),
+            priority=priority,
+        )
+
+    def test_order(self):
+        now = timezone.now()
+        index = SchedulingIndex()
+        index.add(QueuedJob(1, TestJob.STATE_SUBMITTED, 50, now, None, 1, "panda"))
+        index.add(QueuedJob(2, TestJob.STATE_SUBMITTED, 100, now, None, 1, "panda"))
+        index.add(QueuedJob(3, TestJob.STATE_SCHEDULING, 0, now, "g", 1, "panda"))
+        index.add(QueuedJob(4, TestJob.STATE_SUBMITTED, 50, now, None, 1, "juno"))
+        self.assertEqual([j.id for j in index.queue("panda")], [3, 2, 1])
+        self.assertEqual([j.id for j in index.queue("juno")], [4])
+        self.assertEqual(index.queue("unknown"), [])
+
+        index.remove(2)
+        index.handle_event({"job": 3, "state": "Canceling"})
+        index.handle_event({"job": 1, "state": "Submitted"})
+        self.assertEqual([j.id for j in index.queue("panda")], [1])
+        self.assertEqual(len(index), 2)
+
+    def test_match(self):
+        now = timezone.now()
+        index = SchedulingIndex()
+        index.add(QueuedJob(1, 0, 50, now, None, 1, "panda", frozenset([1])))
+        index.add(QueuedJob(2, 0, 100, now, None, 1, "panda", frozenset([2])))
+        index.add(QueuedJob(3, 0, 0, now, None, 1, "panda"))
+
+        def accept(device, job):
+            return job.tags.issubset(device)
+
+        def assign(device, job):
+            return job.id != 1
+
+        # job 2 can't run on any device, job 1 is not valid anymore
+        assigned = index.match(
+            "panda", [frozenset([1]), frozenset([1])], accept, assign
+        )
+        self.assertEqual(assigned, [3])
+        self.assertEqual([j.id for j in index.queue("panda")], [2])
+
+    def test_sync(self):
+        job01 = self._job(self.device_type01)
+        job02 = self._job(self.device_type01, TestJob.HIGH)
+        job02.tags.add(self.tag01)
+        job03 = self._job(self.device_type02)
+
+        index = SchedulingIndex()
+        self.assertEqual(index.sync(), (3, 0))
+        self.assertEqual([j.id for j in index.queue("panda")], [job02.id, job01.id])
+        self.assertEqual(index.jobs[job02.id].tags, frozenset([self.tag01.pk]))
+        self.assertEqual(index.jobs[job01.id].tags, frozenset())
+
+        # Only the given device-types are updated
+        job01.state = TestJob.STATE_CANCELING
+        job01.save()
+        job03.priority = TestJob.HIGH
+        job03.save()
+        self.assertEqual(index.sync(["juno"]), (0, 0))
+        self.assertIn(job01.id, index.jobs)
+        self.assertEqual(index.jobs[job03.id].priority, TestJob.HIGH)
+
+        self.assertEqual(index.sync(), (0, 1))
+        self.assertNotIn(job01.id, index.jobs)
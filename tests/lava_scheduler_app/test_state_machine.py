@@ -19,8 +19,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, see <http://www.gnu.org/licenses>.
 
+import datetime
+
 from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
 
 from lava_common.compat import yaml_safe_dump
 from lava_scheduler_app.models import Device, DeviceType, TestJob, Worker
@@ -506,6 +509,23 @@ class TestTestJobStateMachine(TestCase):
         self.check_device(Device.STATE_RUNNING, Device.HEALTH_UNKNOWN)
         self.check_job(TestJob.STATE_RUNNING, TestJob.HEALTH_UNKNOWN)
 
+    def test_job_go_state_finished_duration(self):
+        self.job.state = TestJob.STATE_RUNNING
+        self.job.start_time = timezone.now() - datetime.timedelta(seconds=62.5)
+        self.job.save()
+        self.job.go_state_finished(TestJob.HEALTH_COMPLETE)
+        self.job.save()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.duration, datetime.timedelta(seconds=62))
+
+    def test_job_set_error(self):
+        self.job.set_error("Infrastructure" * 3, "error message")
+        self.job.save()
+        self.job.refresh_from_db()
+        max_length = TestJob._meta.get_field("error_type").max_length
+        self.assertEqual(self.job.error_type, ("Infrastructure" * 3)[:max_length])
+        self.assertEqual(self.job.error_msg, "error message")
+
     def test_job_go_state_finished_health_check(self):
         # Normal case
         # 1/ STATE_RUNNING => STATE_FINISHED
@@ -26,6 +26,8 @@ from django.http import Http404
 from django.urls import reverse
 from django.utils import timezone
 
+from lava_common.compat import yaml_load
+
 from lava_scheduler_app.models import (
     Alias,
     Device,
@@ -35,12 +37,8 @@ from lava_scheduler_app.models import (
     TestJobUser,
     Worker,
 )
-from lava_scheduler_app.views import (
-    type_report_data,
-    device_report_data,
-    job_report,
-    get_restricted_job,
-)
+from lava_scheduler_app.dbutils import job_report_matrix, job_reports
+from lava_scheduler_app.views import get_restricted_job
 
 
 JOB_DEFINITION = """
@@ -422,15 +420,22 @@ def test_job_status(client, setup):
 @pytest.mark.django_db
 def test_job_timing(client, monkeypatch, setup):
     monkeypatch.setattr(
-        "lava_scheduler_app.views.read_logs",
-        lambda dir_name: """
+        "lava_scheduler_app.logutils.iter_logs",
+        lambda dir_name: iter(
+            yaml_load(
+                """
 - {"dt": "2019-11-05T09:06:14.952630", "lvl": "debug", "msg": "start: 1.1 deploy-device-env (timeout 00:03:52) [common]"}
 - {"dt": "2019-11-05T09:06:14.953059", "lvl": "debug", "msg": "end: 1.1 deploy-device-env (duration 00:00:10) [common]"}
-""",
+"""
+            )
+        ),
     )
     job_1 = TestJob.objects.get(description="test job 01")
     ret = client.post(reverse("lava.scheduler.job.timing", args=[job_1.pk]))
     assert ret.status_code == 200  # nosec
+    assert ret.json()["graph"] == [
+        ["1.1", "deploy-device-env", 10.0, 232.0, False]
+    ]  # nosec
 
 
 @pytest.mark.django_db
@@ -480,17 +485,23 @@ def test_job_log_incremental_large_file(client, monkeypatch, setup):
 def test_job_log_incremental(client, monkeypatch, setup):
     monkeypatch.setattr("lava_scheduler_app.views.size_logs", lambda dir_name: 100)
     monkeypatch.setattr(
-        "lava_scheduler_app.views.read_logs",
-        lambda dir_name, first_line: """
+        "lava_scheduler_app.views.iter_logs",
+        lambda dir_name, first_line: iter(
+            yaml_load(
+                """
 - {"dt": "2019-11-04T15:39:52.345099", "lvl": "results", "msg": {"case": "validate", "definition": "lava", "result": "pass"}}
 - {"dt": "2019-11-04T15:39:52.345794", "lvl": "info", "msg": "start: 1 lxc-deploy (timeout 00:05:00) [tlxc]"}
-""",
+"""
+            )
+        ),
     )
     job_1 = TestJob.objects.get(description="test job 01")
     ret = client.post(reverse("lava.scheduler.job.log_incremental", args=[job_1.pk]))
     assert ret.status_code == 200  # nosec
     assert ret["X-Is-Finished"] == "1"  # nosec
-    assert ret.json()[0]["msg"]["result"] == "pass"
+    data = simplejson.loads(b"".join(ret.streaming_content).decode("utf-8"))
+    assert data[0]["msg"]["result"] == "pass"  # nosec
+    assert len(data) == 2  # nosec
 
 
 @pytest.mark.django_db
@@ -980,52 +991,33 @@ def test_worker_detail(client, setup):
 
 
 @pytest.mark.django_db
-def test_type_report_data_start_day_after_end_day(client, setup):
-    dt = DeviceType.objects.get(name="qemu")
-    result = type_report_data(5, 3, dt, False)
-    # Assure there's no result for disambigous dates
-    assert result["fail"] == 0  # nosec
-    assert result["pass"] == 0  # nosec
-
-
-@pytest.mark.django_db
-def test_type_report_data(client, setup):
-    dt = DeviceType.objects.get(name="juno")
-    result = type_report_data(-1, 1, dt, False)
-    assert result["fail"] == 1  # nosec
-    assert result["pass"] == 1  # nosec
-
-
-@pytest.mark.django_db
-def test_device_report_data_start_day_after_end_day(client, setup):
-    juno = Device.objects.get(hostname="juno-01")
-    result = device_report_data(5, 3, juno, False)
-    # Assure there's no result for disambigous dates
-    assert result["fail"] == 0  # nosec
-    assert result["pass"] == 0  # nosec
-
-
-@pytest.mark.django_db
-def test_device_report_data(client, setup):
-    juno = Device.objects.get(hostname="juno-01")
-    result = device_report_data(-1, 1, juno, False)
-    assert result["fail"] == 1  # nosec
-    assert result["pass"] == 1  # nosec
-
-
-@pytest.mark.django_db
-def test_job_report_start_day_after_end_day(client, setup):
-    result = job_report(5, 3, False)
-    # Assure there's no result for disambigous dates
-    assert result["fail"] == 0  # nosec
-    assert result["pass"] == 0  # nosec
-
+def test_job_reports(client, setup):
+    for reports in [
+        job_reports(),
+        job_reports(device_type=DeviceType.objects.get(name="juno")),
+        job_reports(device=Device.objects.get(hostname="juno-01")),
+    ]:
+        assert len(reports["job_day_report"]) == 7  # nosec
+        assert len(reports["job_week_report"]) == 10  # nosec
+        for key in ["job_day_report", "job_week_report"]:
+            assert reports[key][-1]["pass"] == 1  # nosec
+            assert reports[key][-1]["fail"] == 1  # nosec
+            # Assure there's no result for older dates
+            assert reports[key][0]["pass"] == 0  # nosec
+            assert reports[key][0]["fail"] == 0  # nosec
+        assert reports["health_day_report"][-1]["pass"] == 0  # nosec
+        assert reports["health_week_report"][-1]["fail"] == 0  # nosec
+
+    reports = job_reports(device_type=DeviceType.objects.get(name="qemu"))
+    assert reports["job_day_report"][-1]["pass"] == 0  # nosec
+    assert reports["job_day_report"][-1]["fail"] == 0  # nosec
+    assert reports["job_day_report"][-1]["failure_url"].endswith(  # nosec
+        "?start=-1&end=0&device_type=qemu&health_check=0"
+    )
 
-@pytest.mark.django_db
-def test_job_report(client, setup):
-    result = job_report(-1, 1, False)
-    assert result["fail"] == 1  # nosec
-    assert result["pass"] == 1  # nosec
+    (_, matrix) = job_report_matrix(device=Device.objects.get(hostname="juno-01"))
+    assert len(matrix["jobs"]) == 70  # nosec
+    assert matrix["jobs"][0] == {"pass": 1, "fail": 1}  # nosec
 
 
 @pytest.mark.django_db
@@ -23,7 +23,14 @@ import xmlrpc.client
 from django.contrib.auth.models import Group, User
 
 from lava_common.decorators import nottest
-from lava_scheduler_app.models import Device, DeviceType, Worker
+from lava_scheduler_app.models import (
+    Device,
+    DeviceType,
+    GroupDevicePermission,
+    GroupDeviceTypePermission,
+    TestJob,
+    Worker,
+)
 from tests.lava_scheduler_app.test_api import TestTransport
 
 
@@ -221,3 +228,41 @@ class TestLavaServerApi:
         assert (  # nosec
             self.user2.has_perm("lava_scheduler_app.view_device", self.device1) == False
         )
+
+    def test_user_can_view_and_submit(self):
+        user = self.ensure_user("test", "test@mail.net", "test")
+        server = self.server_proxy("test", "test")
+        device_type2 = DeviceType.objects.create(name="device_type2")
+        device2 = Device.objects.create(
+            hostname="restricted01", device_type=device_type2, worker_host=self.worker1
+        )
+        GroupDevicePermission.objects.assign_perm("view_device", self.group, device2)
+        GroupDeviceTypePermission.objects.assign_perm(
+            "submit_to_devicetype", self.group, self.device_type1
+        )
+        job1 = TestJob.objects.create(
+            submitter=self.user1, requested_device_type=self.device_type1
+        )
+        job2 = TestJob.objects.create(submitter=self.user1, actual_device=device2)
+        job3 = TestJob.objects.create(submitter=user, actual_device=device2)
+        TestJob.objects.update(is_public=True)
+
+        assert server.system.user_can_view_jobs(  # nosec
+            [job1.id, str(job2.id), job3.id, 99999]
+        ) == {str(job1.id): True, str(job2.id): True, str(job3.id): True}
+        assert server.system.user_can_view_devices(  # nosec
+            ["public01", "restricted01", "unknown"]
+        ) == {
+            "device_type1": [
+                {"public01": {"is_pipeline": True, "visible": True, "exclusive": True}}
+            ],
+            "device_type2": [{"restricted01": {"visible": False}}],
+        }
+        assert server.system.user_can_submit_to_types(  # nosec
+            ["device_type1", "device_type2", "unknown"]
+        ) == {"device_type1": False, "device_type2": False}
+
+        user.groups.add(self.group)
+        assert server.system.user_can_submit_to_types(  # nosec
+            ["device_type1", "device_type2"]
+        ) == {"device_type1": True, "device_type2": False}
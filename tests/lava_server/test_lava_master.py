@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import importlib
+import logging
+
+from django.contrib.auth.models import User
+
+from lava_scheduler_app.models import Device, DeviceType, TestJob, Worker
+
+
+def test_start_jobs_error(db, monkeypatch):
+    lava_master = importlib.import_module("lava_server.management.commands.lava-master")
+    user = User.objects.create_user(username="tester", password="tester")  # nosec
+    worker = Worker.objects.create(hostname="worker-01", state=Worker.STATE_ONLINE)
+    device_type = DeviceType.objects.create(name="qemu")
+    device = Device.objects.create(
+        hostname="qemu-01",
+        device_type=device_type,
+        worker_host=worker,
+        state=Device.STATE_RESERVED,
+        health=Device.HEALTH_GOOD,
+    )
+    job = TestJob.objects.create(
+        definition="job_name: test",
+        submitter=user,
+        requested_device_type=device_type,
+        actual_device=device,
+        state=TestJob.STATE_SCHEDULED,
+    )
+
+    def start_job(job):
+        raise OSError(errno.ENOENT, "No such file or directory", "device.jinja2")
+
+    cmd = lava_master.Command()
+    cmd.logger = logging.getLogger("lava-master")
+    monkeypatch.setattr(cmd, "start_job", start_job)
+    cmd.start_jobs()
+
+    job.refresh_from_db()
+    assert job.state == TestJob.STATE_FINISHED  # nosec
+    assert job.health == TestJob.HEALTH_INCOMPLETE  # nosec
+    assert job.error_type == "Infrastructure"  # nosec
+    # The lava.job result is counted, even if the job was loaded before
+    assert (job.count_fail, job.count_total) == (1, 1)  # nosec